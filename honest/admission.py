@@ -0,0 +1,209 @@
+"""
+admission control for the endpoints that write.
+
+SQLite takes one writer at a time and any database slows down for everyone when writes pile up, so during a spike
+posting reviews, people, categories and areas or registering is better turned away straight away than left queueing
+for the database while the pages everyone is reading wait behind it. each endpoint in HONEST_ADMISSION_LIMITS takes
+at most `concurrency` write requests at a time over all the workers, more get a 503, and each client gets a token
+bucket per endpoint holding up to `burst` requests and refilling at `rate` a second, an empty bucket gets a 429.
+both come back with a Retry-After. reads are never held back.
+
+the counts and buckets are shared by every worker of a server through HONEST_ADMISSION_FILE, mapped into memory by
+each of them and changed only under an exclusive fcntl lock on the file:
+
+- a slot per worker process, holding its pid and how many requests it is handling on each endpoint. a worker that
+  dies mid-request can't give its count back, so the slots of pids no longer running are cleared and reused.
+- a hash table of buckets keyed by a hash of endpoint and client address, each with its tokens and when they were
+  last counted. a client whose probe sequence is full takes the bucket used longest ago, a full one by then.
+
+a server that can't use the file, or runs more workers than there are slots, admits everything rather than failing.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+WORKER_SLOTS = 64
+ENDPOINTS = 16
+BUCKET_SLOTS = 4096
+# buckets looked at for a client before one is taken over
+PROBES = 8
+# pid, then requests in progress per endpoint
+WORKER = struct.Struct('q{0}i'.format(ENDPOINTS))
+# key, tokens, time they were counted at
+BUCKET = struct.Struct('Qdd')
+SIZE = WORKER_SLOTS * WORKER.size + BUCKET_SLOTS * BUCKET.size
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def bucket_key(endpoint, client):
+    digest = hashlib.blake2b('{0} {1}'.format(endpoint, client).encode(), digest_size=8).digest()
+    # 0 marks an unused bucket
+    return int.from_bytes(digest, 'little') | 1
+
+
+class AdmissionControl:
+
+    def __init__(self):
+        # fcntl locks are held per process, threads of one process take turns on this first
+        self._lock = threading.Lock()
+        self._pid = self._path = self._fd = self._map = self._slot = None
+
+    def path(self):
+        return getattr(settings, 'HONEST_ADMISSION_FILE', os.path.join(tempfile.gettempdir(), 'honest-admission'))
+
+    def limits(self):
+        return getattr(settings, 'HONEST_ADMISSION_LIMITS', {})
+
+    def _open(self):
+        """maps the file, again in a forked worker or when the setting changed"""
+        path = self.path()
+        if self._map is not None and self._pid == os.getpid() and self._path == path:
+            return
+        self.close()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < SIZE:
+                    # the new space reads as zeroes, unused slots and buckets
+                    os.ftruncate(fd, SIZE)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, SIZE)
+        except Exception:
+            os.close(fd)
+            raise
+        self._pid, self._path, self._fd, self._slot = os.getpid(), path, fd, None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+        self._map = self._fd = None
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self._open()
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def admit(self, endpoint, client, now=None):
+        """None if the request may go ahead, and then leave(endpoint) must follow it, otherwise the status to
+        turn it away with and the seconds to retry after"""
+        limit = self.limits()[endpoint]
+        index = sorted(self.limits()).index(endpoint)
+        now = time.time() if now is None else now
+        try:
+            with self._locked():
+                if self._in_flight(index) >= limit['concurrency']:
+                    return 503, 1
+                wait = self._take_token(bucket_key(endpoint, client), limit['rate'], limit['burst'], now)
+                if wait:
+                    return 429, math.ceil(wait)
+                self._add(index, 1)
+        except OSError:
+            # without the shared file there are no limits
+            pass
+        return None
+
+    def leave(self, endpoint):
+        index = sorted(self.limits()).index(endpoint)
+        try:
+            with self._locked():
+                self._add(index, -1)
+        except OSError:
+            pass
+
+    def _in_flight(self, index):
+        total = 0
+        for slot in range(WORKER_SLOTS):
+            values = WORKER.unpack_from(self._map, slot * WORKER.size)
+            pid, count = values[0], values[1 + index]
+            if not count:
+                continue
+            if pid != self._pid and not alive(pid):
+                WORKER.pack_into(self._map, slot * WORKER.size, *[0] * (1 + ENDPOINTS))
+                continue
+            total += count
+        return total
+
+    def _worker_slot(self):
+        """this process's slot, claimed the first time it is needed. None when every slot is in use"""
+        if self._slot is None:
+            slots = [WORKER.unpack_from(self._map, slot * WORKER.size)[0] for slot in range(WORKER_SLOTS)]
+            free = [slot for slot, pid in enumerate(slots) if pid == 0 or pid != self._pid and not alive(pid)]
+            if self._pid in slots:
+                self._slot = slots.index(self._pid)
+            elif free:
+                self._slot = free[0]
+                WORKER.pack_into(self._map, self._slot * WORKER.size, self._pid, *[0] * ENDPOINTS)
+        return self._slot
+
+    def _add(self, index, delta):
+        slot = self._worker_slot()
+        if slot is None:
+            return
+        values = list(WORKER.unpack_from(self._map, slot * WORKER.size))
+        values[1 + index] = max(0, values[1 + index] + delta)
+        WORKER.pack_into(self._map, slot * WORKER.size, *values)
+
+    def _take_token(self, key, rate, burst, now):
+        """takes a token from the bucket, returning 0, or the seconds until there will be one"""
+        buckets = WORKER_SLOTS * WORKER.size
+        start = key % BUCKET_SLOTS
+        oldest = None
+        for probe in range(PROBES):
+            offset = buckets + (start + probe) % BUCKET_SLOTS * BUCKET.size
+            found, tokens, counted = BUCKET.unpack_from(self._map, offset)
+            if found == key:
+                tokens = min(burst, tokens + (now - counted) * rate)
+                break
+            if found == 0:
+                tokens = burst
+                break
+            if oldest is None or counted < oldest[1]:
+                oldest = offset, counted
+        else:
+            offset, tokens = oldest[0], burst
+        if tokens < 1:
+            BUCKET.pack_into(self._map, offset, key, tokens, now)
+            return (1 - tokens) / rate
+        BUCKET.pack_into(self._map, offset, key, tokens - 1, now)
+        return 0
+
+
+def client_address(request):
+    """the address of whoever sent the request. behind HONEST_TRUSTED_PROXIES proxies, each appending the address
+    it got the request from to X-Forwarded-For, that is the one the furthest of them appended, anything before it
+    was sent by the client and can't be trusted"""
+    proxies = getattr(settings, 'HONEST_TRUSTED_PROXIES', 0)
+    forwarded = [address.strip() for address in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+    forwarded = [address for address in forwarded if address]
+    if proxies and len(forwarded) >= proxies:
+        return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+control = AdmissionControl()
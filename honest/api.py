@@ -0,0 +1,138 @@
+"""
+read-only json api, version 1.
+
+every resource is a list of rows serialized straight from .values(), ordered by id and paged with a cursor. the
+fields query parameter picks which fields come back (only those columns are selected), and list filters narrow
+the rows down by category or area slug, ?area= to the area itself and ?within= to it and every area inside it.
+people can also be ordered best ranked first with ?ordering=score, which with the filters gives the leaderboard of
+a category, an area or both. responses carry an ETag so clients can poll with If-None-Match.
+"""
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+
+from honest.models import Area, Category, Person, Review
+from honest.pagination import InvalidCursor, keyset_paginate
+from honest.ranking import LEADERBOARD_ORDERING
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# public field name -> model field or lookup, filter parameter -> lookup and ordering parameter -> model ordering,
+# for each resource. every ordering ends in id so it can be paged by keyset
+RESOURCES = {
+    'categories': {
+        'model': Category,
+        'fields': {'id': 'id', 'name': 'category', 'slug': 'slug', 'views': 'views'},
+        'filters': {},
+        'orderings': {'id': ['id']},
+    },
+    'areas': {
+        'model': Area,
+        'fields': {'id': 'id', 'name': 'state', 'slug': 'slug', 'views': 'views', 'parent': 'parent__slug'},
+        'filters': {'parent': 'parent__slug'},
+        'orderings': {'id': ['id']},
+    },
+    'people': {
+        'model': Person,
+        'fields': {'id': 'id', 'first_name': 'first_name', 'last_name': 'last_name',
+                   'phone_number': 'phone_number', 'email': 'email', 'category': 'service_slug',
+                   'area': 'location_slug', 'rating': 'rating', 'review_count': 'review_count',
+                   'upvotes': 'upvotes', 'downvotes': 'downvotes', 'score': 'score', 'views': 'views',
+                   'date_added': 'date_added'},
+        'filters': {'category': 'service__slug', 'area': 'location__slug',
+                    'within': 'location__ancestor_links__ancestor__slug'},
+        'orderings': {'id': ['id'], 'score': LEADERBOARD_ORDERING},
+    },
+    'reviews': {
+        'model': Review,
+        'fields': {'id': 'id', 'person': 'person_id', 'rating': 'rating', 'summary': 'summary',
+                   'review_text': 'review_text', 'date_added': 'date_added'},
+        'filters': {'person': 'person_id', 'category': 'person__service__slug', 'area': 'person__location__slug',
+                    'within': 'person__location__ancestor_links__ancestor__slug'},
+        'orderings': {'id': ['id']},
+    },
+}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+def parse_fields(request, resource):
+    """the public field names asked for with ?fields=a,b, all of them by default"""
+    fields = request.GET.get('fields')
+    if not fields:
+        return list(resource['fields'])
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in resource['fields']]
+    if unknown:
+        raise BadRequest("unknown fields: {0}".format(', '.join(unknown)))
+    return fields
+
+
+def parse_ordering(request, resource):
+    ordering = request.GET.get('ordering', 'id')
+    if ordering not in resource['orderings']:
+        raise BadRequest("ordering must be one of: {0}".format(', '.join(resource['orderings'])))
+    return resource['orderings'][ordering]
+
+
+def parse_limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("limit must be a number")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def page_url(request, cursor):
+    if cursor is None:
+        return None
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return request.build_absolute_uri('?' + query.urlencode())
+
+
+@require_safe
+def resource_list(request, resource_name):
+    resource = RESOURCES.get(resource_name)
+    if resource is None:
+        raise Http404("No such resource")
+
+    try:
+        fields = parse_fields(request, resource)
+        limit = parse_limit(request)
+        ordering = parse_ordering(request, resource)
+        queryset = resource['model'].objects.filter(**{
+            lookup: request.GET[parameter] for parameter, lookup in resource['filters'].items()
+            if parameter in request.GET})
+        # the ordering's fields are always selected, the cursor is built from them
+        lookups = [field.lstrip('-') for field in ordering]
+        lookups += [resource['fields'][field] for field in fields if resource['fields'][field] not in lookups]
+        page = keyset_paginate(queryset.values(*lookups), ordering, cursor=request.GET.get('cursor'), per_page=limit)
+    except BadRequest as problem:
+        return error(str(problem))
+    except (InvalidCursor, ValueError):
+        return error("invalid cursor or filter value")
+
+    body = json.dumps({
+        'results': [{field: row[resource['fields'][field]] for field in fields} for row in page],
+        'next': page_url(request, page.next_cursor),
+        'previous': page_url(request, page.previous_cursor),
+    }, cls=DjangoJSONEncoder)
+
+    etag = quote_etag(hashlib.md5(body.encode('utf-8')).hexdigest())
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    return get_conditional_response(request, etag=etag, response=response)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class HonestConfig(AppConfig):
     name = 'honest'
+
+    def ready(self):
+        # connect signal receivers that keep denormalized data in step with the models
+        from honest import signals  # noqa: F401
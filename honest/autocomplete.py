@@ -0,0 +1,86 @@
+"""
+prefix autocomplete for category and area names, answered from memory.
+
+each worker keeps a sorted list of lower cased name suffixes that start at a word boundary, so "dev" finds
+"Web Developer", and looks prefixes up with bisect. the lists are built when the worker starts (see wsgi.py) and
+rebuilt when the taxonomy generation moves on, which post_save/post_delete on Category and Area take care of in
+every worker sharing the cache (see honest/caching.py).
+"""
+import bisect
+import re
+import threading
+
+from django.db import DatabaseError
+
+from honest.caching import TAXONOMY, get_generation
+from honest.models import Area, Category
+from honest.routers import reading_primary
+
+
+class PrefixIndex:
+
+    def __init__(self, entries):
+        """entries is an iterable of (name, slug)"""
+        keys = []
+        for name, slug in entries:
+            for match in re.finditer(r'\w+', name):
+                keys.append((name[match.start():].lower(), name, slug))
+        keys.sort()
+        self.keys = keys
+        self.prefixes = [key for key, name, slug in keys]
+
+    def complete(self, prefix, limit=10):
+        """[(name, slug)] of names with a word starting with prefix, in alphabetical order of the match"""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        results, seen = [], set()
+        position = bisect.bisect_left(self.prefixes, prefix)
+        while position < len(self.keys) and self.prefixes[position].startswith(prefix) and len(results) < limit:
+            key, name, slug = self.keys[position]
+            if slug not in seen:
+                seen.add(slug)
+                results.append((name, slug))
+            position += 1
+        return results
+
+
+class Autocompleter:
+    """the prefix index of one model's names, rebuilt whenever the taxonomy generation changes"""
+
+    def __init__(self, model, name_field):
+        self.model = model
+        self.name_field = name_field
+        self._lock = threading.Lock()
+        self._index = None
+        self._generation = None
+
+    def index(self):
+        generation = get_generation(TAXONOMY)
+        if self._index is None or generation != self._generation:
+            with self._lock, reading_primary():
+                entries = self.model.objects.order_by().values_list(self.name_field, 'slug')
+                self._index, self._generation = PrefixIndex(entries), generation
+        return self._index
+
+    def complete(self, prefix, limit=10):
+        return self.index().complete(prefix, limit)
+
+    def invalidate(self):
+        self._index = None
+
+
+AUTOCOMPLETERS = {
+    'categories': Autocompleter(Category, 'category'),
+    'areas': Autocompleter(Area, 'state'),
+}
+
+
+def warm():
+    """builds every index up front so the first person to type doesn't wait for it"""
+    try:
+        for autocompleter in AUTOCOMPLETERS.values():
+            autocompleter.index()
+    except DatabaseError:
+        # tables don't exist yet, e.g. before the first migrate, the indexes get built on first use instead
+        pass
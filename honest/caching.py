@@ -0,0 +1,184 @@
+"""
+cache helpers shared by the parts of honest that keep derived data around between requests.
+
+a generation is a counter in the shared cache that is bumped whenever the data it stands for changes. anything
+built from that data remembers the generation it was built at and rebuilds itself once the counter moves on, which
+keeps copies held in each worker process coherent without the workers talking to each other.
+
+that only holds while every worker uses the same cache, the redis server at REDIS_URL, see settings.py. without it
+each process falls back to a cache of its own and sees only its own bumps, fine for runserver but not for several
+gunicorn workers, which would go on serving pages and in-memory copies another worker has made stale.
+"""
+import hashlib
+import re
+import time
+from functools import wraps
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from honest.counters import view_counts
+from honest.middleware import get_visitor_id
+from honest.routers import reading_primary
+
+GENERATION_KEY = 'honest:generation:{0}'
+
+# categories and areas, their names, slugs and hierarchy
+TAXONOMY = 'taxonomy'
+
+
+def get_generation(name):
+    return cache.get(GENERATION_KEY.format(name), 0)
+
+
+def bump_generation(name):
+    """marks everything built from name as stale in every worker"""
+    key = GENERATION_KEY.format(name)
+    # a generation that was evicted or cleared starts again from the clock rather than from 0, so it can't count
+    # back up to a value that something built before the eviction still remembers
+    cache.add(key, generation_seed(), None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the key was evicted between add and incr
+        cache.set(key, generation_seed(), None)
+
+
+def generation_seed():
+    return int(time.time() * 1000000)
+
+
+# the home page's top 10 categories and areas by views, refreshed when views are flushed or either model changes
+HOME_PAGE_KEY = 'honest:home-page:top'
+
+PAGE_KEY = 'honest:page:{0}'
+
+# holes are the per user parts of a page: while a page is rendered for the cache each {% hole %} tag leaves a
+# marker in its place, and the marker is replaced with that hole's template rendered for whoever asks for the page
+HOLE_MARKER = '<!--honest:hole:{0}-->'
+HOLE_MARKER_PATTERN = re.compile(r'<!--honest:hole:(\w+)-->')
+HOLE_TEMPLATE = 'honest/holes/{0}.html'
+
+
+def category_page(category_slug):
+    """generations the category page depends on, the view's keyword arguments go in"""
+    return ['category:{0}'.format(category_slug)]
+
+
+def area_page(area_slug):
+    return ['area:{0}'.format(area_slug)]
+
+
+def category_in_area_page(area_slug, category_slug):
+    return ['category-in-area:{0}:{1}'.format(area_slug, category_slug)]
+
+
+def person_page(person_id, **slugs):
+    # the slugs in a person's url don't change what the page shows
+    return ['person:{0}'.format(person_id)]
+
+
+def pages_showing_person(person_id, category_slug, area_slugs):
+    """generations of every page a person appears on, bumped when the person or their reviews change. area_slugs
+    are the person's area and every area it is inside, whose pages list the person too"""
+    pages = person_page(person_id) + category_page(category_slug)
+    for area_slug in area_slugs:
+        pages += area_page(area_slug) + category_in_area_page(area_slug, category_slug)
+    return pages
+
+
+def bump_generations(names):
+    for name in names:
+        bump_generation(name)
+
+
+def record_page_view(request, object):
+    """notes that the page being rendered counts a view of object, so the view is counted again on cache hits"""
+    if not hasattr(request, '_page_views'):
+        request._page_views = []
+    request._page_views.append((object._meta.label_lower, object.pk))
+
+
+def cache_page_shell(versions):
+    """decorator caching the shared shell of a view's page for GET requests from anyone, logged in or not.
+
+    the shell is rendered once with the per user parts left as holes (see honest.templatetags.honest_tags) and
+    each request fills the holes for its own user, so logged in users hit the cache as often as anonymous ones.
+
+    versions takes the view's keyword arguments and returns the names of the generations the page depends on,
+    shells are cached under a key made from the path, the pagination cursor and the current value of those
+    generations and the taxonomy, so bumping one of them drops exactly the pages that show it. the cursor is the only
+    query parameter the views read, any other, like a campaign's ?utm_source=, gets the same page from the cache. responses carry an ETag and Last-Modified and
+    conditional requests get a 304 Not Modified."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            names = [TAXONOMY] + versions(**kwargs)
+            generations = cache.get_many([GENERATION_KEY.format(name) for name in names])
+            fingerprint = request.path + '?cursor=' + request.GET.get('cursor', '') + repr(
+                [generations.get(GENERATION_KEY.format(name), 0) for name in names])
+            key = PAGE_KEY.format(hashlib.md5(fingerprint.encode('utf-8')).hexdigest())
+
+            entry = cache.get(key)
+            if entry is None:
+                request.punch_holes = True
+                try:
+                    with reading_primary():
+                        response = view(request, *args, **kwargs)
+                finally:
+                    # an error page rendered for the request fills its holes in
+                    request.punch_holes = False
+                if response.status_code != 200 or response.streaming:
+                    return response
+                content = response.content.decode(response.charset)
+                entry = {
+                    'content': content,
+                    'content_type': response['Content-Type'],
+                    'hash': hashlib.md5(content.encode('utf-8')).hexdigest(),
+                    'last_modified': int(time.time()),
+                    'views': getattr(request, '_page_views', []),
+                }
+                cache.set(key, entry, getattr(settings, 'HONEST_PAGE_CACHE_TIMEOUT', 300))
+            else:
+                # views of a cached page are still counted, the buffer doesn't touch the database
+                for label, pk in entry['views']:
+                    view_counts.add(apps.get_model(label), pk, visitor=get_visitor_id(request))
+
+            return cached_response(request, entry)
+        return wrapper
+    return decorator
+
+
+def cached_response(request, entry):
+    """the page's shell with its holes filled for this request, or a 304 if the requester's copy is current"""
+    fragments = {}
+
+    def fill(match):
+        name = match.group(1)
+        if name not in fragments:
+            fragments[name] = render_to_string(HOLE_TEMPLATE.format(name), request=request)
+        return fragments[name]
+
+    content = HOLE_MARKER_PATTERN.sub(fill, entry['content'])
+
+    # holes only depend on who the user is and their csrf secret, a fresh csrf token is masked differently every
+    # time but the one a browser already has stays valid for as long as its csrf cookie does
+    etag = '{0}:{1}:{2}'.format(entry['hash'], request.user.pk, request.META.get('CSRF_COOKIE', ''))
+    etag = quote_etag(hashlib.md5(etag.encode('utf-8')).hexdigest())
+
+    response = HttpResponse(content, content_type=entry['content_type'])
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    patch_vary_headers(response, ['Cookie'])
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True)
+    return get_conditional_response(request, etag=etag, last_modified=entry['last_modified'], response=response)
@@ -0,0 +1,155 @@
+"""
+write-behind buffer for page view counts.
+
+page views are added up in memory per worker process and written to the views column of Category, Area and Person
+in one batched UPDATE per model, along with the HyperLogLog sketch of each object's unique visitors, either when
+HONEST_VIEW_COUNT_FLUSH_THRESHOLD views are pending or when the first view after HONEST_VIEW_COUNT_FLUSH_INTERVAL
+seconds arrives. pending counts are also written when the worker exits normally and when the flush_view_counts
+command asks for it.
+
+crash rule: a worker that is killed without exiting cleanly loses the views it hasn't written yet. while flushes
+succeed that is at most HONEST_VIEW_COUNT_FLUSH_THRESHOLD - 1 views per worker process, but a flush that fails puts
+its counts back for the next one, so while the database refuses the writes the backlog, and what a crash would lose,
+keeps growing. nothing else is lost.
+
+the flush_view_counts command reaches the workers through the shared cache (see honest/caching.py), a worker
+without it never sees the request.
+
+sketches are merged into the stored ones by taking the larger of each register, so only rows whose sketch actually
+changed are written, and a sketch can only change a bounded number of times however many visits it sees.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BinaryField, Case, F, IntegerField, Value, When
+from django.dispatch import Signal
+
+from honest.hll import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+# sent after pending counts reach the database, counts is {model: {pk: views added}}
+view_counts_flushed = Signal(providing_args=['counts'])
+
+# cache key bumped by the flush_view_counts command, workers flush when they see it change
+FLUSH_REQUEST_KEY = 'honest:view-counts:flush-request'
+
+# how many objects go in one UPDATE statement
+UPDATE_BATCH_SIZE = 500
+
+
+class ViewCountBuffer:
+    """collects view increments per (model, pk) and flushes them to the views column in batches"""
+
+    def __init__(self, threshold, interval, poll_interval=1):
+        self.threshold = threshold
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._sketches = {}
+        self._pending = 0
+        self._last_flush = self._last_poll = time.monotonic()
+        self._flush_request = None
+
+    def add(self, model, pk, count=1, visitor=None):
+        """records count views of one object by visitor (a visitor id, optional), flushing if the buffer is due"""
+        with self._lock:
+            model_counts = self._counts.setdefault(model, {})
+            model_counts[pk] = model_counts.get(pk, 0) + count
+            self._pending += count
+            if visitor is not None:
+                model_sketches = self._sketches.setdefault(model, {})
+                model_sketches.setdefault(pk, HyperLogLog()).add(visitor)
+        if self.flush_due():
+            self.flush()
+
+    def pending(self):
+        """number of views recorded but not yet written"""
+        return self._pending
+
+    def flush_due(self):
+        now = time.monotonic()
+        if self._pending >= self.threshold or now - self._last_flush >= self.interval:
+            return True
+        if now - self._last_poll >= self.poll_interval:
+            # check now and again whether the flush_view_counts command asked every worker to flush
+            self._last_poll = now
+            flush_request = cache.get(FLUSH_REQUEST_KEY)
+            if flush_request != self._flush_request:
+                self._flush_request = flush_request
+                return True
+        return False
+
+    def flush(self):
+        """writes every pending count to the database, returns {model: {pk: views added}}"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            sketches, self._sketches = self._sketches, {}
+            self._pending = 0
+            self._last_flush = time.monotonic()
+        if not counts:
+            return counts
+
+        try:
+            with transaction.atomic():
+                for model, model_counts in counts.items():
+                    # rows are always updated in primary key order so concurrent flushes can't deadlock
+                    pks = sorted(model_counts)
+                    for start in range(0, len(pks), UPDATE_BATCH_SIZE):
+                        batch = pks[start:start + UPDATE_BATCH_SIZE]
+                        increments = Case(*[When(pk=pk, then=Value(model_counts[pk])) for pk in batch],
+                                          default=Value(0), output_field=IntegerField())
+                        model.objects.filter(pk__in=batch).update(views=F('views') + increments)
+                for model, model_sketches in sketches.items():
+                    self._merge_sketches(model, model_sketches)
+        except Exception:
+            # keep the counts for the next flush rather than dropping them with the failed request
+            logger.exception("could not flush page view counts, will retry")
+            with self._lock:
+                for model, model_counts in counts.items():
+                    for pk, count in model_counts.items():
+                        self._counts.setdefault(model, {})
+                        self._counts[model][pk] = self._counts[model].get(pk, 0) + count
+                        self._pending += count
+                for model, model_sketches in sketches.items():
+                    for pk, sketch in model_sketches.items():
+                        self._sketches.setdefault(model, {}).setdefault(pk, HyperLogLog()).merge(sketch)
+            return {}
+
+        view_counts_flushed.send(sender=self.__class__, counts=counts)
+        return counts
+
+    def _merge_sketches(self, model, model_sketches):
+        """merges buffered visitor sketches into the stored ones, writing only the sketches that changed"""
+        pks = sorted(model_sketches)
+        for start in range(0, len(pks), UPDATE_BATCH_SIZE):
+            batch = pks[start:start + UPDATE_BATCH_SIZE]
+            changed = {}
+            stored_sketches = model.objects.select_for_update().filter(pk__in=batch).order_by('pk').values_list(
+                'pk', 'visitors_hll')
+            for pk, stored in stored_sketches:
+                sketch = HyperLogLog(stored)
+                if sketch.merge(model_sketches[pk]):
+                    changed[pk] = bytes(sketch)
+            if changed:
+                sketches = Case(*[When(pk=pk, then=Value(data, output_field=BinaryField()))
+                                  for pk, data in changed.items()], output_field=BinaryField())
+                model.objects.filter(pk__in=list(changed)).update(visitors_hll=sketches)
+
+
+def request_flush():
+    """asks every worker sharing the cache to flush on its next page view"""
+    cache.set(FLUSH_REQUEST_KEY, time.time(), None)
+
+
+view_counts = ViewCountBuffer(threshold=getattr(settings, 'HONEST_VIEW_COUNT_FLUSH_THRESHOLD', 100),
+                              interval=getattr(settings, 'HONEST_VIEW_COUNT_FLUSH_INTERVAL', 30))
+
+# write whatever is left when the worker shuts down cleanly
+atexit.register(view_counts.flush)
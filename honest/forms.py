@@ -1,4 +1,5 @@
 from django import forms
+from django.urls import reverse_lazy
 from honest.models import Category, Area, Person, UserProfile, Review
 
 
@@ -17,22 +18,30 @@ class AreaForm(forms.ModelForm):
     state = forms.CharField(
         max_length=100, help_text='Enter the State name. EG Lagos, Kaduna', widget=forms.TextInput(
             attrs={'class': 'form-control', 'placeholder': 'Enter the State name. EG Lagos, Kaduna'}))
+    parent = forms.ModelChoiceField(
+        queryset=Area.objects.order_by('state'), required=False, label='Inside',
+        help_text='The state or LGA this area is in, leave empty for a state',
+        widget=forms.Select(attrs={'class': 'form-control'}))
     views = forms.IntegerField(widget=forms.HiddenInput, required=False)
     slug = forms.CharField(widget=forms.HiddenInput, required=False)
 
     class Meta:
         model = Area
-        fields = ('state',)
+        fields = ('state', 'parent')
 
 
 class PersonForm(forms.ModelForm):
     # define forms for adding new service and location, other fields will be populated automatically
     new_service = forms.CharField(max_length=100, required=False, help_text="Enter their service ONLY if it IS NOT "
                                                                             "found above, EG Web Developer, Mechanic", widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': "Enter their service ONLY if it IS NOT "
-                                                                                                                                                     "found above, EG Web Developer, Mechanic"}))
+                                                                                                                                                     "found above, EG Web Developer, Mechanic",
+                                                                                                                              'list': 'service-suggestions', 'autocomplete': 'off',
+                                                                                                                              'data-autocomplete': reverse_lazy('honest:autocomplete', args=['categories'])}))
     new_location = forms.CharField(max_length=100, required=False, help_text="Enter their location ONLY if it IS NOT"
                                                                              " found above, EG Lagos, Kaduna", widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': "Enter their location ONLY if it IS NOT"
-                                                                                                                                             " found above, EG Lagos, Kaduna"}))
+                                                                                                                                             " found above, EG Lagos, Kaduna",
+                                                                                                                      'list': 'location-suggestions', 'autocomplete': 'off',
+                                                                                                                      'data-autocomplete': reverse_lazy('honest:autocomplete', args=['areas'])}))
 
     first_name = forms.CharField(max_length=60, widget=forms.TextInput(
         attrs={'class': 'form-control', 'placeholder': 'first name'}))
@@ -52,7 +61,8 @@ class PersonForm(forms.ModelForm):
         # point form to this model to populate all its fields
         model = Person
         # exclude fields which users should not be able to influence/interact with
-        exclude = ('date_added', 'views', 'upvotes', 'downvotes', 'rating')
+        exclude = ('date_added', 'views', 'upvotes', 'downvotes', 'rating', 'rating_sum', 'review_count',
+                   'one_star_count', 'two_star_count', 'three_star_count', 'four_star_count', 'five_star_count')
 
     def __init__(self, *args, **kwargs):
         # override init to make service and location fields optional
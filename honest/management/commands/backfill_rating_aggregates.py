@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from honest.models import Person, Review, RATING_AGGREGATE_FIELDS, review_aggregates
+from honest.ranking import person_score
+
+
+class Command(BaseCommand):
+    help = ("Backfill and verify the running review aggregates and ranking score stored on each person, "
+            "in batches of people")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="number of people checked per batch")
+        parser.add_argument('--verify', action='store_true',
+                            help="only report people whose aggregates don't match their reviews, change nothing")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = mismatched = 0
+        last_pk = 0
+
+        while True:
+            # walk people in primary key order so each batch is an indexed range scan
+            people = list(Person.objects.filter(pk__gt=last_pk).order_by('pk')
+                          .values('pk', 'upvotes', 'downvotes', *RATING_AGGREGATE_FIELDS)[:batch_size])
+            if not people:
+                break
+            last_pk = people[-1]['pk']
+
+            # one grouped query works out the true aggregates for the whole batch
+            actual = {row.pop('person_id'): row for row in Review.objects.filter(
+                person_id__in=[person['pk'] for person in people]).order_by().values('person_id').annotate(
+                **review_aggregates())}
+
+            with transaction.atomic():
+                for stored in people:
+                    person = Person(pk=stored.pop('pk'), upvotes=stored.pop('upvotes'),
+                                    downvotes=stored.pop('downvotes'))
+                    for field, value in actual.get(person.pk, {}).items():
+                        setattr(person, field, value)
+                    person.rating = person.average_rating()
+                    person.score = person_score(person)
+                    expected = {field: getattr(person, field) for field in RATING_AGGREGATE_FIELDS}
+                    if expected == stored:
+                        continue
+                    mismatched += 1
+                    if options['verify']:
+                        self.stdout.write("person {0}: stored {1}, expected {2}".format(person.pk, stored, expected))
+                    else:
+                        person.save(update_fields=RATING_AGGREGATE_FIELDS)
+            checked += len(people)
+
+        if options['verify'] and mismatched:
+            raise CommandError("checked {0} people, {1} have stale aggregates".format(checked, mismatched))
+        self.stdout.write("checked {0} people, fixed {1} with stale aggregates".format(checked, mismatched))
@@ -0,0 +1,116 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Max
+from django.template.defaultfilters import slugify
+
+from honest.management.commands.benchmark_search import FIRST_NAMES, LAST_NAMES, SERVICES, STATES
+from honest.models import Area, Category, Person
+from honest.ranking import leaderboard, person_score, recompute_scores
+
+
+class Command(BaseCommand):
+    help = ("Measure the vectorized score recompute against per person updates, and leaderboard query latency, "
+            "over N synthetic people. Uses a temporary SQLite database unless --database names a configured one")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--people', type=int, default=1000000)
+        parser.add_argument('--saves', type=int, default=10000, help="people updated one by one for comparison")
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--database', help="migrated database alias to use instead of a temporary SQLite file, "
+                                               "the people, categories and areas the run adds are deleted after it")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        scratch = None
+        alias = options['database']
+        if alias is None:
+            scratch = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+            scratch.close()
+            alias = 'ranking_benchmark'
+            connections.databases[alias] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': scratch.name}
+            call_command('migrate', 'honest', database=alias, verbosity=0)
+
+        # primary keys only grow, everything the run inserts comes after the rows already there
+        last_pks = {model: model.objects.using(alias).aggregate(last=Max('pk'))['last'] or 0
+                    for model in (Person, Category, Area)}
+        try:
+            people = Person.objects.using(alias)
+            if last_pks[Person]:
+                # only the people the run inserts are scored, timed and deleted
+                people = people.filter(pk__gt=last_pks[Person])
+            categories, areas = self.load_people(rng, alias, options['people'])
+
+            started = time.monotonic()
+            checked, changed = recompute_scores(people)
+            elapsed = time.monotonic() - started
+            self.stdout.write("vectorized recompute: {0} people, {1} scores changed in {2:.1f}s ({3:.0f} people/s)"
+                              .format(checked, changed, elapsed, checked / elapsed))
+
+            # the same work done a row at a time, the way a loop of save() calls would, minus the signals
+            started = time.monotonic()
+            with transaction.atomic(using=alias):
+                for person in people.order_by('pk')[:options['saves']]:
+                    people.filter(pk=person.pk).update(score=person_score(person))
+            elapsed = time.monotonic() - started
+            self.stdout.write("per person update: {0} people in {1:.1f}s ({2:.0f} people/s, {3:.0f}s for all {4})"
+                              .format(options['saves'], elapsed, options['saves'] / elapsed,
+                                      elapsed * checked / options['saves'], checked))
+
+            for name, scope in (('category', lambda: {'category': rng.choice(categories)}),
+                                ('area', lambda: {'area': rng.choice(areas)}),
+                                ('category in area', lambda: {'category': rng.choice(categories),
+                                                              'area': rng.choice(areas)})):
+                timings = []
+                for _ in range(options['queries']):
+                    started = time.perf_counter()
+                    list(leaderboard(people, limit=20, **scope()).values_list('pk', 'score'))
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                self.stdout.write("top 20 by {0}: p50 {1:.2f}ms p95 {2:.2f}ms p99 {3:.2f}ms mean {4:.2f}ms".format(
+                    name, timings[len(timings) // 2], timings[int(len(timings) * 0.95)],
+                    timings[int(len(timings) * 0.99)], statistics.mean(timings)))
+        finally:
+            if scratch is None:
+                # deleted without signals, like they were inserted, the receivers would change the search index,
+                # counts and caches of the default database
+                for model in (Person, Category, Area):
+                    model.objects.using(alias).filter(pk__gt=last_pks[model])._raw_delete(alias)
+            connections[alias].close()
+            if scratch is not None:
+                os.unlink(scratch.name)
+
+    def load_people(self, rng, alias, count):
+        """count people with random votes and reviews, their scores left at 0 for the recompute to fill in.
+        everything is bulk inserted, save signals would write search documents and caches for the default database"""
+        Category.objects.using(alias).bulk_create(
+            [Category(category=name, slug=slugify(name)) for name in SERVICES if not
+             Category.objects.using(alias).filter(category=name).exists()])
+        Area.objects.using(alias).bulk_create(
+            [Area(state=name, slug=slugify(name)) for name in STATES if not
+             Area.objects.using(alias).filter(state=name).exists()])
+        categories = list(Category.objects.using(alias).filter(category__in=SERVICES))
+        areas = list(Area.objects.using(alias).filter(state__in=STATES))
+        started = time.monotonic()
+        for start in range(0, count, 10000):
+            batch = []
+            for _ in range(min(10000, count - start)):
+                reviews = int(rng.expovariate(0.2))
+                ratings = [rng.choice([1, 2, 3, 4, 4, 5, 5, 5]) for _ in range(reviews)]
+                service, location = rng.choice(categories), rng.choice(areas)
+                batch.append(Person(service=service, location=location, service_slug=service.slug,
+                                    location_slug=location.slug, first_name=rng.choice(FIRST_NAMES),
+                                    last_name=rng.choice(LAST_NAMES),
+                                    phone_number='08031234567', rating_sum=sum(ratings), review_count=reviews,
+                                    upvotes=int(rng.expovariate(0.3)), downvotes=int(rng.expovariate(0.6))))
+            with transaction.atomic(using=alias):
+                Person.objects.using(alias).bulk_create(batch)
+        self.stdout.write("created {0} people in {1:.1f}s".format(count, time.monotonic() - started))
+        return categories, areas
@@ -0,0 +1,104 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from honest.search import document_id, get_backend, search_terms
+
+FIRST_NAMES = ['Ade', 'Bola', 'Chidi', 'Dayo', 'Emeka', 'Funke', 'Gbenga', 'Halima', 'Ifeoma', 'Jide', 'Kemi',
+               'Lola', 'Musa', 'Ngozi', 'Obinna', 'Segun', 'Tunde', 'Uche', 'Yemi', 'Zainab']
+LAST_NAMES = ['Adeyemi', 'Bello', 'Chukwu', 'Danjuma', 'Eze', 'Falana', 'Garba', 'Ibrahim', 'Johnson', 'Kalu',
+              'Lawal', 'Mohammed', 'Nwosu', 'Okafor', 'Okonkwo', 'Olawale', 'Sani', 'Usman', 'Williams', 'Yusuf']
+SERVICES = ['Tailor', 'Mechanic', 'Plumber', 'Electrician', 'Carpenter', 'Web Developer', 'Barber', 'Painter',
+            'Caterer', 'Photographer', 'Driver', 'Welder', 'Hairdresser', 'Tutor', 'Cleaner']
+STATES = ['Lagos', 'Abuja', 'Kano', 'Kaduna', 'Oyo', 'Rivers', 'Enugu', 'Delta', 'Edo', 'Ogun', 'Anambra', 'Kwara']
+REVIEW_WORDS = ['great', 'honest', 'fast', 'careful', 'late', 'friendly', 'expensive', 'cheap', 'reliable',
+                'professional', 'recommend', 'excellent', 'poor', 'neat', 'quality', 'work', 'job', 'service']
+
+
+class Command(BaseCommand):
+    help = ("Measure full-text search latency against a synthetic index of N people in a scratch table. "
+            "Uses a temporary SQLite database unless --database names a configured one")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--people', type=int, default=1000000)
+        parser.add_argument('--reviews-per-person', type=float, default=0.5)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--database', help="database alias to benchmark instead of a temporary SQLite file")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        scratch = None
+        alias = options['database']
+        if alias is None:
+            scratch = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+            scratch.close()
+            alias = 'search_benchmark'
+            connections.databases[alias] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': scratch.name}
+        backend = get_backend(connections[alias], table='honest_search_benchmark')
+
+        try:
+            backend.drop_index()
+            backend.create_index()
+            started = time.monotonic()
+            documents = self.documents(rng, options['people'], options['reviews_per_person'])
+            batch = []
+            for document in documents:
+                batch.append(document)
+                if len(batch) == 10000:
+                    with transaction.atomic(using=alias):
+                        backend.add(batch)
+                    batch = []
+            with transaction.atomic(using=alias):
+                backend.add(batch)
+            backend.optimize()
+            self.stdout.write("indexed {0} people in {1:.1f}s".format(options['people'],
+                                                                      time.monotonic() - started))
+
+            queries = [self.query(rng) for _ in range(options['queries'])]
+            timings = []
+            for query in queries:
+                started = time.perf_counter()
+                backend.search(search_terms(query), 30)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write("{0} queries: p50 {1:.2f}ms p95 {2:.2f}ms p99 {3:.2f}ms mean {4:.2f}ms".format(
+                len(timings), timings[len(timings) // 2], timings[int(len(timings) * 0.95)],
+                timings[int(len(timings) * 0.99)], statistics.mean(timings)))
+        finally:
+            backend.drop_index()
+            connections[alias].close()
+            if scratch is not None:
+                os.unlink(scratch.name)
+
+    def documents(self, rng, people, reviews_per_person):
+        for index, service in enumerate(SERVICES, 1):
+            yield document_id('category', index), 'category', index, service, ''
+        for index, state in enumerate(STATES, 1):
+            yield document_id('area', index), 'area', index, state, ''
+        review_id = 0
+        for person_id in range(1, people + 1):
+            yield (document_id('person', person_id), 'person', person_id,
+                   '{0} {1}'.format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)), '')
+            while rng.random() < reviews_per_person / (1 + reviews_per_person):
+                review_id += 1
+                yield (document_id('review', review_id), 'review', review_id, ' '.join(rng.sample(REVIEW_WORDS, 2)),
+                       ' '.join(rng.choice(REVIEW_WORDS) for _ in range(12)))
+
+    def query(self, rng):
+        """a mix of full names, single names, partly typed names, services and review words"""
+        kind = rng.random()
+        if kind < 0.3:
+            return '{0} {1}'.format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        if kind < 0.5:
+            return rng.choice(LAST_NAMES)
+        if kind < 0.7:
+            return rng.choice(FIRST_NAMES)[:3]
+        if kind < 0.85:
+            return rng.choice(SERVICES)
+        return '{0} {1}'.format(rng.choice(REVIEW_WORDS), rng.choice(REVIEW_WORDS))
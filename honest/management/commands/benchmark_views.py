@@ -0,0 +1,234 @@
+import io
+import json
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.template.backends.django import Template
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from honest import urls
+from honest.counters import view_counts
+from honest.models import Person, UserProfile
+
+# a regression must also be at least this much slower, so sub-millisecond noise on fast pages isn't flagged
+MIN_REGRESSION_MS = 1.0
+COMPARED_METRICS = ['p50_ms', 'p95_ms', 'query_ms', 'template_ms']
+
+
+class Recorder:
+    """times the sql and template rendering done during a request"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.query_seconds = 0
+        self.template_seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - started
+
+    @contextmanager
+    def timing_templates(self):
+        """wraps the django template backend's render, which includes and extends happen inside of. form widgets
+        render through the same backend inside the page, only the outermost render is timed so they aren't counted
+        twice"""
+        render = Template.render
+        recorder = self
+        recorder.depth = 0
+
+        def timed_render(template, *args, **kwargs):
+            recorder.depth += 1
+            started = time.perf_counter()
+            try:
+                return render(template, *args, **kwargs)
+            finally:
+                recorder.depth -= 1
+                if not recorder.depth:
+                    recorder.template_seconds += time.perf_counter() - started
+
+        Template.render = timed_render
+        try:
+            yield
+        finally:
+            Template.render = render
+
+
+class Command(BaseCommand):
+    help = ("Fill a throwaway test database with generate_data and time every url in honest/urls.py through the test client, "
+            "recording latency percentiles, sql queries and time, template render time and peak memory per "
+            "endpoint. Write the results with --output and compare them to an earlier run with --baseline")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--people', type=int, default=2000)
+        parser.add_argument('--reviews-per-person', type=float, default=3)
+        parser.add_argument('--requests', type=int, default=50, help="timed requests per endpoint")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--cold', action='store_true',
+                            help="empty the cache before every request, to time the views rather than the page cache")
+        parser.add_argument('--output', help="file to write the results to as json")
+        parser.add_argument('--baseline', help="results file of an earlier run to compare against")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="fail when a time metric grows by more than this fraction of the baseline")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # every request comes from one address, admission limits would turn most of the review posts away
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver'], HONEST_ADMISSION_LIMITS={},
+                                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+                started = time.monotonic()
+                person = self.seed(options['seed'], options['people'], options['reviews_per_person'])
+                self.stdout.write("seeded {0} people in {1:.1f}s".format(options['people'],
+                                                                        time.monotonic() - started))
+                results = {
+                    'dataset': {'people': options['people'], 'reviews_per_person': options['reviews_per_person'],
+                                'seed': options['seed'], 'cold': options['cold']},
+                    'endpoints': self.run(self.endpoints(person), options['requests'], options['cold']),
+                }
+        finally:
+            view_counts.flush()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for name, metrics in results['endpoints'].items():
+            self.stdout.write("{0:28} p50 {p50_ms:7.2f}ms p95 {p95_ms:7.2f}ms p99 {p99_ms:7.2f}ms "
+                              "{queries:3d} queries {query_ms:6.2f}ms templates {template_ms:6.2f}ms "
+                              "peak {peak_memory_kb:7.0f}KiB".format(name, **metrics))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                baseline = json.load(baseline)
+            if baseline['dataset'] != results['dataset']:
+                raise CommandError("the baseline was run with {0}, run again with the same options".format(
+                    baseline['dataset']))
+            regressions = compare(baseline['endpoints'], results['endpoints'], options['threshold'])
+            if regressions:
+                raise CommandError("{0} regressions against {1}:\n{2}".format(
+                    len(regressions), options['baseline'], "\n".join(regressions)))
+            self.stdout.write("no regressions against {0}".format(options['baseline']))
+
+    def seed(self, seed, people, reviews_per_person):
+        """a generated data set plus a user to log in as. returns one person with reviews, for the urls that
+        need one"""
+        call_command('generate_data', people=people, reviews=int(people * reviews_per_person),
+                     reviewers=max(people // 10, 1), seed=seed, stdout=io.StringIO())
+        UserProfile.objects.create_user('benchmark', password='benchmark')
+        return Person.objects.filter(review_count__gt=0).select_related('service', 'location').first()
+
+    def endpoints(self, person):
+        """(name, method, url, data, logged in) for every url pattern. fails when a pattern has no entry here,
+        so new views get benchmarked too"""
+        person_url = reverse('honest:person', args=[person.location.slug, person.service.slug, person.pk])
+        endpoints = [
+            ('index', 'get', reverse('honest:index'), None, False),
+            ('about', 'get', reverse('honest:about'), None, False),
+            ('search', 'get', reverse('honest:search'), {'q': person.last_name}, False),
+            ('autocomplete', 'get', reverse('honest:autocomplete', args=['categories']), {'q': 'p'}, False),
+            ('api_list people', 'get', reverse('honest:api_list', args=['people']),
+             {'category': person.service.slug, 'ordering': 'score'}, False),
+            ('api_list reviews', 'get', reverse('honest:api_list', args=['reviews']), {'person': person.pk}, False),
+            ('category', 'get', reverse('honest:category', args=[person.service.slug]), None, False),
+            ('all_categories', 'get', reverse('honest:all_categories'), None, False),
+            ('add_category', 'get', reverse('honest:add_category'), None, True),
+            ('area', 'get', reverse('honest:area', args=[person.location.slug]), None, False),
+            ('all_areas', 'get', reverse('honest:all_areas'), None, False),
+            ('add_area', 'get', reverse('honest:add_area'), None, True),
+            ('add_person', 'get', reverse('honest:add_person'), None, True),
+            ('register', 'get', reverse('honest:register'), None, False),
+            ('login', 'get', reverse('honest:login'), None, False),
+            ('logout', 'get', reverse('honest:logout'), None, True),
+            ('category_in_area', 'get',
+             reverse('honest:category_in_area', args=[person.location.slug, person.service.slug]), None, False),
+            ('person', 'get', person_url, None, False),
+            ('person logged in', 'get', person_url, None, True),
+            # posting a review changes the person's pages, so it goes last
+            ('person review post', 'post', person_url, {'rating': 4, 'summary': "Benchmark", 'review_text': ""},
+             False),
+        ]
+        covered = {name.split()[0] for name, *rest in endpoints}
+        missing = [pattern.name for pattern in urls.urlpatterns if pattern.name not in covered]
+        if missing:
+            raise CommandError("no benchmark for urls: {0}".format(', '.join(missing)))
+        return endpoints
+
+    def run(self, endpoints, requests, cold):
+        recorder = Recorder()
+        results = {}
+        with connection.execute_wrapper(recorder), recorder.timing_templates():
+            for name, method, url, data, logged_in in endpoints:
+                cache.clear()
+                client = Client()
+                if logged_in:
+                    client.login(username='benchmark', password='benchmark')
+                request = getattr(client, method)
+
+                # one untimed request warms the page cache and lazy imports, the next is traced for memory
+                self.check_response(name, request(url, data))
+                tracemalloc.start()
+                request(url, data)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                timings, queries, query_seconds, template_seconds = [], [], [], []
+                for _ in range(requests):
+                    if logged_in and name == 'logout':
+                        client.login(username='benchmark', password='benchmark')
+                    if cold:
+                        cache.clear()
+                    recorder.reset()
+                    started = time.perf_counter()
+                    response = request(url, data)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    self.check_response(name, response)
+                    queries.append(recorder.queries)
+                    query_seconds.append(recorder.query_seconds)
+                    template_seconds.append(recorder.template_seconds)
+                timings.sort()
+                results[name] = {
+                    'p50_ms': timings[len(timings) // 2], 'p95_ms': timings[int(len(timings) * 0.95)],
+                    'p99_ms': timings[int(len(timings) * 0.99)], 'queries': max(queries),
+                    'query_ms': statistics.mean(query_seconds) * 1000,
+                    'template_ms': statistics.mean(template_seconds) * 1000,
+                    'peak_memory_kb': peak_memory / 1024,
+                }
+        return results
+
+    def check_response(self, name, response):
+        if response.status_code not in (200, 302, 304):
+            raise CommandError("{0} answered {1}".format(name, response.status_code))
+
+
+def compare(baseline, current, threshold):
+    """descriptions of every metric that got worse than the baseline allows. query counts are exact, a single
+    extra query is a regression, times may grow by threshold and at least MIN_REGRESSION_MS"""
+    regressions = []
+    for name, before in sorted(baseline.items()):
+        after = current.get(name)
+        if after is None:
+            continue
+        if after['queries'] > before['queries']:
+            regressions.append("{0}: {1} queries, was {2}".format(name, after['queries'], before['queries']))
+        for metric in COMPARED_METRICS:
+            grown = after[metric] - before[metric]
+            if grown > before[metric] * threshold and grown >= MIN_REGRESSION_MS:
+                regressions.append("{0}: {1} {2:.2f}, was {3:.2f}".format(name, metric, after[metric],
+                                                                        before[metric]))
+        if after['peak_memory_kb'] > before['peak_memory_kb'] * (1 + threshold):
+            regressions.append("{0}: peak memory {1:.0f}KiB, was {2:.0f}KiB".format(
+                name, after['peak_memory_kb'], before['peak_memory_kb']))
+    return regressions
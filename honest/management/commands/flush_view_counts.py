@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from honest.counters import request_flush, view_counts
+
+
+class Command(BaseCommand):
+    help = ("Force buffered page view counts to be written. Workers sharing the cache flush on their next page "
+            "view, within a second of it")
+
+    def handle(self, *args, **options):
+        request_flush()
+        flushed = view_counts.flush()
+        self.stdout.write("flush requested from all workers, wrote {0} views buffered in this process".format(
+            sum(sum(model_counts.values()) for model_counts in flushed.values())))
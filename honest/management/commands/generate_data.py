@@ -0,0 +1,227 @@
+import csv
+import datetime
+import io
+import time
+
+import numpy
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from honest import search
+from honest.caching import area_page, bump_generations, category_in_area_page, category_page
+from honest.management.commands.benchmark_search import FIRST_NAMES, LAST_NAMES, REVIEW_WORDS, SERVICES
+from honest.models import Area, AreaCategoryStats, Category, Person, Review, STAR_COUNT_FIELDS, UserProfile
+from honest.ranking import score
+
+STATES = ['Abia', 'Adamawa', 'Akwa Ibom', 'Anambra', 'Bauchi', 'Bayelsa', 'Benue', 'Borno', 'Cross River', 'Delta',
+          'Ebonyi', 'Edo', 'Ekiti', 'Enugu', 'FCT', 'Gombe', 'Imo', 'Jigawa', 'Kaduna', 'Kano', 'Katsina', 'Kebbi',
+          'Kogi', 'Kwara', 'Lagos', 'Nasarawa', 'Niger', 'Ogun', 'Ondo', 'Osun', 'Oyo', 'Plateau', 'Rivers', 'Sokoto',
+          'Taraba', 'Yobe', 'Zamfara']
+QUALIFIERS = ['Mobile', 'Commercial', 'Domestic', 'Industrial', 'Emergency', 'Certified', 'Budget', 'Luxury']
+DISTRICTS = ['North', 'South', 'East', 'West', 'Central']
+# how many distinct review summaries and texts are made up front, reviews pick from them
+TEXT_POOL_SIZE = 5000
+# reviews are spread over this many days before now
+HISTORY_DAYS = 3 * 365
+
+
+def names(base, extra, pattern, count):
+    """count distinct names, the base names first and then every base name combined with each extra word"""
+    result = list(base) + [pattern.format(name=name, word=word) for word in extra for name in base]
+    if count > len(result):
+        raise CommandError("can't make up more than {0} names".format(len(result)))
+    return result[:count]
+
+
+def zipf_weights(count, exponent):
+    """popularity of count things where the nth most popular gets 1/n**exponent of the most popular's share"""
+    weights = 1 / numpy.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def write_rows(model, columns, rows):
+    """inserts rows into the model's table as fast as the database allows: COPY on postgres, one prepared
+    statement run for every row elsewhere"""
+    table = connection.ops.quote_name(model._meta.db_table)
+    quoted = ', '.join(connection.ops.quote_name(column) for column in columns)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # in COPY's csv format an unquoted empty value is NULL and bytea is written as hex
+            data = io.StringIO()
+            csv.writer(data).writerows([['\\x' + value.hex() if isinstance(value, bytes) else value for value in row]
+                                        for row in rows])
+            data.seek(0)
+            cursor.copy_expert("COPY {0} ({1}) FROM STDIN WITH (FORMAT csv)".format(table, quoted), data)
+        else:
+            cursor.executemany("INSERT INTO {0} ({1}) VALUES ({2})".format(
+                table, quoted, ', '.join(['%s'] * len(columns))), rows)
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = ("Generate a large, realistic and repeatable data set: categories and areas with Zipf distributed "
+            "popularity, people, reviewers and reviews with realistic rating distributions. Rows are written with "
+            "raw batched inserts (COPY on Postgres) and every denormalized value is filled in as it goes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=40)
+        parser.add_argument('--areas', type=int, default=37)
+        parser.add_argument('--people', type=int, default=100000)
+        parser.add_argument('--reviews', type=int, default=1000000, help="roughly how many reviews to write")
+        parser.add_argument('--reviewers', type=int, default=10000, help="registered users writing the reviews")
+        parser.add_argument('--anonymous-share', type=float, default=0.3, help="share of reviews with no reviewer")
+        parser.add_argument('--zipf', type=float, default=1.1, help="exponent of category and area popularity")
+        parser.add_argument('--batch-size', type=int, default=20000, help="people written per transaction")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help="don't add the new rows to the full-text search index")
+
+    def handle(self, *args, **options):
+        rng = numpy.random.RandomState(options['seed'])
+        started = time.monotonic()
+        self.today = timezone.now().date()
+
+        # few enough to go through the models, so their slugs, search documents and signals are all as usual
+        categories = [Category.objects.get_or_create(category=name)[0]
+                      for name in names(SERVICES, QUALIFIERS, '{word} {name}', options['categories'])]
+        areas = [Area.objects.get_or_create(state=name)[0]
+                 for name in names(STATES, DISTRICTS, '{name} {word}', options['areas'])]
+        category_ids = numpy.array([category.pk for category in categories])
+        area_ids = numpy.array([area.pk for area in areas])
+        self.slugs = {(Category, category.pk): category.slug for category in categories}
+        self.slugs.update({(Area, area.pk): area.slug for area in areas})
+        # reviewers draw from their own stream, so reusing an earlier run's reviewers doesn't change the rest
+        reviewer_ids = self.create_reviewers(numpy.random.RandomState([options['seed'], 1]), options['reviewers'])
+        backend = None if options['skip_search_index'] else search.get_backend()
+
+        # a person's share of all reviews follows a long tail, most people have a few and some have hundreds
+        people = options['people']
+        popularity = rng.lognormal(0, 1.2, people)
+        expected_reviews = popularity / popularity.sum() * options['reviews']
+        category_weights = zipf_weights(len(categories), options['zipf'])
+        area_weights = zipf_weights(len(areas), options['zipf'])
+        summaries = [' '.join(rng.choice(REVIEW_WORDS, 2)).capitalize() for _ in range(TEXT_POOL_SIZE)]
+        texts = [' '.join(rng.choice(REVIEW_WORDS, rng.randint(4, 30))) for _ in range(TEXT_POOL_SIZE)]
+
+        first_person, first_review = next_id(Person), next_id(Review)
+        people_done = reviews_done = 0
+        for start in range(0, people, options['batch_size']):
+            count = min(options['batch_size'], people - start)
+            with transaction.atomic():
+                written = self.write_batch(
+                    rng, backend, first_person + start, first_review + reviews_done, count,
+                    expected_reviews[start:start + count], category_ids[rng.choice(len(categories), count,
+                                                                                   p=category_weights)],
+                    area_ids[rng.choice(len(areas), count, p=area_weights)], reviewer_ids,
+                    options['anonymous_share'], summaries, texts)
+            people_done += count
+            reviews_done += written
+            elapsed = time.monotonic() - started
+            self.stdout.write("{0} people, {1} reviews, {2:.0f} rows/s".format(
+                people_done, reviews_done, (people_done + reviews_done) / elapsed))
+
+        with connection.cursor() as cursor:
+            # rows were written with their ids, move postgres sequences past them
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Person, Review]):
+                cursor.execute(sql)
+        bump_generations([generation for category in categories for area in areas for generation in
+                          category_in_area_page(area.slug, category.slug)] +
+                         [generation for category in categories for generation in category_page(category.slug)] +
+                         [generation for area in areas for generation in area_page(area.slug)])
+        self.stdout.write("generated {0} people and {1} reviews in {2:.1f}s".format(
+            people_done, reviews_done, time.monotonic() - started))
+
+    def create_reviewers(self, rng, count):
+        """ids of count reviewers, the ones made by an earlier run and new ones with unusable passwords"""
+        reviewer_ids = list(UserProfile.objects.filter(username__startswith='reviewer').order_by('pk').values_list(
+            'pk', flat=True)[:count])
+        # multi-table models can't be bulk inserted, reviewers are the only rows saved one at a time
+        with transaction.atomic():
+            for number in range(len(reviewer_ids), count):
+                profile = UserProfile(username='reviewer{0}'.format(number), first_name=rng.choice(FIRST_NAMES),
+                                      last_name=rng.choice(LAST_NAMES))
+                profile.set_unusable_password()
+                profile.save()
+                reviewer_ids.append(profile.pk)
+        return numpy.array(reviewer_ids, dtype=int)
+
+    def write_batch(self, rng, backend, first_person, first_review, count, expected_reviews, services, locations,
+                    reviewer_ids, anonymous_share, summaries, texts):
+        """writes count people and their reviews with consecutive ids, returns how many reviews were written"""
+        person_ids = numpy.arange(first_person, first_person + count)
+        review_counts = rng.poisson(expected_reviews)
+        total = int(review_counts.sum())
+
+        # each person has a hidden quality, their reviews scatter around it and pile up at 4 and 5 stars
+        quality = rng.beta(6, 2, count)
+        owners = numpy.repeat(numpy.arange(count), review_counts)
+        ratings = numpy.clip(numpy.rint(rng.normal(1 + 4 * quality[owners], 0.9)), 1, 5).astype(int)
+        joined_days_ago = rng.randint(0, HISTORY_DAYS, count)
+        review_days_ago = (joined_days_ago[owners] * rng.random_sample(total)).astype(int)
+        reviewers = reviewer_ids[rng.randint(0, len(reviewer_ids), total)] if len(reviewer_ids) else \
+            numpy.zeros(total, dtype=int)
+        anonymous = rng.random_sample(total) < anonymous_share if len(reviewer_ids) else numpy.ones(total, bool)
+        summary_choices = rng.randint(0, TEXT_POOL_SIZE, total)
+        text_choices = rng.randint(0, TEXT_POOL_SIZE, total)
+
+        # the aggregates the models keep on each person, worked out for the whole batch at once
+        stars = {rating: numpy.bincount(owners[ratings == rating], minlength=count) for rating in STAR_COUNT_FIELDS}
+        rating_sums = numpy.bincount(owners, weights=ratings, minlength=count).astype(int)
+        upvotes, downvotes = rng.poisson(2, count), rng.poisson(0.5, count)
+        # averages and scores are rounded exactly as saving a person rounds them, which numpy doesn't always match
+        averages = [round(int(rating_sum) / int(reviews), 2) if reviews else 0
+                    for rating_sum, reviews in zip(rating_sums, review_counts)]
+        scores = [score(int(rating_sum), int(reviews), int(up), int(down))
+                  for rating_sum, reviews, up, down in zip(rating_sums, review_counts, upvotes, downvotes)]
+
+        first_names = rng.choice(FIRST_NAMES, count)
+        last_names = rng.choice(LAST_NAMES, count)
+        phone_numbers = rng.randint(10 ** 7, 10 ** 8, count)
+        dates = self.dates(max(joined_days_ago.max(), 0) + 1)
+        person_rows = [
+            (int(person_ids[i]), first_names[i], last_names[i], '0803{0}'.format(phone_numbers[i]),
+             '{0}.{1}@example.com'.format(first_names[i], last_names[i]).lower(), dates[joined_days_ago[i]],
+             int(services[i]), int(locations[i]), 0, int(upvotes[i]), int(downvotes[i]), float(averages[i]),
+             int(rating_sums[i]), int(review_counts[i])) +
+            tuple(int(stars[rating][i]) for rating in STAR_COUNT_FIELDS) +
+            (float(scores[i]), b'', self.slugs[Category, int(services[i])], self.slugs[Area, int(locations[i])])
+            for i in range(count)]
+        write_rows(Person, ['id', 'first_name', 'last_name', 'phone_number', 'email', 'date_added', 'service_id',
+                            'location_id', 'views', 'upvotes', 'downvotes', 'rating', 'rating_sum', 'review_count'] +
+                   list(STAR_COUNT_FIELDS.values()) + ['score', 'visitors_hll', 'service_slug', 'location_slug'],
+                   person_rows)
+
+        review_ids = numpy.arange(first_review, first_review + total)
+        review_rows = [
+            (int(review_ids[i]), int(person_ids[owners[i]]), None if anonymous[i] else int(reviewers[i]),
+             int(ratings[i]), summaries[summary_choices[i]], texts[text_choices[i]], dates[review_days_ago[i]])
+            for i in range(total)]
+        write_rows(Review, ['id', 'person_id', 'reviewer_id', 'rating', 'summary', 'review_text', 'date_added'],
+                   review_rows)
+
+        # people and review counts of each area and category pair in the batch
+        pairs, pair_index = numpy.unique(numpy.stack([locations, services], axis=1), axis=0, return_inverse=True)
+        pair_people = numpy.bincount(pair_index, minlength=len(pairs))
+        pair_reviews = numpy.bincount(pair_index, weights=review_counts, minlength=len(pairs))
+        pair_ratings = numpy.bincount(pair_index, weights=rating_sums, minlength=len(pairs))
+        for (area_id, category_id), people, reviews, rating_sum in zip(pairs, pair_people, pair_reviews,
+                                                                        pair_ratings):
+            AreaCategoryStats.adjust(int(area_id), int(category_id), people=int(people), reviews=int(reviews),
+                                     rating_sum=int(rating_sum))
+
+        if backend:
+            backend.add([(search.document_id('person', row[0]), 'person', row[0], '{0} {1}'.format(row[1], row[2]),
+                          '') for row in person_rows] +
+                        [(search.document_id('review', row[0]), 'review', row[0], row[4], row[5])
+                         for row in review_rows])
+        return total
+
+    def dates(self, days):
+        """iso dates of the last days days, today first, so every row shares a few hundred strings"""
+        return [(self.today - datetime.timedelta(days=day)).isoformat() for day in range(days)]
@@ -0,0 +1,200 @@
+import csv
+import io
+import itertools
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from honest import search, taxonomy
+from honest.caching import bump_generations, pages_showing_person
+from honest.ranking import person_score
+from honest.models import (Area, AreaCategoryStats, Category, ImportProgress, Person, Review, STAR_COUNT_FIELDS,
+                           clean_name)
+
+
+class RowError(ValueError):
+    pass
+
+
+def json_row(line):
+    """one line of a JSON lines file as the dict it holds"""
+    if not line.strip():
+        raise RowError("blank line")
+    try:
+        row = json.loads(line)
+    except ValueError:
+        raise RowError("not valid JSON")
+    if not isinstance(row, dict):
+        raise RowError("not a JSON object")
+    return row
+
+
+def create_with_pks(model, instances):
+    """bulk inserts instances and makes sure they come back with their primary keys, which sqlite doesn't return"""
+    model.objects.bulk_create(instances)
+    if instances and not connection.features.can_return_ids_from_bulk_insert:
+        # called inside the batch's transaction, which holds the write lock, so the new rows are the newest ones
+        ids = model.objects.order_by('-pk').values_list('pk', flat=True)[:len(instances)]
+        for instance, pk in zip(instances, reversed(list(ids))):
+            instance.pk = pk
+
+
+def count_in_facets(people):
+    """adds new people and their reviews to the area and category counts, one update per pair"""
+    pairs = {}
+    for person in people:
+        counts = pairs.setdefault((person.location_id, person.service_id), [0, 0, 0])
+        counts[0] += 1
+        counts[1] += person.review_count
+        counts[2] += person.rating_sum
+    for (area_id, category_id), (people_count, review_count, rating_sum) in pairs.items():
+        AreaCategoryStats.adjust(area_id, category_id, people=people_count, reviews=review_count,
+                                 rating_sum=rating_sum)
+
+
+class Command(BaseCommand):
+    help = ("Bulk import people, and optionally their reviews, from a CSV or JSON lines file. "
+            "Columns/keys: first_name, last_name, phone_number, email, service, location and, in JSON lines only, "
+            "reviews: a list of {rating, summary, review_text}. Progress is committed with every batch, so running "
+            "the same import again after a failure picks up where it stopped")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="file to import, .csv or .jsonl")
+        parser.add_argument('--batch-size', type=int, default=2000, help="people inserted per transaction")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="file format, by default from the extension")
+        parser.add_argument('--source', help="name progress is recorded under, the file's absolute path by default")
+        parser.add_argument('--restart', action='store_true', help="ignore recorded progress and start over")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError("can't tell the format of {0}, use --format".format(path))
+        source = options['source'] or os.path.abspath(path)
+        progress, created = ImportProgress.objects.get_or_create(source=source)
+        if options['restart']:
+            progress.rows_done, progress.finished = 0, False
+            progress.save()
+        if progress.finished:
+            self.stdout.write("{0} was already imported, use --restart to import it again".format(source))
+            return
+
+        self.categories = dict(Category.objects.values_list('category', 'id'))
+        self.areas = dict(Area.objects.values_list('state', 'id'))
+        self.slugs = {}
+        self.imported = self.skipped = self.reviews = 0
+        started = time.monotonic()
+
+        with io.open(path, newline='', encoding='utf-8') as stream:
+            # json lines are parsed one row at a time in import_batch, so a bad line is skipped like a bad csv row
+            rows = csv.DictReader(stream) if file_format == 'csv' else stream
+            self.parse_row = json_row if file_format == 'jsonl' else dict
+            # rows already committed by an earlier run are read past, not inserted again
+            rows = enumerate(itertools.islice(rows, progress.rows_done, None), progress.rows_done + 1)
+            if progress.rows_done:
+                self.stdout.write("resuming {0} after row {1}".format(source, progress.rows_done))
+            while True:
+                batch = list(itertools.islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                self.import_batch(batch, progress)
+                elapsed = time.monotonic() - started
+                self.stdout.write("{0} rows done, {1} people at {2:.0f} people/s".format(
+                    progress.rows_done, self.imported, self.imported / elapsed if elapsed else 0))
+
+        progress.finished = True
+        progress.save()
+        elapsed = time.monotonic() - started
+        self.stdout.write("imported {0} people and {1} reviews, skipped {2} bad rows in {3:.1f}s ({4:.0f} people/s)"
+                          .format(self.imported, self.reviews, self.skipped, elapsed,
+                                  self.imported / elapsed if elapsed else 0))
+
+    def import_batch(self, batch, progress):
+        people, reviews = [], []
+        for line, row in batch:
+            try:
+                person, person_reviews = self.person_from_row(self.parse_row(row))
+            except RowError as problem:
+                self.stderr.write("row {0}: {1}".format(line, problem))
+                self.skipped += 1
+                continue
+            people.append(person)
+            reviews.append(person_reviews)
+
+        with transaction.atomic():
+            create_with_pks(Person, people)
+            new_reviews = [Review(person_id=person.pk, **review)
+                           for person, person_reviews in zip(people, reviews) for review in person_reviews]
+            create_with_pks(Review, new_reviews)
+            search.index_objects(people)
+            search.index_objects(new_reviews)
+            count_in_facets(people)
+            progress.rows_done = batch[-1][0]
+            progress.save()
+        self.imported += len(people)
+        self.reviews += len(new_reviews)
+
+        # bulk inserts don't send signals, drop the cached listing pages the new people appear on
+        pages = set()
+        for person in people:
+            pages.update(pages_showing_person(person.pk, person.service_slug,
+                                              taxonomy.areas.lineage_slugs(person.location_slug)))
+        bump_generations(pages)
+
+    def person_from_row(self, row):
+        values = {field: str(row.get(field) or '').strip()
+                  for field in ('first_name', 'last_name', 'phone_number', 'email', 'service', 'location')}
+        for field in ('first_name', 'last_name', 'phone_number', 'service', 'location'):
+            if not values[field]:
+                raise RowError("{0} is missing".format(field))
+        if not 11 <= len(values['phone_number']) <= 14:
+            raise RowError("phone number must be 11 - 14 characters long")
+        if values['email']:
+            try:
+                validate_email(values['email'])
+            except ValidationError:
+                raise RowError("invalid email {0}".format(values['email']))
+
+        service_id = self.resolve(Category, 'category', self.categories, values['service'])
+        location_id = self.resolve(Area, 'state', self.areas, values['location'])
+        person = Person(first_name=values['first_name'][:60], last_name=values['last_name'][:60],
+                        phone_number=values['phone_number'], email=values['email'][:150],
+                        service_id=service_id, location_id=location_id,
+                        service_slug=self.slugs[Category, service_id], location_slug=self.slugs[Area, location_id])
+
+        # reviews don't go through Review.save, so the person's aggregates are worked out here
+        person_reviews = []
+        if not isinstance(row.get('reviews') or [], list):
+            raise RowError("reviews must be a list")
+        for review in row.get('reviews') or []:
+            try:
+                rating = int(review['rating'])
+                summary = str(review['summary']).strip()
+            except (KeyError, TypeError, ValueError):
+                raise RowError("reviews need a rating and a summary")
+            if rating not in STAR_COUNT_FIELDS or not summary:
+                raise RowError("review ratings go from 1 to 5 and need a summary")
+            person_reviews.append({'rating': rating, 'summary': summary[:40],
+                                   'review_text': str(review.get('review_text') or '')[:360]})
+            person.rating_sum += rating
+            person.review_count += 1
+            setattr(person, STAR_COUNT_FIELDS[rating], getattr(person, STAR_COUNT_FIELDS[rating]) + 1)
+        person.rating = person.average_rating()
+        person.score = person_score(person)
+        return person, person_reviews
+
+    def resolve(self, model, name_field, known, name):
+        """id of the category or area called name, created the first time the import sees it"""
+        name = clean_name(name)[:100]
+        if name not in known:
+            instance, created = model.objects.get_or_create(**{name_field: name})
+            known[name] = instance.pk
+            self.slugs[model, instance.pk] = instance.slug
+        elif (model, known[name]) not in self.slugs:
+            self.slugs[model, known[name]] = model.objects.values_list('slug', flat=True).get(pk=known[name])
+        return known[name]
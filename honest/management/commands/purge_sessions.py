@@ -0,0 +1,37 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ("Delete expired sessions a batch at a time, each batch in its own short transaction, so logins and "
+            "logged in page views aren't held up behind one long DELETE the way clearsessions can hold them up")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.1,
+                            help="seconds to wait between batches, leaving the table to other writers")
+
+    def handle(self, *args, **options):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if not hasattr(store, 'get_model_class'):
+            self.stdout.write("{0} sessions expire by themselves, nothing to purge".format(settings.SESSION_ENGINE))
+            return
+        sessions = store.get_model_class().objects
+        # sessions expiring after now are left alone, however long the purge takes
+        now = timezone.now()
+        deleted = 0
+        while True:
+            # expire_date is indexed, so each batch is found without reading the sessions still in use
+            keys = list(sessions.filter(expire_date__lt=now).order_by('expire_date')
+                        .values_list('session_key', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            deleted += sessions.filter(session_key__in=keys).delete()[0]
+            if len(keys) < options['batch_size']:
+                break
+            time.sleep(options['pause'])
+        self.stdout.write("deleted {0} expired sessions".format(deleted))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from honest.models import AreaCategoryStats, Person, Review
+
+COUNT_FIELDS = ['people_count', 'review_count', 'rating_sum']
+
+
+class Command(BaseCommand):
+    help = "Recount the people, reviews and ratings of every area and category pair from scratch and fix stale counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help="only report pairs whose stored counts are wrong, change nothing")
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        with transaction.atomic():
+            # the stored rows are locked before anything is counted, so an adjust made meanwhile either lands before
+            # the recount sees its person or review, or waits and lands on top of the recounted value. on sqlite
+            # the transaction's lock on the database does the same
+            stored = {(stats.area_id, stats.category_id): stats
+                      for stats in AreaCategoryStats.objects.select_for_update()}
+            expected = self.expected_counts()
+            for pair in set(expected) | set(stored):
+                counts = expected.get(pair, dict.fromkeys(COUNT_FIELDS, 0))
+                stats = stored.get(pair) or AreaCategoryStats(area_id=pair[0], category_id=pair[1])
+                if {field: getattr(stats, field) for field in COUNT_FIELDS} == counts:
+                    continue
+                mismatched += 1
+                if options['verify']:
+                    self.stdout.write("area {0}, category {1}: stored {2}, expected {3}".format(
+                        pair[0], pair[1], {field: getattr(stats, field) for field in COUNT_FIELDS}, counts))
+                    continue
+                for field, value in counts.items():
+                    setattr(stats, field, value)
+                stats.save()
+
+        if options['verify'] and mismatched:
+            raise CommandError("checked {0} pairs, {1} have stale counts".format(len(expected), mismatched))
+        self.stdout.write("checked {0} pairs, fixed {1} with stale counts".format(len(expected), mismatched))
+
+    def expected_counts(self):
+        """the true counts of every pair from two grouped queries, each person counted in their area and in every
+        area it is inside through the area closure table"""
+        area = 'location__ancestor_links__ancestor_id'
+        expected = {}
+        for pair in Person.objects.order_by().values(area, 'service_id').annotate(people=Count('id')):
+            expected[pair[area], pair['service_id']] = {
+                'people_count': pair['people'], 'review_count': 0, 'rating_sum': 0}
+        for pair in Review.objects.order_by().values('person__' + area, 'person__service_id').annotate(
+                reviews=Count('id'), ratings=Sum('rating')):
+            counts = expected[pair['person__' + area], pair['person__service_id']]
+            counts.update(review_count=pair['reviews'], rating_sum=pair['ratings'])
+        return expected
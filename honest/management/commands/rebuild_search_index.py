@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from honest.models import Area, Category, Person, Review
+from honest.search import document, get_backend
+
+# only the columns that go into documents are loaded
+INDEXED_FIELDS = {
+    Person: ('first_name', 'last_name'),
+    Category: ('category',),
+    Area: ('state',),
+    Review: ('summary', 'review_text'),
+}
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from scratch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="documents written per transaction")
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if backend is None:
+            raise CommandError("full-text search isn't supported on this database")
+        batch_size = options['batch_size']
+        started = time.monotonic()
+
+        backend.create_index()
+        backend.clear()
+        total = 0
+        for model, fields in INDEXED_FIELDS.items():
+            last_pk = indexed = 0
+            while True:
+                # walk each table in primary key order rather than holding one huge result set open
+                batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk').only(*fields)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                with transaction.atomic():
+                    backend.add([document(instance) for instance in batch])
+                indexed += len(batch)
+            self.stdout.write("indexed {0} {1} documents".format(indexed, model._meta.verbose_name))
+            total += indexed
+        backend.optimize()
+        self.stdout.write("rebuilt search index with {0} documents in {1:.1f}s".format(
+            total, time.monotonic() - started))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from honest.models import Person
+from honest.ranking import RECOMPUTE_BATCH_SIZE, recompute_scores
+
+
+class Command(BaseCommand):
+    help = ("Recompute every person's ranking score from their votes and review aggregates, scoring each batch "
+            "of people in one vectorized pass and writing only the scores that changed")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECOMPUTE_BATCH_SIZE,
+                            help="number of people read and scored per batch")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        checked, changed = recompute_scores(Person.objects.all(), batch_size=options['batch_size'])
+        self.stdout.write("checked {0} people, updated {1} scores in {2:.1f}s".format(
+            checked, changed, time.monotonic() - started))
@@ -0,0 +1,301 @@
+"""
+per view request metrics in prometheus' text format.
+
+MetricsMiddleware times every request and adds up, per url name, a latency histogram, sql queries and their time,
+template render time and response bytes. each request's own numbers go back to the client in a Server-Timing header.
+/metrics is only served to staff and to scrapers sending HONEST_METRICS_TOKEN as a bearer token.
+
+gunicorn runs several worker processes, each with its own totals. every worker writes its totals to a file of its own
+in HONEST_METRICS_DIR at most every HONEST_METRICS_FLUSH_INTERVAL seconds, and /metrics adds up all the files. the
+files are named after the worker's pid and when it started, so a new worker given a pid an exited one had doesn't
+overwrite the old one's totals. when /metrics is scraped the files of workers that have exited are folded into one
+file of retired totals and removed, so their totals still count, the summed counters never go backwards, and the
+directory doesn't grow with every worker ever started.
+"""
+import atexit
+import fcntl
+import hmac
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates, Template
+
+from honest.admission import alive
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# counters kept per url name, besides the histogram, and how they are exported
+COUNTERS = (
+    ('requests', 'honest_requests_total', "Requests served"),
+    ('queries', 'honest_db_queries_total', "SQL queries run"),
+    ('query_seconds', 'honest_db_query_seconds_total', "Time spent running SQL queries"),
+    ('template_seconds', 'honest_template_render_seconds_total', "Time spent rendering templates"),
+    ('response_bytes', 'honest_response_bytes_total', "Response body bytes sent, streamed responses not included"),
+)
+
+# the measurements of the request being handled on this thread
+current = threading.local()
+
+# worker-<pid>-<start>.json, start is the process' start time, or x and a random id where it can't be read
+WORKER_FILE = re.compile(r'^worker-(?P<pid>\d+)-(?P<start>\w+)\.json$')
+# {"views": totals per url name of every worker folded in, "folded": worker files added to them and not yet removed}
+RETIRED_FILE = 'retired.json'
+
+
+def process_start(pid):
+    """when the process started, in clock ticks since boot, None where /proc isn't there to tell"""
+    try:
+        with open('/proc/{0}/stat'.format(pid)) as stat:
+            # the command name before it is in parentheses and may hold spaces, starttime is the 20th field after it
+            return stat.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def worker_file_name(pid):
+    return 'worker-{0}-{1}.json'.format(pid, process_start(pid) or 'x' + uuid.uuid4().hex)
+
+
+def worker_running(pid, start):
+    """whether the worker that wrote a file is still running, not just another process with the same pid"""
+    if not alive(pid):
+        return False
+    return start.startswith('x') or process_start(pid) in (None, start)
+
+
+def add_views(into, views):
+    for view, totals in views.items():
+        combined = into.setdefault(view, {'buckets': [0] * len(LATENCY_BUCKETS)})
+        for key, value in totals.items():
+            if key == 'buckets':
+                combined['buckets'] = [mine + theirs for mine, theirs in zip(combined['buckets'], value)]
+            else:
+                combined[key] = combined.get(key, 0) + value
+
+
+def read_json(path):
+    try:
+        with open(path) as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    """replaces the file whole so readers never see half of it"""
+    with open(path + '.tmp', 'w') as output:
+        output.write(data)
+    os.replace(path + '.tmp', path)
+
+
+class RequestTimings:
+    """sql and template time of one request, filled in by the execute wrapper and the template backend"""
+    __slots__ = ('queries', 'query_seconds', 'template_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+class TimedTemplate(Template):
+    """a django template that adds its render time to the current request's timings"""
+
+    def render(self, context=None, request=None):
+        timings = getattr(current, 'timings', None)
+        if timings is None:
+            return super(TimedTemplate, self).render(context, request)
+        started = time.perf_counter()
+        try:
+            return super(TimedTemplate, self).render(context, request)
+        finally:
+            timings.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """the django template backend, timing each top level render. included and extended templates render inside
+    the top level one, so they aren't counted twice"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super(TimedDjangoTemplates, self).get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+class Registry:
+    """this process's totals per url name, written to its own file now and then"""
+
+    def __init__(self, directory, flush_interval):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.views = {}
+        self.next_flush = time.monotonic() + flush_interval
+        self._pid = self._file_name = None
+
+    def record(self, view, seconds, timings, response_bytes):
+        with self.lock:
+            totals = self.views.get(view)
+            if totals is None:
+                totals = self.views[view] = {name: 0 for name, metric, description in COUNTERS}
+                totals.update(buckets=[0] * len(LATENCY_BUCKETS), seconds=0.0)
+            totals['requests'] += 1
+            totals['seconds'] += seconds
+            bucket = bisect_left(LATENCY_BUCKETS, seconds)
+            if bucket < len(LATENCY_BUCKETS):
+                totals['buckets'][bucket] += 1
+            totals['queries'] += timings.queries
+            totals['query_seconds'] += timings.query_seconds
+            totals['template_seconds'] += timings.template_seconds
+            totals['response_bytes'] += response_bytes
+        if time.monotonic() >= self.next_flush:
+            self.flush()
+
+    def path(self):
+        """this process's file, named again in a forked worker"""
+        if self._pid != os.getpid():
+            self._pid, self._file_name = os.getpid(), worker_file_name(os.getpid())
+        return os.path.join(self.directory, self._file_name)
+
+    def flush(self):
+        """writes this process's totals to its file"""
+        with self.lock:
+            data = json.dumps(self.views)
+            self.next_flush = time.monotonic() + self.flush_interval
+        os.makedirs(self.directory, exist_ok=True)
+        write_json(self.path(), data)
+
+    def worker_files(self):
+        """{file name: (pid, start)} of every worker file in the directory"""
+        matches = (WORKER_FILE.match(name) for name in os.listdir(self.directory))
+        return {match.group(0): (int(match.group('pid')), match.group('start')) for match in matches if match}
+
+    def collect(self):
+        """totals per url name summed over every worker that has written a file, running or not. the directory is
+        locked meanwhile, so no scrape sees a file both in the retired totals and on its own"""
+        self.flush()
+        with open(os.path.join(self.directory, 'collect.lock'), 'a') as lock:
+            fcntl.lockf(lock, fcntl.LOCK_EX)
+            try:
+                combined = {}
+                add_views(combined, self.retire_exited())
+                for name in self.worker_files():
+                    add_views(combined, read_json(os.path.join(self.directory, name)) or {})
+                return combined
+            finally:
+                fcntl.lockf(lock, fcntl.LOCK_UN)
+
+    def retire_exited(self):
+        """folds the files of workers that have exited into the retired totals and removes them, returns the
+        retired totals"""
+        retired_path = os.path.join(self.directory, RETIRED_FILE)
+        retired = read_json(retired_path) or {'views': {}, 'folded': []}
+        files = self.worker_files()
+        # files already added to the totals, by a scrape that stopped before it removed them
+        folded = set(retired['folded']) & set(files)
+        exited = [name for name, (pid, start) in files.items()
+                  if name not in folded and not worker_running(pid, start)]
+        if exited:
+            for name in exited:
+                add_views(retired['views'], read_json(os.path.join(self.directory, name)) or {})
+            folded.update(exited)
+            retired['folded'] = sorted(folded)
+            write_json(retired_path, json.dumps(retired))
+        for name in folded:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+        return retired['views']
+
+
+def prometheus_text(views):
+    lines = ['# HELP honest_request_duration_seconds Request latency by url name',
+             '# TYPE honest_request_duration_seconds histogram']
+    for view, totals in sorted(views.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, totals['buckets']):
+            cumulative += count
+            lines.append('honest_request_duration_seconds_bucket{{view="{0}",le="{1}"}} {2}'.format(
+                view, bound, cumulative))
+        lines.append('honest_request_duration_seconds_bucket{{view="{0}",le="+Inf"}} {1}'.format(
+            view, totals['requests']))
+        lines.append('honest_request_duration_seconds_sum{{view="{0}"}} {1}'.format(view, totals['seconds']))
+        lines.append('honest_request_duration_seconds_count{{view="{0}"}} {1}'.format(view, totals['requests']))
+    for key, metric, description in COUNTERS:
+        lines.append('# HELP {0} {1}'.format(metric, description))
+        lines.append('# TYPE {0} counter'.format(metric))
+        for view, totals in sorted(views.items()):
+            lines.append('{0}{{view="{1}"}} {2}'.format(metric, view, totals[key]))
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry(
+    getattr(settings, 'HONEST_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'honest-metrics')),
+    getattr(settings, 'HONEST_METRICS_FLUSH_INTERVAL', 5))
+atexit.register(registry.flush)
+
+
+class MetricsMiddleware:
+    """times the request, counts its sql through every connection and records it under its url name.
+    goes first in MIDDLEWARE so the time of the rest of the middleware is included"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = current.timings = RequestTimings()
+        wrapped = [connection.execute_wrappers for connection in connections.all()]
+        for wrappers in wrapped:
+            wrappers.append(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            for wrappers in wrapped:
+                wrappers.remove(timings)
+            current.timings = None
+        seconds = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        response_bytes = 0 if response.streaming else len(response.content)
+        registry.record(view, seconds, timings, response_bytes)
+        response['Server-Timing'] = 'db;dur={0:.2f};desc="{1} queries", tpl;dur={2:.2f}, total;dur={3:.2f}'.format(
+            timings.query_seconds * 1000, timings.queries, timings.template_seconds * 1000, seconds * 1000)
+        return response
+
+
+def may_read_metrics(request):
+    """staff, or a scraper with 'Authorization: Bearer <HONEST_METRICS_TOKEN>'"""
+    token = getattr(settings, 'HONEST_METRICS_TOKEN', None)
+    sent = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and hmac.compare_digest(sent.encode(), 'Bearer {0}'.format(token).encode()):
+        return True
+    return request.user.is_staff
+
+
+def metrics(request):
+    """every worker's totals in prometheus' text exposition format"""
+    if not may_read_metrics(request):
+        return HttpResponseForbidden("metrics are for staff and scrapers with HONEST_METRICS_TOKEN")
+    return HttpResponse(prometheus_text(registry.collect()), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,97 @@
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+from honest import admission, routers
+
+VISITOR_COOKIE = 'honest_visitor'
+VISITOR_COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+PRIMARY_COOKIE = 'honest_primary'
+
+
+def get_visitor_id(request):
+    """returns a stable anonymous id for whoever made this request, from a signed cookie.
+    a new id is made up for first time visitors and VisitorMiddleware sends it back to them"""
+    if not hasattr(request, '_visitor_id'):
+        visitor_id = request.get_signed_cookie(VISITOR_COOKIE, default=None)
+        if visitor_id is None:
+            visitor_id = uuid.uuid4().hex
+            request._new_visitor_id = True
+        request._visitor_id = visitor_id
+    return request._visitor_id
+
+
+class VisitorMiddleware:
+    """sets the visitor id cookie for first time visitors whose id was used while handling the request.
+    keeps page view tracking out of the session so reading a page never writes to the session table"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, '_new_visitor_id', False):
+            response.set_signed_cookie(VISITOR_COOKIE, request._visitor_id, max_age=VISITOR_COOKIE_MAX_AGE,
+                                       secure=settings.SESSION_COOKIE_SECURE, httponly=True)
+        return response
+
+
+class ReplicaMiddleware:
+    """lets GET and HEAD requests read from a replica, except for a user who wrote something in the last
+    HONEST_REPLICA_PIN_SECONDS, and pins whoever makes any other request to the primary for that long, see
+    honest/routers.py"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pin_seconds = getattr(settings, 'HONEST_REPLICA_PIN_SECONDS', 10)
+        reads_only = request.method in ('GET', 'HEAD')
+        pinned = request.get_signed_cookie(PRIMARY_COOKIE, default=None, max_age=pin_seconds) is not None
+        routers.state.replica = routers.choose_replica() if reads_only and not pinned else None
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.state.replica = None
+        if not reads_only and routers.replicas() and response.status_code < 500:
+            response.set_signed_cookie(PRIMARY_COOKIE, '1', max_age=pin_seconds,
+                                       secure=settings.SESSION_COOKIE_SECURE, httponly=True)
+        return response
+
+
+class AdmissionMiddleware:
+    """turns write requests to the endpoints in HONEST_ADMISSION_LIMITS away with a 503 when too many are already
+    being handled, or a 429 when the client has sent too many lately, see honest/admission.py. goes before the
+    middleware that reads the session or the database so turning a request away costs next to nothing"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if len(admission.control.limits()) > admission.ENDPOINTS:
+            raise ImproperlyConfigured("HONEST_ADMISSION_LIMITS can limit at most {0} endpoints".format(
+                admission.ENDPOINTS))
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return self.get_response(request)
+        try:
+            # resolved once here, the handler keeps it and MetricsMiddleware records turned away requests under it
+            request.resolver_match = match = resolve(request.path_info)
+        except Resolver404:
+            return self.get_response(request)
+        endpoint = match.view_name
+        if endpoint not in admission.control.limits():
+            return self.get_response(request)
+        refused = admission.control.admit(endpoint, admission.client_address(request))
+        if refused is not None:
+            status, retry_after = refused
+            message = "Too many requests, please try again shortly" if status == 429 else "Too busy, please try again"
+            response = HttpResponse(message, status=status, content_type='text/plain')
+            response['Retry-After'] = str(retry_after)
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            admission.control.leave(endpoint)
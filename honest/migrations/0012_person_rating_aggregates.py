@@ -0,0 +1,48 @@
+# Generated by Django 2.0 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honest', '0011_auto_20190318_0534'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='five_star_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='four_star_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='one_star_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='review_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='three_star_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='two_star_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0.13 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honest', '0012_person_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='area',
+            name='visitors_hll',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='visitors_hll',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='visitors_hll',
+            field=models.BinaryField(default=b''),
+        ),
+    ]
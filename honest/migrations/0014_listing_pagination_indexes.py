@@ -0,0 +1,29 @@
+# Generated by Django 2.0.13 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honest', '0013_unique_visitor_sketches'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['service', 'rating', 'id'], name='person_service_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['location', 'rating', 'id'], name='person_location_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['service', 'location', 'rating', 'id'], name='person_svc_loc_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['person', 'date_added', 'id'], name='review_person_date_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from honest.search import get_backend
+    backend = get_backend(schema_editor.connection)
+    if backend:
+        backend.create_index()
+
+
+def drop_search_index(apps, schema_editor):
+    from honest.search import get_backend
+    backend = get_backend(schema_editor.connection)
+    if backend:
+        backend.drop_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honest', '0014_listing_pagination_indexes'),
+    ]
+
+    operations = [
+        # the index is empty to begin with, fill it with manage.py rebuild_search_index
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
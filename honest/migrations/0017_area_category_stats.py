@@ -0,0 +1,45 @@
+# Generated by Django 2.0.13 on 2026-10-18 14:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_existing_people(apps, schema_editor):
+    Person = apps.get_model('honest', 'Person')
+    AreaCategoryStats = apps.get_model('honest', 'AreaCategoryStats')
+    alias = schema_editor.connection.alias
+    pairs = Person.objects.using(alias).order_by().values('location_id', 'service_id').annotate(
+        people=models.Count('id'), reviews=models.Sum('review_count'), ratings=models.Sum('rating_sum'))
+    AreaCategoryStats.objects.using(alias).bulk_create([
+        AreaCategoryStats(area_id=pair['location_id'], category_id=pair['service_id'], people_count=pair['people'],
+                          review_count=pair['reviews'] or 0, rating_sum=pair['ratings'] or 0) for pair in pairs])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honest', '0016_import_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AreaCategoryStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('people_count', models.IntegerField(default=0)),
+                ('review_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('area', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_stats', to='honest.Area')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='area_stats', to='honest.Category')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='areacategorystats',
+            index=models.Index(fields=['area', 'category'], name='stats_area_category_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='areacategorystats',
+            unique_together={('category', 'area')},
+        ),
+        migrations.RunPython(count_existing_people, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.0.13 on 2026-10-18 14:28
+
+from django.db import migrations, models
+
+
+def score_existing_people(apps, schema_editor):
+    from honest.ranking import recompute_scores
+    recompute_scores(apps.get_model('honest', 'Person').objects.using(schema_editor.connection.alias))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honest', '0017_area_category_stats'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='person',
+            name='person_service_rating_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='person',
+            name='person_location_rating_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='person',
+            name='person_svc_loc_rating_idx',
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(score_existing_people, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['service', 'score', 'id'], name='person_service_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['location', 'score', 'id'], name='person_location_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['service', 'location', 'score', 'id'], name='person_svc_loc_score_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.0.13 on 2026-10-18 14:36
+
+from django.db import migrations, models
+
+
+def number_duplicate_slugs(apps, schema_editor):
+    """names that differ only in case or punctuation share a slug, number all but the oldest so it can be unique"""
+    alias = schema_editor.connection.alias
+    for model_name in ('Category', 'Area'):
+        model = apps.get_model('honest', model_name)
+        taken = set()
+        for row in model.objects.using(alias).order_by('pk'):
+            slug, number = row.slug, 1
+            while slug in taken:
+                number += 1
+                slug = '{0}-{1}'.format(row.slug, number)
+            taken.add(slug)
+            if slug != row.slug:
+                model.objects.using(alias).filter(pk=row.pk).update(slug=slug)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honest', '0018_person_ranking_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(number_duplicate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='area',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='area',
+            index=models.Index(fields=['-views'], name='area_views_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['-views'], name='category_views_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.0.13 on 2026-10-18 16:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_slugs(apps, schema_editor):
+    Person = apps.get_model('honest', 'Person')
+    Category = apps.get_model('honest', 'Category')
+    Area = apps.get_model('honest', 'Area')
+    Person.objects.using(schema_editor.connection.alias).update(
+        service_slug=Subquery(Category.objects.filter(pk=OuterRef('service_id')).values('slug')[:1]),
+        location_slug=Subquery(Area.objects.filter(pk=OuterRef('location_id')).values('slug')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honest', '0019_unique_slugs_and_view_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='service_slug',
+            field=models.SlugField(db_index=False, default='', editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='location_slug',
+            field=models.SlugField(db_index=False, default='', editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_slugs, migrations.RunPython.noop),
+    ]
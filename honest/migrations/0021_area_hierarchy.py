@@ -0,0 +1,47 @@
+# Generated by Django 2.0.13 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_areas_to_themselves(apps, schema_editor):
+    """every existing area becomes a top level area, its people and counts stay where they are"""
+    Area = apps.get_model('honest', 'Area')
+    AreaClosure = apps.get_model('honest', 'AreaClosure')
+    alias = schema_editor.connection.alias
+    AreaClosure.objects.using(alias).bulk_create(
+        [AreaClosure(ancestor_id=pk, descendant_id=pk, depth=0)
+         for pk in Area.objects.using(alias).values_list('pk', flat=True).iterator()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('honest', '0020_person_url_slugs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='area',
+            name='parent',
+            field=models.ForeignKey(blank=True, help_text='The area this one is in, if any', null=True,
+                                    on_delete=django.db.models.deletion.PROTECT, related_name='children',
+                                    to='honest.Area'),
+        ),
+        migrations.CreateModel(
+            name='AreaClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE,
+                                               related_name='descendant_links', to='honest.Area')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                 related_name='ancestor_links', to='honest.Area')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='areaclosure',
+            unique_together={('ancestor', 'descendant')},
+        ),
+        migrations.RunPython(link_areas_to_themselves, migrations.RunPython.noop),
+    ]
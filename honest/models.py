@@ -1,48 +1,139 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.core.exceptions import ValidationError
 from django.core.validators import MinLengthValidator
-from django.db.models import Sum
+from django.db.models import Count, F, Q, Sum
+from django.urls import reverse
 from django.utils import timezone
 from django.template.defaultfilters import slugify
 import datetime
 
+from honest.hll import HyperLogLog
+from honest.ranking import person_score
+
+
+def clean_name(name):
+    """category and area names can't contain "/", it would break their urls"""
+    return name.replace("/", "-")
+
+
+def unique_slug(instance, name):
+    """slug for name that no other row of the instance's model has, numbered when names differ only in case or
+    punctuation"""
+    base = slugify(name) or instance._meta.model_name
+    slug, number = base, 1
+    others = type(instance).objects.exclude(pk=instance.pk)
+    while others.filter(slug=slug).exists():
+        number += 1
+        slug = '{0}-{1}'.format(base, number)
+    return slug
+
 
 # Create your models here.
-class Category(models.Model):
+class UniqueVisitorsModel(models.Model):
+    """abstract base for models whose pages count unique visitors in a fixed size HyperLogLog sketch"""
+    visitors_hll = models.BinaryField(default=b'', editable=False)
+
+    class Meta:
+        abstract = True
+
+    def visitors_sketch(self):
+        return HyperLogLog(self.visitors_hll)
+
+    def unique_views(self):
+        """estimated number of unique visitors to this object's page"""
+        return self.visitors_sketch().count()
+
+
+class Category(UniqueVisitorsModel):
     category = models.CharField(max_length=100, unique=True, default='General',
                                 help_text="Category of Service Provided")
     views = models.IntegerField(default=0)
-    slug = models.SlugField()
+    slug = models.SlugField(unique=True)
+
+    class Meta:
+        # the home page lists the most viewed
+        indexes = [
+            models.Index(fields=['-views'], name='category_views_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         """override save function to add a slug on creationm updates slug on namechange"""
-        self.category = self.category.replace("/", "-")
-        self.slug = slugify(self.category)
+        self.category = clean_name(self.category)
+        self.slug = unique_slug(self, self.category)
         super(Category, self).save(*args, **kwargs)
 
     def __str__(self):
         return self.category
 
 
-class Area(models.Model):
+class Area(UniqueVisitorsModel):
     state = models.CharField(max_length=100, unique=True, default='Nigeria')
     views = models.IntegerField(default=0)
-    slug = models.SlugField()
-    """ commented out, states are unique and cant have multiple areas
-    area = models.CharField(max_length=100, unique=True, null=True)
-    """
+    slug = models.SlugField(unique=True)
+    # the area this one is part of, a town's LGA or an LGA's state, none for a state. names stay unique across
+    # the whole tree so an area can still be found by name alone
+    parent = models.ForeignKey('self', on_delete=models.PROTECT, null=True, blank=True, related_name='children',
+                               help_text='The area this one is in, if any')
+
+    class Meta:
+        # the home page lists the most viewed
+        indexes = [
+            models.Index(fields=['-views'], name='area_views_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        """override save function to add a slug on creationm updates slug on namechange"""
-        self.state = self.state.replace("/", "-")
-        self.slug = slugify(self.state)
-        super(Area, self).save(*args, **kwargs)
+        """override save function to add a slug on creationm updates slug on namechange, and keep the area's
+        place in the tree in AreaClosure, moving everything inside it along when its parent changes"""
+        self.state = clean_name(self.state)
+        self.slug = unique_slug(self, self.state)
+        update_fields = kwargs.get('update_fields')
+        adding = self._state.adding
+        with transaction.atomic():
+            moved = not adding and (update_fields is None or 'parent' in update_fields) and Area.objects.filter(
+                pk=self.pk).exclude(parent_id=self.parent_id).exists()
+            if moved:
+                previous_ancestors = AreaClosure.ancestor_ids(self.pk)
+            super(Area, self).save(*args, **kwargs)
+            if adding:
+                AreaClosure.insert(self)
+            elif moved:
+                AreaClosure.move(self)
+                AreaCategoryStats.move_area(self.pk, previous_ancestors, AreaClosure.ancestor_ids(self.pk))
+
+    def clean(self):
+        if self.pk and self.parent_id and AreaClosure.objects.filter(ancestor_id=self.pk,
+                                                                     descendant_id=self.parent_id).exists():
+            raise ValidationError({'parent': "An area can't be inside itself or an area inside it"})
+
+    def subtree(self):
+        """ids of this area and every area inside it at any depth, as a subquery"""
+        return AreaClosure.objects.filter(ancestor_id=self.pk).values('descendant_id')
 
     def __str__(self):
         return self.state
 
 
-class Person(models.Model):
+# running review aggregates kept on each person, one histogram field per star rating
+STAR_COUNT_FIELDS = {
+    1: 'one_star_count',
+    2: 'two_star_count',
+    3: 'three_star_count',
+    4: 'four_star_count',
+    5: 'five_star_count',
+}
+RATING_AGGREGATE_FIELDS = ['rating_sum', 'review_count'] + list(STAR_COUNT_FIELDS.values()) + ['rating', 'score']
+
+
+def review_aggregates():
+    """expressions that compute a person's review aggregates from their reviews, for aggregate() or annotate()"""
+    aggregates = {'rating_sum': Sum('rating'), 'review_count': Count('id')}
+    for stars, field in STAR_COUNT_FIELDS.items():
+        aggregates[field] = Count('id', filter=Q(rating=stars))
+    return aggregates
+
+
+class Person(UniqueVisitorsModel):
     service = models.ForeignKey(
         Category, on_delete=models.PROTECT, related_name='service', help_text='Service')
     location = models.ForeignKey(
@@ -60,10 +151,47 @@ class Person(models.Model):
     upvotes = models.IntegerField(default=0)
     downvotes = models.IntegerField(default=0)
     rating = models.FloatField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    review_count = models.IntegerField(default=0)
+    one_star_count = models.IntegerField(default=0)
+    two_star_count = models.IntegerField(default=0)
+    three_star_count = models.IntegerField(default=0)
+    four_star_count = models.IntegerField(default=0)
+    five_star_count = models.IntegerField(default=0)
+    # ranking score from votes and reviews, see honest/ranking.py
+    score = models.FloatField(default=0, editable=False)
+    # copies of the category and area slugs, so the person's url is built without loading either. renaming a
+    # category or an area updates them, see honest/signals.py
+    service_slug = models.SlugField(editable=False, db_index=False)
+    location_slug = models.SlugField(editable=False, db_index=False)
+
+    class Meta:
+        # listings are paged by (score, id) within a category, an area or both
+        indexes = [
+            models.Index(fields=['service', 'score', 'id'], name='person_service_score_idx'),
+            models.Index(fields=['location', 'score', 'id'], name='person_location_score_idx'),
+            models.Index(fields=['service', 'location', 'score', 'id'], name='person_svc_loc_score_idx'),
+        ]
 
     def __str__(self):
         return self.first_name
 
+    def save(self, *args, **kwargs):
+        """override save to keep the ranking score in step with the votes and review aggregates, and the url
+        slugs with the category and area"""
+        self.score = person_score(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'service', 'location'} & set(update_fields):
+            self.service_slug = self.service.slug
+            self.location_slug = self.location.slug
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'service_slug', 'location_slug'}
+        super(Person, self).save(*args, **kwargs)
+
+    def get_absolute_url(self):
+        """the person's one canonical url, other slugs in the url are redirected here"""
+        return reverse('honest:person', args=[self.location_slug, self.service_slug, self.pk])
+
     def recently_added(self):
         """returns true if this person was added within the last 10 days"""
         now = timezone.now()
@@ -74,12 +202,42 @@ class Person(models.Model):
         return self.upvotes > self.downvotes
 
     def set_average_rating(self):
-        if self.review_set.all():
-            rating_sum = self.review_set.all().aggregate(
-                Sum('rating'))['rating__sum']
-            rating_count = self.review_set.all().count()
-            self.rating = round(rating_sum/rating_count, 2)
-            self.save()
+        """recomputes the review aggregates and rating from scratch with a single query over this person's reviews"""
+        aggregates = self.review_set.aggregate(**review_aggregates())
+        for field, value in aggregates.items():
+            setattr(self, field, value or 0)
+        self.rating = self.average_rating()
+        self.save(update_fields=RATING_AGGREGATE_FIELDS)
+
+    def average_rating(self):
+        """mean of all review ratings from the running aggregates, 0 when there are no reviews"""
+        if not self.review_count:
+            return 0
+        return round(self.rating_sum / self.review_count, 2)
+
+    def apply_review_rating(self, rating, delta):
+        """adds (delta=1) or removes (delta=-1) one review rating from the running aggregates.
+        the row is locked and updated in place, so the cost doesn't depend on how many reviews the person has"""
+        with transaction.atomic():
+            current = Person.objects.select_for_update().filter(pk=self.pk).values(
+                'service_id', 'location_id', 'upvotes', 'downvotes', *RATING_AGGREGATE_FIELDS).first()
+            if current is None:
+                # person is being deleted along with their reviews
+                return
+            AreaCategoryStats.adjust(current['location_id'], current['service_id'],
+                                     reviews=delta, rating_sum=rating * delta)
+            for field, value in current.items():
+                setattr(self, field, value)
+            self.rating_sum += rating * delta
+            self.review_count += delta
+            star_field = STAR_COUNT_FIELDS[rating]
+            setattr(self, star_field, getattr(self, star_field) + delta)
+            self.rating = self.average_rating()
+            self.save(update_fields=RATING_AGGREGATE_FIELDS)
+
+    def star_histogram(self):
+        """list of (stars, number of reviews) pairs from 5 stars down to 1"""
+        return [(stars, getattr(self, STAR_COUNT_FIELDS[stars])) for stars in sorted(STAR_COUNT_FIELDS, reverse=True)]
 
     def avg_rating(self):
         if self.rating == 0.0:
@@ -88,12 +246,127 @@ class Person(models.Model):
             return self.rating
 
 
+class AreaCategoryStats(models.Model):
+    """number of people, reviews and their rating total for each area and category pair that has had people, an
+    area's counting everyone in the areas inside it too. kept up to date as people and reviews change, so the facet
+    lists on listing pages are one indexed lookup at any level of the area tree"""
+    area = models.ForeignKey(Area, on_delete=models.CASCADE, related_name='category_stats')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='area_stats')
+    people_count = models.IntegerField(default=0)
+    review_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+
+    class Meta:
+        # the unique index serves a category's areas, the second index an area's categories
+        unique_together = ('category', 'area')
+        indexes = [
+            models.Index(fields=['area', 'category'], name='stats_area_category_idx'),
+        ]
+
+    def __str__(self):
+        return '{0} in {1}'.format(self.category_id, self.area_id)
+
+    def average_rating(self):
+        """mean of every review rating given to people in this area and category, 0 when there are none"""
+        if not self.review_count:
+            return 0
+        return round(self.rating_sum / self.review_count, 2)
+
+    @classmethod
+    def adjust(cls, area_id, category_id, people=0, reviews=0, rating_sum=0):
+        """adds the given changes to a pair's counts in place, and to the pairs of every area the area is inside,
+        so an area's counts cover everything in it"""
+        for counted_area_id in [area_id] + AreaClosure.ancestor_ids(area_id):
+            cls.adjust_one(counted_area_id, category_id, people, reviews, rating_sum)
+
+    @classmethod
+    def adjust_one(cls, area_id, category_id, people=0, reviews=0, rating_sum=0):
+        """adds the given changes to one pair's counts in place, creating its row the first time it is needed"""
+        changes = {'people_count': F('people_count') + people, 'review_count': F('review_count') + reviews,
+                   'rating_sum': F('rating_sum') + rating_sum}
+        if cls.objects.filter(area_id=area_id, category_id=category_id).update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(area_id=area_id, category_id=category_id, people_count=people,
+                                   review_count=reviews, rating_sum=rating_sum)
+        except IntegrityError:
+            # another request created the row first
+            cls.objects.filter(area_id=area_id, category_id=category_id).update(**changes)
+
+    @classmethod
+    def move_area(cls, area_id, previous_ancestor_ids, ancestor_ids):
+        """an area moved to another parent with everything inside it. its own counts cover the lot, they come off
+        the areas it is no longer inside and go onto the ones it is now inside"""
+        left = set(previous_ancestor_ids) - set(ancestor_ids)
+        joined = set(ancestor_ids) - set(previous_ancestor_ids)
+        for stats in cls.objects.filter(area_id=area_id):
+            for areas, sign in ((left, -1), (joined, 1)):
+                for ancestor_id in areas:
+                    cls.adjust_one(ancestor_id, stats.category_id, people=sign * stats.people_count,
+                                   reviews=sign * stats.review_count, rating_sum=sign * stats.rating_sum)
+
+
+class AreaClosure(models.Model):
+    """a closure table of the area tree: a row for every area and each area it is inside, at the number of levels
+    between them, and one linking each area to itself at depth 0. the areas inside an area at any depth are then
+    one indexed lookup, and so are the people in them. kept up to date by Area.save"""
+    ancestor = models.ForeignKey(Area, on_delete=models.CASCADE, related_name='descendant_links', db_index=False)
+    descendant = models.ForeignKey(Area, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        # the unique index finds an area's subtree, the descendant's own index the areas it is inside
+        unique_together = ('ancestor', 'descendant')
+
+    def __str__(self):
+        return '{0} in {1}'.format(self.descendant_id, self.ancestor_id)
+
+    @classmethod
+    def ancestor_ids(cls, area_id):
+        """ids of the areas this one is inside, not counting itself"""
+        return list(cls.objects.filter(descendant_id=area_id, depth__gt=0).values_list('ancestor_id', flat=True))
+
+    @classmethod
+    def insert(cls, area):
+        """links a new area to itself and to its parent and everything its parent is inside"""
+        links = [cls(ancestor_id=area.pk, descendant_id=area.pk, depth=0)]
+        if area.parent_id is not None:
+            links += [cls(ancestor_id=ancestor_id, descendant_id=area.pk, depth=depth + 1) for ancestor_id, depth
+                      in cls.objects.filter(descendant_id=area.parent_id).values_list('ancestor_id', 'depth')]
+        cls.objects.bulk_create(links)
+
+    @classmethod
+    def move(cls, area):
+        """relinks an area and everything inside it under the area's new parent"""
+        subtree = dict(cls.objects.filter(ancestor_id=area.pk).values_list('descendant_id', 'depth'))
+        if area.parent_id in subtree:
+            raise ValueError("{0} can't be moved inside itself".format(area))
+        # the links within the subtree stay, the ones to the areas it was inside go
+        cls.objects.filter(descendant_id__in=list(subtree)).exclude(ancestor_id__in=list(subtree)).delete()
+        if area.parent_id is not None:
+            ancestors = cls.objects.filter(descendant_id=area.parent_id).values_list('ancestor_id', 'depth')
+            cls.objects.bulk_create([cls(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=above + below + 1)
+                                     for ancestor_id, above in ancestors for descendant_id, below in subtree.items()])
+
+
 class UserProfile(User):
 
     def __str__(self):
         return self.username
 
 
+class ImportProgress(models.Model):
+    """how many rows of a bulk import source have been committed, updated in the same transaction as the rows"""
+    source = models.CharField(max_length=255, unique=True)
+    rows_done = models.IntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.source
+
+
 class Review(models.Model):
     ONE_STAR = 1
     TWO_STARS = 2
@@ -117,5 +390,23 @@ class Review(models.Model):
     review_text = models.CharField(max_length=360, blank=True)
     date_added = models.DateField(auto_now_add=True)
 
+    class Meta:
+        # a person's reviews are paged newest first by (date_added, id)
+        indexes = [
+            models.Index(fields=['person', 'date_added', 'id'], name='review_person_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """override save to update the person's rating aggregates in the same transaction as the review"""
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                # an edited review takes its old rating out of the aggregates before the new one goes in
+                previous = Review.objects.filter(pk=self.pk).values('person_id', 'rating').first()
+            super(Review, self).save(*args, **kwargs)
+            if previous:
+                Person(pk=previous['person_id']).apply_review_rating(previous['rating'], -1)
+            self.person.apply_review_rating(self.rating, 1)
+
     def __str__(self):
         return self.summary
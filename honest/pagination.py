@@ -0,0 +1,99 @@
+"""
+keyset (cursor) pagination.
+
+pages are fetched with a WHERE clause on the ordering keys of the last row shown rather than an OFFSET, so any page
+costs the same as the first one provided an index covers the filter and ordering. the ordering must end in a
+unique field (normally id) so every row has exactly one place in it.
+"""
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'honest.pagination'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    """one page of results with cursors for the pages either side of it"""
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _key(item, fields):
+    """ordering key values of a model instance or a values() row"""
+    if isinstance(item, dict):
+        return [item[field] for field in fields]
+    return [getattr(item, field) for field in fields]
+
+
+def _encode(direction, item, fields):
+    # values go in as strings and come back out through each field's to_python, so dates survive the trip
+    return signing.dumps([direction, [str(value) for value in _key(item, fields)]], salt=CURSOR_SALT)
+
+
+def _decode(cursor, fields, model):
+    try:
+        direction, values = signing.loads(cursor, salt=CURSOR_SALT)
+        values = [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+    except (signing.BadSignature, ValueError, TypeError) as error:
+        raise InvalidCursor("invalid page cursor") from error
+    if direction not in ('next', 'prev') or len(values) != len(fields):
+        raise InvalidCursor("invalid page cursor")
+    return direction, values
+
+
+def _after(ordering, values, reverse=False):
+    """filter matching rows that come after values in ordering (or before them if reverse)"""
+    condition = Q()
+    equal = {}
+    for order, value in zip(ordering, values):
+        field = order.lstrip('-')
+        descending = order.startswith('-') != reverse
+        condition |= Q(**equal, **{'{0}__{1}'.format(field, 'lt' if descending else 'gt'): value})
+        equal[field] = value
+    return condition
+
+
+def keyset_paginate(queryset, ordering, cursor=None, per_page=20):
+    """returns the KeysetPage of queryset, ordered by the list of fields in ordering, that cursor points at.
+    no cursor means the first page, a cursor that doesn't decode raises InvalidCursor"""
+    fields = [order.lstrip('-') for order in ordering]
+    model = queryset.model
+    direction, values = _decode(cursor, fields, model) if cursor else ('next', None)
+
+    if direction == 'next':
+        if values is not None:
+            queryset = queryset.filter(_after(ordering, values))
+        items = list(queryset.order_by(*ordering)[:per_page + 1])
+        has_more, has_less = len(items) > per_page, values is not None
+        items = items[:per_page]
+    else:
+        # walk backwards from the cursor with the ordering flipped, then put the page back in order
+        reversed_ordering = [order[1:] if order.startswith('-') else '-' + order for order in ordering]
+        items = list(queryset.filter(_after(ordering, values, reverse=True))
+                     .order_by(*reversed_ordering)[:per_page + 1])
+        has_more, has_less = True, len(items) > per_page
+        items = items[:per_page][::-1]
+
+    if not items:
+        return KeysetPage(items)
+    return KeysetPage(items,
+                      next_cursor=_encode('next', items[-1], fields) if has_more else None,
+                      previous_cursor=_encode('prev', items[0], fields) if has_less else None)
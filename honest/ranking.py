@@ -0,0 +1,106 @@
+"""
+Ranking people by how sure we can be that they are good, not by their raw average rating.
+
+Votes and reviews are treated as judgements: a vote is one fully positive or negative judgement and a review is
+(stars - 1) / 4 of a positive one, so 5 stars is fully positive and 1 star fully negative. A person's score is the
+lower bound of the Wilson score interval on the positive share of their judgements. With few judgements the bound is
+low, so one 5 star review (0.21) ranks below two hundred reviews averaging 4.8 (0.91).
+
+The score is stored on each person and kept current as votes and reviews change, listings order by it through the
+(service/location, score, id) indexes. recompute_scores() works it out again for every person in vectorized batches.
+"""
+import math
+
+import numpy
+from django.db import connections, transaction
+
+# z for a 95% confidence interval
+Z = 1.96
+# scores are stored rounded, a recomputed score within a rounding step of the stored one is left alone
+SCORE_DIGITS = 6
+# people ranked best first, id breaks ties so every person has one place
+LEADERBOARD_ORDERING = ['-score', '-id']
+# how many people are read per recompute batch and written per UPDATE statement
+RECOMPUTE_BATCH_SIZE = 10000
+UPDATE_BATCH_SIZE = 500
+
+
+def wilson_lower_bound(positive, total):
+    if total <= 0:
+        return 0.0
+    share = positive / total
+    z2 = Z * Z
+    centre = share + z2 / (2 * total)
+    spread = Z * math.sqrt((share * (1 - share) + z2 / (4 * total)) / total)
+    return round((centre - spread) / (1 + z2 / total), SCORE_DIGITS)
+
+
+def score(rating_sum, review_count, upvotes, downvotes):
+    positive = (rating_sum - review_count) / 4 + upvotes
+    return wilson_lower_bound(positive, review_count + upvotes + downvotes)
+
+
+def person_score(person):
+    return score(person.rating_sum, person.review_count, person.upvotes, person.downvotes)
+
+
+def score_arrays(rating_sum, review_count, upvotes, downvotes):
+    """score() over whole arrays at once, equal element for element up to the last rounded digit"""
+    total = review_count + upvotes + downvotes
+    # people with no judgements score 0, dividing by 1 instead keeps the arithmetic warning free
+    safe_total = numpy.where(total > 0, total, 1)
+    share = ((rating_sum - review_count) / 4 + upvotes) / safe_total
+    z2 = Z * Z
+    centre = share + z2 / (2 * safe_total)
+    spread = Z * numpy.sqrt((share * (1 - share) + z2 / (4 * safe_total)) / safe_total)
+    scores = numpy.round((centre - spread) / (1 + z2 / safe_total), SCORE_DIGITS)
+    return numpy.where(total > 0, scores, 0.0)
+
+
+def leaderboard(people, category=None, area=None, limit=10):
+    """the best scored limit people, optionally only those in a category, an area or both"""
+    if category is not None:
+        people = people.filter(service=category)
+    if area is not None:
+        people = people.filter(location=area)
+    return people.order_by(*LEADERBOARD_ORDERING)[:limit]
+
+
+def recompute_scores(people, batch_size=RECOMPUTE_BATCH_SIZE):
+    """works the score out again for every person in the people queryset, in primary key batches.
+    each batch is read into arrays, scored in one vectorized pass and only the scores that changed are written.
+    returns (people checked, scores changed)"""
+    checked = changed = 0
+    last_pk = 0
+    while True:
+        rows = list(people.filter(pk__gt=last_pk).order_by('pk').values_list(
+            'pk', 'rating_sum', 'review_count', 'upvotes', 'downvotes', 'score')[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        pks, rating_sum, review_count, upvotes, downvotes, stored = numpy.array(rows, dtype=float).T
+        scores = score_arrays(rating_sum, review_count, upvotes, downvotes)
+        stale = ~numpy.isclose(scores, stored, rtol=0, atol=10 ** -SCORE_DIGITS)
+        with transaction.atomic(using=people.db):
+            write_scores(people, pks[stale].astype(int).tolist(), scores[stale].tolist())
+        checked += len(rows)
+        changed += int(stale.sum())
+    return checked, changed
+
+
+def write_scores(people, pks, scores):
+    """writes new scores in as few statements as the database allows. a CASE per batch, as the view counters use,
+    costs more to build and evaluate than the scoring itself at this size"""
+    connection = connections[people.db]
+    table = connection.ops.quote_name(people.model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for start in range(0, len(pks), UPDATE_BATCH_SIZE):
+                rows = list(zip(pks[start:start + UPDATE_BATCH_SIZE], scores[start:start + UPDATE_BATCH_SIZE]))
+                cursor.execute(
+                    'UPDATE {0} SET score = new.score FROM (VALUES {1}) AS new (id, score) WHERE {0}.id = new.id'
+                    .format(table, ', '.join(['(%s, %s::double precision)'] * len(rows))),
+                    [value for row in rows for value in row])
+        else:
+            # sqlite prepares the statement once and runs it per row without leaving the process
+            cursor.executemany('UPDATE {0} SET score = %s WHERE id = %s'.format(table), list(zip(scores, pks)))
@@ -0,0 +1,64 @@
+"""
+primary and read replica routing.
+
+writes always go to the primary, the default database. reads go to a replica only while ReplicaMiddleware is
+handling a GET or HEAD request from someone who hasn't written anything recently, and only outside transactions
+on the primary, so anything that reads in order to write (view count flushes, review aggregates, get_or_create)
+reads what it is about to change. management commands and the shell only ever use the primary.
+
+a request that writes, any POST, pins its user to the primary for HONEST_REPLICA_PIN_SECONDS with a signed
+cookie, long enough for the replicas to catch up, so a new review or person shows up on the very next page.
+anything cached under a generation is built from the primary, see reading_primary. replicas are listed by alias
+in HONEST_DATABASE_REPLICAS, see settings.py.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# the replica the request being handled on this thread reads from, None to read from the primary
+state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'HONEST_DATABASE_REPLICAS', [])
+
+
+def choose_replica():
+    """a replica for one request to read from, the whole request reads from the same one so it sees one
+    consistent copy of the data"""
+    aliases = replicas()
+    return random.choice(aliases) if aliases else None
+
+
+@contextmanager
+def reading_primary():
+    """reads inside go to the primary. for anything kept around under a generation, like cached pages and the
+    in-memory taxonomy: built from a replica that is behind, it would be remembered as current"""
+    replica, state.replica = getattr(state, 'replica', None), None
+    try:
+        yield
+    finally:
+        state.replica = replica
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(state, 'replica', None)
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every database holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from the primary along with the data
+        return db not in replicas()
@@ -0,0 +1,188 @@
+"""
+full-text search over people, categories, areas and reviews.
+
+every searchable object is one document (title, body) in an inverted index table kept in the same database:
+an FTS5 virtual table on SQLite and a table with a GIN indexed tsvector column on Postgres. each document's row id
+is worked out from its kind and primary key, so saving or deleting an object updates its document with a single
+primary key lookup. signals in honest/signals.py keep the index in step with the models, and the
+rebuild_search_index command rebuilds it from scratch.
+"""
+import re
+
+from django.db import connection as default_connection
+
+from honest.models import Area, Category, Person, Review
+
+INDEX_TABLE = 'honest_search'
+
+# document row id = primary key * len(KINDS) + kind number
+KINDS = ('person', 'category', 'area', 'review')
+MODEL_KINDS = {Person: 'person', Category: 'category', Area: 'area', Review: 'review'}
+
+
+def document_id(kind, pk):
+    return pk * len(KINDS) + KINDS.index(kind)
+
+
+def document(instance):
+    """(row id, kind, object id, title, body) of the search document for a model instance"""
+    kind = MODEL_KINDS[type(instance)]
+    if kind == 'person':
+        title, body = '{0} {1}'.format(instance.first_name, instance.last_name), ''
+    elif kind == 'category':
+        title, body = instance.category, ''
+    elif kind == 'area':
+        title, body = instance.state, ''
+    else:
+        title, body = instance.summary, instance.review_text
+    return document_id(kind, instance.pk), kind, instance.pk, title, body
+
+
+def search_terms(query):
+    """words of a user's query, the last one matched as a prefix so results show up while typing"""
+    return re.findall(r'\w+', query.lower())[:10]
+
+
+class SQLiteSearchBackend:
+
+    def __init__(self, connection, table=INDEX_TABLE):
+        self.connection = connection
+        self.table = table
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5("
+                "kind UNINDEXED, object_id UNINDEXED, title, body, tokenize='unicode61 remove_diacritics 1')"
+                .format(self.table))
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS {0}".format(self.table))
+
+    def add(self, documents):
+        """adds or replaces documents, a list of document() tuples"""
+        with self.connection.cursor() as cursor:
+            # fts5 tables don't support upserts, so replaced documents are deleted first
+            cursor.executemany("DELETE FROM {0} WHERE rowid = %s".format(self.table),
+                               [(document[0],) for document in documents])
+            cursor.executemany("INSERT INTO {0} (rowid, kind, object_id, title, body) VALUES (%s, %s, %s, %s, %s)"
+                               .format(self.table), documents)
+
+    def remove(self, document_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany("DELETE FROM {0} WHERE rowid = %s".format(self.table),
+                               [(document_id,) for document_id in document_ids])
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {0}".format(self.table))
+
+    def optimize(self):
+        """merges the index's segments after a bulk load"""
+        with self.connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {0} ({0}) VALUES ('optimize')".format(self.table))
+
+    def search(self, terms, limit):
+        """[(kind, object id)] best match first"""
+        match = ' '.join('"{0}"'.format(term) for term in terms) + '*'
+        with self.connection.cursor() as cursor:
+            # bm25 weights matches in the title ten times as much as matches in the body
+            cursor.execute("SELECT kind, object_id FROM {0} WHERE {0} MATCH %s "
+                           "ORDER BY bm25({0}, 0, 0, 10.0, 1.0) LIMIT %s".format(self.table), [match, limit])
+            return cursor.fetchall()
+
+
+class PostgresSearchBackend:
+
+    # simple configuration, names and places shouldn't be stemmed as english words
+    DOCUMENT = "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')"
+
+    def __init__(self, connection, table=INDEX_TABLE):
+        self.connection = connection
+        self.table = table
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS {0} (id bigint PRIMARY KEY, kind varchar(10) NOT NULL, "
+                           "object_id integer NOT NULL, document tsvector NOT NULL)".format(self.table))
+            cursor.execute("CREATE INDEX IF NOT EXISTS {0}_document_idx ON {0} USING gin (document)"
+                           .format(self.table))
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS {0}".format(self.table))
+
+    def add(self, documents):
+        with self.connection.cursor() as cursor:
+            cursor.executemany("INSERT INTO {0} (id, kind, object_id, document) VALUES (%s, %s, %s, {1}) "
+                               "ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document"
+                               .format(self.table, self.DOCUMENT), documents)
+
+    def remove(self, document_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {0} WHERE id = ANY(%s)".format(self.table), [list(document_ids)])
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("TRUNCATE {0}".format(self.table))
+
+    def optimize(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("ANALYZE {0}".format(self.table))
+
+    def search(self, terms, limit):
+        query = ' & '.join(terms) + ':*'
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT kind, object_id FROM {0}, to_tsquery('simple', %s) query "
+                           "WHERE document @@ query ORDER BY ts_rank_cd(document, query) DESC, id LIMIT %s"
+                           .format(self.table), [query, limit])
+            return cursor.fetchall()
+
+
+BACKENDS = {'sqlite': SQLiteSearchBackend, 'postgresql': PostgresSearchBackend}
+
+
+def get_backend(connection=None, table=INDEX_TABLE):
+    """search backend for the database behind connection, None if search isn't supported there"""
+    connection = connection or default_connection
+    if connection.vendor not in BACKENDS:
+        return None
+    return BACKENDS[connection.vendor](connection, table)
+
+
+def index_objects(instances):
+    """adds or updates the search documents of model instances"""
+    backend = get_backend()
+    if backend and instances:
+        backend.add([document(instance) for instance in instances])
+
+
+def unindex_objects(instances):
+    backend = get_backend()
+    if backend and instances:
+        backend.remove([document_id(MODEL_KINDS[type(instance)], instance.pk) for instance in instances])
+
+
+def search(query, limit=30):
+    """ranked search results for a user's query, best match first, as a list of (kind, model instance)"""
+    terms = search_terms(query)
+    backend = get_backend()
+    if not terms or not backend:
+        return []
+    hits = backend.search(terms, limit)
+
+    # load the matching objects with one query per kind, joining what the results page shows. it doesn't show
+    # unique visitors, so their sketches are left behind
+    querysets = {
+        'person': Person.objects.select_related('service', 'location').defer(
+            'visitors_hll', 'service__visitors_hll', 'location__visitors_hll'),
+        'category': Category.objects.defer('visitors_hll'),
+        'area': Area.objects.defer('visitors_hll'),
+        'review': Review.objects.select_related('person').defer('person__visitors_hll'),
+    }
+    wanted = {}
+    for kind, pk in hits:
+        wanted.setdefault(kind, []).append(pk)
+    found = {kind: querysets[kind].in_bulk(pks) for kind, pks in wanted.items()}
+    return [(kind, found[kind][pk]) for kind, pk in hits if pk in found[kind]]
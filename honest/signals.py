@@ -0,0 +1,139 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from honest import search, taxonomy
+from honest.caching import HOME_PAGE_KEY, TAXONOMY, bump_generation, bump_generations, pages_showing_person
+from honest.counters import view_counts_flushed
+from honest.models import Area, AreaCategoryStats, Category, Person, Review, RATING_AGGREGATE_FIELDS
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_aggregates(sender, instance, **kwargs):
+    """take a deleted review's rating out of its person's aggregates.
+    post_delete also fires for queryset and cascade deletes, and runs inside the delete's transaction"""
+    Person(pk=instance.person_id).apply_review_rating(instance.rating, -1)
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Area)
+@receiver(post_save, sender=Review)
+def update_search_document(sender, instance, raw=False, update_fields=None, **kwargs):
+    """keep the object's search document in step with it, inside the save's transaction"""
+    if raw or (sender is Person and update_fields and set(update_fields) <= set(RATING_AGGREGATE_FIELDS)):
+        # rating updates save a Person(pk=...) with nothing but the aggregates, and the document doesn't use them
+        return
+    search.index_objects([instance])
+
+
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Area)
+@receiver(post_delete, sender=Review)
+def remove_search_document(sender, instance, **kwargs):
+    search.unindex_objects([instance])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Area)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Area)
+def taxonomy_changed(sender, **kwargs):
+    """category and area names are held in memory by every worker, tell them all to reload"""
+    bump_generation(TAXONOMY)
+    cache.delete(HOME_PAGE_KEY)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Area)
+def update_person_url_slugs(sender, instance, created, raw=False, **kwargs):
+    """a renamed category or area gets a new slug, copy it to the people in it so their urls follow.
+    their pages are all cached under the taxonomy generation, which the rename bumps"""
+    if raw or created:
+        return
+    foreign_key, slug_field = ('service', 'service_slug') if sender is Category else ('location', 'location_slug')
+    Person.objects.filter(**{foreign_key: instance}).exclude(**{slug_field: instance.slug}).update(
+        **{slug_field: instance.slug})
+
+
+@receiver(view_counts_flushed)
+def refresh_home_page_lists(sender, counts, **kwargs):
+    """new category or area views can change the home page's top 10s"""
+    if Category in counts or Area in counts:
+        cache.delete(HOME_PAGE_KEY)
+    # and this worker's copies of their view counts, other workers catch up within HONEST_SLUG_CACHE_MAX_AGE
+    for model in counts:
+        if model in taxonomy.RESOLVERS:
+            taxonomy.RESOLVERS[model].invalidate()
+
+
+def person_pages(person_id):
+    """generations of the pages a person is on now, none if they are gone"""
+    slugs = Person.objects.filter(pk=person_id).values_list('service_slug', 'location_slug').first()
+    if not slugs:
+        return []
+    return pages_showing_person(person_id, slugs[0], taxonomy.areas.lineage_slugs(slugs[1]))
+
+
+@receiver(pre_save, sender=Person)
+def remember_person_pages(sender, instance, update_fields=None, **kwargs):
+    """note the pages a person is on before the save, in case it moves them to another category or area"""
+    instance._previous_pages = []
+    if instance.pk and (update_fields is None or {'service', 'location'} & set(update_fields)):
+        instance._previous_pages = person_pages(instance.pk)
+
+
+@receiver(post_save, sender=Person)
+def person_pages_changed(sender, instance, update_fields=None, raw=False, **kwargs):
+    """drop cached pages showing this person, wherever they were before and are now"""
+    if raw or (update_fields and set(update_fields) <= set(RATING_AGGREGATE_FIELDS)):
+        # rating updates come from review saves, which drop the same pages themselves
+        return
+    bump_generations(set(getattr(instance, '_previous_pages', []) + person_pages(instance.pk)))
+
+
+@receiver(post_delete, sender=Person)
+def deleted_person_pages_changed(sender, instance, **kwargs):
+    bump_generations(pages_showing_person(instance.pk, instance.service_slug,
+                                          taxonomy.areas.lineage_slugs(instance.location_slug)))
+
+
+@receiver(pre_save, sender=Person)
+def remember_person_facet(sender, instance, update_fields=None, raw=False, **kwargs):
+    """note which area and category a person was counted in before the save, in case it moves them"""
+    instance._previous_facet = None
+    if not raw and instance.pk and (update_fields is None or {'service', 'location'} & set(update_fields)):
+        instance._previous_facet = Person.objects.filter(pk=instance.pk).values(
+            'location_id', 'service_id', 'review_count', 'rating_sum').first()
+
+
+@receiver(post_save, sender=Person)
+def count_person_in_facet(sender, instance, created, raw=False, **kwargs):
+    """count a new person in their area and category, or move a person's counts to their new pair.
+    review counts follow reviews as they are saved, see Person.apply_review_rating"""
+    previous = getattr(instance, '_previous_facet', None)
+    if raw or not (created or previous):
+        return
+    if previous:
+        if (previous['location_id'], previous['service_id']) == (instance.location_id, instance.service_id):
+            return
+        AreaCategoryStats.adjust(previous['location_id'], previous['service_id'], people=-1,
+                                 reviews=-previous['review_count'], rating_sum=-previous['rating_sum'])
+    counts = previous or {'review_count': instance.review_count, 'rating_sum': instance.rating_sum}
+    AreaCategoryStats.adjust(instance.location_id, instance.service_id, people=1,
+                             reviews=counts['review_count'], rating_sum=counts['rating_sum'])
+
+
+@receiver(post_delete, sender=Person)
+def uncount_deleted_person(sender, instance, **kwargs):
+    """the person's reviews are deleted first and take themselves out of the counts on the way"""
+    AreaCategoryStats.adjust(instance.location_id, instance.service_id, people=-1)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_pages_changed(sender, instance, raw=False, **kwargs):
+    """a review changes the person's page and their rating on every listing they are in"""
+    if not raw:
+        bump_generations(person_pages(instance.person_id))
@@ -0,0 +1,127 @@
+"""
+static files as collectstatic builds them for production.
+
+on top of what whitenoise's CompressedManifestStaticFilesStorage already does, fingerprinting every file with a
+hash of its contents and writing gzip and brotli copies beside it, stylesheets are minified before they are hashed,
+and every jpeg and png gets copies resized to each of HONEST_IMAGE_WIDTHS narrower than itself, as the same format
+and as webp, plus a full size webp. the copies are hashed and served like any other static file, so whitenoise
+sends them all with a year long immutable Cache-Control.
+
+which copies were made for which image is written to responsive.json in STATIC_ROOT, for the responsive_image
+template tag to build srcset attributes from. with any other storage, e.g. while developing, there are no copies
+and the tag falls back to a plain img.
+"""
+import io
+import json
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# what Pillow calls each format the copies are saved as, and the arguments it saves them with
+SAVE_OPTIONS = {
+    '.jpg': ('JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+    '.jpeg': ('JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+    '.png': ('PNG', {'optimize': True}),
+    '.webp': ('WEBP', {'quality': 80}),
+}
+
+# strings are kept whole, comments dropped, whitespace around braces, semicolons, commas and after colons
+# dropped along with the semicolon before a closing brace, and any other run of whitespace becomes one space
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/|\s*(?:;\s*)?(})\s*|\s*([{;,])\s*|'''
+                        r'''(:)\s+|(\s+)''', re.S)
+
+
+def minify_css(css):
+    def token(match):
+        string, close, punctuation, colon, space = match.groups()
+        return string or close or punctuation or colon or (' ' if space else '')
+    return CSS_TOKENS.sub(token, css).strip()
+
+
+def variant_name(name, width, extension):
+    """honest/images/logo.jpg -> honest/images/logo-320w.webp, the full size copy has no width"""
+    root = os.path.splitext(name)[0]
+    return '{0}-{1}w{2}'.format(root, width, extension) if width else root + extension
+
+
+class OptimizedStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    variants_name = 'responsive.json'
+
+    def __init__(self, *args, **kwargs):
+        super(OptimizedStaticFilesStorage, self).__init__(*args, **kwargs)
+        self._variants = None
+        self._variants_lock = threading.Lock()
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super(OptimizedStaticFilesStorage, self).post_process(paths, dry_run=dry_run, **options)
+            return
+        variants = {}
+        for name, (storage, path) in list(paths.items()):
+            extension = os.path.splitext(name)[1].lower()
+            if extension == '.css':
+                self.minify(name, storage, path)
+                paths[name] = (self, name)
+            elif extension in IMAGE_EXTENSIONS:
+                variants[name] = self.resize(name, storage, path)
+                for width, copy in variants[name]['images'][:-1] + variants[name]['webp']:
+                    paths[copy] = (self, copy)
+        yield from super(OptimizedStaticFilesStorage, self).post_process(paths, dry_run=dry_run, **options)
+        self.replace(self.variants_name, json.dumps(variants, sort_keys=True).encode())
+
+    def replace(self, name, content):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(content))
+
+    def minify(self, name, storage, path):
+        # read from where it was collected from, the copy in STATIC_ROOT may already be minified
+        with storage.open(path) as original:
+            css = original.read().decode('utf-8')
+        self.replace(name, minify_css(css).encode('utf-8'))
+
+    def resize(self, name, storage, path):
+        """saves the copies of one image, returning its size and the [width, name] of each copy, largest last"""
+        with storage.open(path) as original:
+            image = Image.open(io.BytesIO(original.read()))
+            image.load()
+        extension = os.path.splitext(name)[1].lower()
+        width, height = image.size
+        widths = sorted(w for w in getattr(settings, 'HONEST_IMAGE_WIDTHS', [320, 640, 1280]) if w < width)
+        images, webp = [], []
+        for target in widths + [width]:
+            resized = image if target == width else image.resize((target, round(height * target / width)),
+                                                                  Image.LANCZOS)
+            if target != width:
+                images.append([target, self.save_image(resized, variant_name(name, target, extension), extension)])
+            webp_name = variant_name(name, target if target != width else None, '.webp')
+            webp.append([target, self.save_image(resized, webp_name, '.webp')])
+        images.append([width, name])
+        return {'width': width, 'height': height, 'images': images, 'webp': webp}
+
+    def save_image(self, image, name, extension):
+        image_format, options = SAVE_OPTIONS[extension]
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, image_format, **options)
+        self.replace(name, output.getvalue())
+        return name
+
+    def variants(self, name):
+        """what post_process recorded for the image called name, None if it made no copies of it"""
+        if self._variants is None:
+            with self._variants_lock:
+                try:
+                    with self.open(self.variants_name) as recorded:
+                        self._variants = json.loads(recorded.read().decode('utf-8'))
+                except (IOError, ValueError):
+                    # collectstatic hasn't been run
+                    self._variants = {}
+        return self._variants.get(name)
@@ -0,0 +1,133 @@
+"""
+category and area lookups by slug, answered from memory.
+
+each worker keeps every category's and area's id, name, slug and views in a dict keyed by slug, so resolving the
+slug in a url costs no queries, and neither does a slug that doesn't exist: anything missing from the dict is
+known not to be in the table. the dicts are reloaded when the taxonomy generation moves on, which saving or
+deleting a category or an area does for every worker sharing the cache (see honest/caching.py), and at least every
+HONEST_SLUG_CACHE_MAX_AGE seconds so the view counts shown on their pages keep up with the flushed views.
+
+areas are held with their parent, so the areas around one in the tree, the ones it is inside and the ones directly
+inside it, come from memory too.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+from django.http import Http404
+
+from honest.caching import TAXONOMY, get_generation
+from honest.models import Area, Category
+from honest.routers import reading_primary
+
+FIELDS = ['id', 'slug', 'views']
+
+
+class SlugResolver:
+    """slug -> row of one small model, reloaded whenever the taxonomy generation changes"""
+
+    def __init__(self, model, name_field, max_age, tree=False):
+        self.model = model
+        # from_db takes the values in the model's field order
+        self.field_names = [field.attname for field in model._meta.concrete_fields
+                            if field.attname in FIELDS + [name_field] + (['parent_id'] if tree else [])]
+        self.slug_index = self.field_names.index('slug')
+        self.id_index = self.field_names.index('id')
+        self.name_index = self.field_names.index(name_field)
+        self.parent_index = self.field_names.index('parent_id') if tree else None
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._rows = None
+        self._by_id = self._children = {}
+        self._generation = None
+        self._loaded = 0
+
+    def rows(self):
+        generation = get_generation(TAXONOMY)
+        if self._rows is None or generation != self._generation or time.monotonic() - self._loaded > self.max_age:
+            with self._lock, reading_primary():
+                rows = list(self.model.objects.order_by().values_list(*self.field_names))
+                self._by_id = {row[self.id_index]: row for row in rows}
+                children = {}
+                if self.parent_index is not None:
+                    for row in sorted(rows, key=lambda row: row[self.name_index]):
+                        children.setdefault(row[self.parent_index], []).append(row)
+                self._children = children
+                self._rows = {row[self.slug_index]: row for row in rows}
+                self._generation, self._loaded = generation, time.monotonic()
+        return self._rows
+
+    def resolve(self, slug):
+        """a fresh instance of the row with this slug, None if there is none. the fields that aren't held in
+        memory are deferred, so they are loaded if used and left alone if the instance is saved"""
+        row = self.rows().get(slug)
+        if row is None:
+            return None
+        return self.model.from_db(DEFAULT_DB_ALIAS, self.field_names, row)
+
+    def attach(self, objects, foreign_key):
+        """sets foreign_key on each of objects from memory, found by the slug copied onto them as
+        <foreign_key>_slug, so listings needn't join the model in. the generation is checked once for the lot"""
+        rows = self.rows()
+        instances = {}
+        for instance in objects:
+            slug = getattr(instance, foreign_key + '_slug')
+            if slug not in instances:
+                row = rows.get(slug)
+                instances[slug] = row and self.model.from_db(DEFAULT_DB_ALIAS, self.field_names, row)
+            related = instances[slug]
+            # a row missing or with another id is a change not seen yet, loading it the usual way is still right
+            if related is not None and related.pk == getattr(instance, foreign_key + '_id'):
+                setattr(instance, foreign_key, related)
+        return objects
+
+    def lineage(self, slug):
+        """the rows of the one called slug and of each one it is inside, innermost first"""
+        rows = self.rows()
+        row, lineage = rows.get(slug), []
+        # bounded in case a half seen move left a loop
+        while row is not None and len(lineage) <= len(rows):
+            lineage.append(row)
+            row = self._by_id.get(row[self.parent_index])
+        return lineage
+
+    def lineage_slugs(self, slug):
+        """slug and the slugs of everything it is inside, for the pages that show what is in any of them"""
+        return [slug] + [row[self.slug_index] for row in self.lineage(slug)[1:]]
+
+    def ancestors(self, instance):
+        """fresh instances of what instance is inside, outermost first"""
+        return [self.model.from_db(DEFAULT_DB_ALIAS, self.field_names, row)
+                for row in reversed(self.lineage(instance.slug)[1:])]
+
+    def children(self, instance):
+        """fresh instances of what is directly inside instance, by name"""
+        self.rows()
+        return [self.model.from_db(DEFAULT_DB_ALIAS, self.field_names, row)
+                for row in self._children.get(instance.pk, [])]
+
+    def get_or_404(self, slug):
+        instance = self.resolve(slug)
+        if instance is None:
+            raise Http404("No {0} called {1}".format(self.model._meta.verbose_name, slug))
+        return instance
+
+    def invalidate(self):
+        self._rows = None
+
+
+max_age = getattr(settings, 'HONEST_SLUG_CACHE_MAX_AGE', 30)
+categories = SlugResolver(Category, 'category', max_age)
+areas = SlugResolver(Area, 'state', max_age, tree=True)
+RESOLVERS = {Category: categories, Area: areas}
+
+
+def warm():
+    """loads every lookup up front so a worker's first requests don't pay for it"""
+    try:
+        for resolver in RESOLVERS.values():
+            resolver.rows()
+    except DatabaseError:
+        # tables don't exist yet, e.g. before the first migrate, they get loaded on first use instead
+        pass
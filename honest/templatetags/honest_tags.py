@@ -0,0 +1,40 @@
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.contrib.staticfiles.templatetags.staticfiles import static
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from honest.caching import HOLE_MARKER, HOLE_TEMPLATE
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name):
+    """renders honest/holes/<name>.html in place, or leaves a marker for it when the page is being rendered as a
+    shared shell for the page cache. anything that depends on the logged in user belongs in a hole"""
+    request = context.get('request')
+    if getattr(request, 'punch_holes', False):
+        return mark_safe(HOLE_MARKER.format(name))
+    return context.template.engine.get_template(HOLE_TEMPLATE.format(name)).render(context)
+
+
+@register.simple_tag
+def responsive_image(name, alt, sizes='100vw', **attributes):
+    """an img of the static image called name, wrapped in a picture offering the webp and resized copies
+    collectstatic made of it, see honest/storage.py, for the browser to pick from by sizes. the img's other
+    attributes are passed as keyword arguments, width and height default to the image's own"""
+    variants = getattr(staticfiles_storage, 'variants', None)
+    recorded = variants(name) if variants else None
+    if recorded is None:
+        return format_html('<img src="{0}" alt="{1}"{2}>', static(name), alt, flatatt(attributes))
+    if 'width' not in attributes and 'height' not in attributes:
+        attributes.update(width=recorded['width'], height=recorded['height'])
+
+    def srcset(images):
+        return ', '.join('{0} {1}w'.format(static(image), width) for width, image in images)
+    return format_html('<picture><source type="image/webp" srcset="{0}" sizes="{1}">'
+                       '<img src="{2}" srcset="{3}" sizes="{1}" alt="{4}"{5}></picture>',
+                       srcset(recorded['webp']), sizes, static(name), srcset(recorded['images']), alt,
+                       flatatt(attributes))
@@ -0,0 +1,22 @@
+"""
+the test runner honest's tests run with, see TEST_RUNNER in settings.py.
+
+pages link their static files through static(), which with the production storage needs the manifest collectstatic
+writes, and the tests don't run collectstatic. so the whole test run uses the plain storage, and StaticAssetsTest
+builds the production one itself.
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class HonestTestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super(HonestTestRunner, self).setup_test_environment(**kwargs)
+        self.static_storage = override_settings(
+            STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+        self.static_storage.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.static_storage.disable()
+        super(HonestTestRunner, self).teardown_test_environment(**kwargs)
@@ -1,7 +1,39 @@
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.db.models import Count, F
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles.templatetags.staticfiles import static
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from honest.autocomplete import AUTOCOMPLETERS, PrefixIndex
+from honest.caching import cache_page_shell
+from honest.counters import ViewCountBuffer, view_counts
+from honest import admission, metrics, routers, taxonomy
+from honest.hll import HyperLogLog
+from honest.management.commands.benchmark_views import Recorder, compare
+from honest.pagination import InvalidCursor, keyset_paginate
+from honest.ranking import person_score, score, score_arrays
+from honest.routers import PrimaryReplicaRouter
+from honest.search import get_backend, search
+from honest.storage import minify_css
 from honest.forms import PersonForm, CategoryForm, AreaForm, UserForm, ReviewsForm
-from .models import Category, Area, Person, UserProfile, Review
+from PIL import Image
+from .models import AreaCategoryStats, AreaClosure, Category, Area, ImportProgress, Person, UserProfile, Review
 import datetime
+import io
+import numpy
+import json
+import os
+import tempfile
+import re
+import time
+import sqlite3
 
 
 # Create your tests here.
@@ -36,6 +68,49 @@ def create_review(person, rating, summary, review_text):
     return Review.objects.create(person=person, rating=rating, summary=summary, review_text=review_text)
 
 
+def create_people(category, areas, count):
+    """adds count people to an existing category, spread across the areas given"""
+    return [Person.objects.create(service=category, location=areas[i % len(areas)], first_name="Person%d" % i,
+                                  last_name="Test", phone_number="012345678912", email="tester@yahoo.com")
+            for i in range(count)]
+
+
+def warm_taxonomy():
+    """loads the in-memory category and area lookups, as a worker does when it starts"""
+    taxonomy.warm()
+
+
+# a cache every process can see, like the redis server workers share in production
+SHARED_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                             'LOCATION': os.path.join(tempfile.gettempdir(), 'honest-test-cache')}}
+
+
+def in_other_worker(function):
+    """runs function in a forked child process, another worker of the same server. the child has its own copy of
+    the test database, so only what it does to the shared cache reaches this process. True if function returned"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            function()
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+    return os.waitpid(pid, 0)[1] == 0
+
+
+class QueryBudgetMixin:
+    """test helper that fails when a view runs more sql queries than it is allowed"""
+
+    def get_within_query_budget(self, url, budget):
+        """GETs url and fails if the request ran more than budget queries, returns (response, queries run)"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        if len(queries) > budget:
+            self.fail("{0} ran {1} queries, budget is {2}:\n{3}".format(
+                url, len(queries), budget, "\n".join(query['sql'] for query in queries.captured_queries)))
+        return response, len(queries)
+
+
 class CategoryModelTest(TestCase):
 
     def test_slug_created_with_new_category(self):
@@ -80,6 +155,42 @@ class PersonModelTest(TestCase):
         person.set_average_rating()
         self.assertEqual(person.rating, 0)
 
+    def test_review_save_updates_aggregates(self):
+        """saving a review adds its rating to the person's running sum, count and star histogram"""
+        person = create_person(service="Clown", location="Disneyland", first_name="Psycho")
+        create_review(person=person, rating=4, summary="Great", review_text="Did a good Job")
+        create_review(person=person, rating=5, summary="Excellent", review_text="Thoroughly impressed")
+        person.refresh_from_db()
+        self.assertEqual((person.rating_sum, person.review_count, person.rating), (9, 2, 4.5))
+        self.assertEqual(person.star_histogram(), [(5, 1), (4, 1), (3, 0), (2, 0), (1, 0)])
+
+    def test_review_edit_and_delete_update_aggregates(self):
+        """editing a review swaps its old rating for the new one, deleting it takes the rating out"""
+        person = create_person(service="Clown", location="Disneyland", first_name="Psycho")
+        review = create_review(person=person, rating=2, summary="Meh", review_text="")
+        create_review(person=person, rating=4, summary="Great", review_text="")
+        review.rating = 5
+        review.save()
+        person.refresh_from_db()
+        self.assertEqual((person.rating_sum, person.two_star_count, person.five_star_count), (9, 0, 1))
+        Review.objects.filter(pk=review.pk).delete()
+        person.refresh_from_db()
+        self.assertEqual((person.rating_sum, person.review_count, person.five_star_count, person.rating),
+                         (4, 1, 0, 4.0))
+
+    def test_backfill_rating_aggregates(self):
+        """backfill command finds and fixes people whose stored aggregates drifted from their reviews"""
+        person = create_person(service="Clown", location="Disneyland", first_name="Psycho")
+        create_review(person=person, rating=3, summary="Ok", review_text="")
+        Person.objects.filter(pk=person.pk).update(rating_sum=0, review_count=0, three_star_count=0, rating=0)
+        with self.assertRaises(CommandError):
+            call_command('backfill_rating_aggregates', '--verify', stdout=io.StringIO())
+        call_command('backfill_rating_aggregates', '--batch-size', '1', stdout=io.StringIO())
+        person.refresh_from_db()
+        self.assertEqual((person.rating_sum, person.review_count, person.three_star_count, person.rating),
+                         (3, 1, 1, 3.0))
+        call_command('backfill_rating_aggregates', '--verify', stdout=io.StringIO())
+
     def test_avg_rating_with_no_rating(self):
         """avg_rating() returns 'Not rated yet' when rating does not exist (rating = 0.0)"""
         person = create_person(service="Clown", location="Disneyland", views=5, upvotes=4, downvotes=6, rating=0.0)
@@ -202,4 +313,1364 @@ class ReviewsFormTest(TestCase):
     def test_blank_data(self):
         """blank data should render form invalid"""
         form = ReviewsForm({})
-        self.assertFalse(form.is_valid())
\ No newline at end of file
+        self.assertFalse(form.is_valid())
+
+
+class ListingQueryBudgetTest(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        # a full local memory cache culls entries, generations included, which would reload the taxonomy
+        cache.clear()
+        self.category = create_category("Clown")
+        self.areas = [create_area("Area %d" % i) for i in range(5)]
+
+    def assert_fixed_query_count(self, url, budget):
+        """the number of queries should not grow with the number of people listed"""
+        create_people(self.category, self.areas, 1)
+        # the in-memory taxonomy is loaded once per worker, not per page
+        warm_taxonomy()
+        response, few_queries = self.get_within_query_budget(url, budget)
+        self.assertEqual(response.status_code, 200)
+        create_people(self.category, self.areas, 30)
+        # start a fresh visit so page view counting does the same work both times
+        self.client.cookies.clear()
+        response, many_queries = self.get_within_query_budget(url, budget)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(few_queries, many_queries)
+
+    def test_category_query_budget(self):
+        """category view runs the same small number of queries however many people it lists"""
+        self.assert_fixed_query_count(reverse('honest:category', args=[self.category.slug]), 8)
+
+    def test_area_query_budget(self):
+        """area view runs the same small number of queries however many people it lists"""
+        self.assert_fixed_query_count(reverse('honest:area', args=[self.areas[0].slug]), 8)
+
+    def test_category_in_area_query_budget(self):
+        """category_in_area view runs the same small number of queries however many people it lists"""
+        self.assert_fixed_query_count(
+            reverse('honest:category_in_area', args=[self.areas[0].slug, self.category.slug]), 8)
+
+    def test_listings_leave_visitor_sketches_behind(self):
+        """people listings and search results don't load the unique visitor sketches they never show"""
+        create_people(self.category, self.areas, 3)
+        Area.objects.create(state="Town", parent=self.areas[0])
+        for url, data in ((reverse('honest:category', args=[self.category.slug]), None),
+                          (reverse('honest:area', args=[self.areas[0].slug]), None),
+                          (reverse('honest:category_in_area', args=[self.areas[1].slug, self.category.slug]), None),
+                          (reverse('honest:search'), {'q': 'person0'})):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url, data).status_code, 200)
+            people = [query['sql'] for query in queries if 'FROM "honest_person"' in query['sql']]
+            self.assertTrue(people, url)
+            for sql in people:
+                self.assertNotIn('visitors_hll', sql.split(' FROM ')[0], url)
+
+    def test_category_lists_distinct_areas(self):
+        """each area should be listed once on the category page, however many people are in it"""
+        create_people(self.category, self.areas[:2], 6)
+        response = self.client.get(reverse('honest:category', args=[self.category.slug]))
+        self.assertEqual([(facet.area.state, facet.people_count) for facet in response.context['areas']],
+                         [("Area 0", 3), ("Area 1", 3)])
+
+
+
+class AreaCategoryStatsTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        self.category = create_category("Plumber")
+        self.lagos, self.abuja = create_area("Lagos"), create_area("Abuja")
+
+    def counts(self, area):
+        stats = AreaCategoryStats.objects.get(area=area, category=self.category)
+        return stats.people_count, stats.review_count, stats.rating_sum
+
+    def test_counts_follow_people_and_reviews(self):
+        """adding, editing and deleting reviews and people keeps the pair's counts right"""
+        first, second = create_people(self.category, [self.lagos], 2)
+        review = create_review(person=first, rating=5, summary="Quick", review_text="")
+        create_review(person=second, rating=2, summary="Slow", review_text="")
+        self.assertEqual(self.counts(self.lagos), (2, 2, 7))
+        review.rating = 3
+        review.save()
+        self.assertEqual(self.counts(self.lagos), (2, 2, 5))
+        self.assertEqual(AreaCategoryStats.objects.get(area=self.lagos).average_rating(), 2.5)
+        second.delete()
+        self.assertEqual(self.counts(self.lagos), (1, 1, 3))
+
+    def test_moving_a_person_moves_their_counts(self):
+        """a person moved to another area takes their reviews' counts with them"""
+        person = create_people(self.category, [self.lagos], 1)[0]
+        create_review(person=person, rating=4, summary="Fine", review_text="")
+        person.refresh_from_db()
+        person.location = self.abuja
+        person.save()
+        self.assertEqual(self.counts(self.lagos), (0, 0, 0))
+        self.assertEqual(self.counts(self.abuja), (1, 1, 4))
+
+    def test_rebuild_command_fixes_stale_counts(self):
+        """the rebuild command recounts every pair from people and reviews"""
+        person = create_people(self.category, [self.lagos], 1)[0]
+        create_review(person=person, rating=4, summary="Fine", review_text="")
+        AreaCategoryStats.objects.update(people_count=9, rating_sum=1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_area_category_stats', '--verify', stdout=io.StringIO())
+        call_command('rebuild_area_category_stats', stdout=io.StringIO())
+        self.assertEqual(self.counts(self.lagos), (1, 1, 4))
+        call_command('rebuild_area_category_stats', '--verify', stdout=io.StringIO())
+
+    def test_rebuild_locks_before_counting(self):
+        """the stored counts are locked, in the same transaction, before people and reviews are counted"""
+        create_people(self.category, [self.lagos], 1)
+        with CaptureQueriesContext(connection) as queries:
+            call_command('rebuild_area_category_stats', stdout=io.StringIO())
+        statements = [query['sql'] for query in queries]
+        locked = next(n for n, sql in enumerate(statements) if 'FROM "honest_areacategorystats"' in sql)
+        counted = next(n for n, sql in enumerate(statements) if 'FROM "honest_person"' in sql)
+        self.assertLess(locked, counted)
+        self.assertTrue(any(sql.startswith('SAVEPOINT') for sql in statements[:locked]))
+
+    def test_category_in_area_header(self):
+        """the pair page shows how many people it has and their average rating"""
+        person = create_people(self.category, [self.lagos], 1)[0]
+        create_review(person=person, rating=4, summary="Fine", review_text="")
+        response = self.client.get(reverse('honest:category_in_area', args=[self.lagos.slug, self.category.slug]))
+        self.assertContains(response, "1 people, rated 4.0 on average from 1 reviews")
+        response = self.client.get(reverse('honest:category_in_area', args=[self.abuja.slug, self.category.slug]))
+        self.assertContains(response, "0 people, rated 0 on average from 0 reviews")
+
+
+class RankingTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        self.category = create_category("Mechanic")
+        self.area = create_area("Kano")
+
+    def test_confidence_beats_a_single_review(self):
+        """one 5 star review ranks below two hundred reviews averaging 4.8, and votes count too"""
+        self.assertLess(score(5, 1, 0, 0), score(960, 200, 0, 0))
+        self.assertLess(score(0, 0, 1, 0), score(0, 0, 50, 2))
+        self.assertEqual(score(0, 0, 0, 0), 0)
+
+    def test_vectorized_scores_match(self):
+        """the array version gives the same scores as the one used on save"""
+        rng = numpy.random.RandomState(1)
+        review_count = rng.randint(0, 50, 1000).astype(float)
+        rating_sum = review_count + numpy.floor(rng.random_sample(1000) * review_count * 4)
+        upvotes, downvotes = rng.randint(0, 20, 1000).astype(float), rng.randint(0, 5, 1000).astype(float)
+        expected = [score(*row) for row in zip(rating_sum, review_count, upvotes, downvotes)]
+        numpy.testing.assert_allclose(score_arrays(rating_sum, review_count, upvotes, downvotes), expected,
+                                      atol=1e-6)
+
+    def test_score_follows_reviews_and_votes(self):
+        """reviews and vote changes saved on a person update their score"""
+        person = create_people(self.category, [self.area], 1)[0]
+        create_review(person=person, rating=5, summary="Fixed it", review_text="")
+        person.refresh_from_db()
+        self.assertEqual(person.score, score(5, 1, 0, 0))
+        person.upvotes = 4
+        person.save()
+        person.refresh_from_db()
+        self.assertEqual(person.score, score(5, 1, 4, 0))
+
+    def test_listings_and_api_rank_by_score(self):
+        """listing pages and the people api with ordering=score put the best ranked first"""
+        one_review, many_reviews, unrated = create_people(self.category, [self.area], 3)
+        create_review(person=one_review, rating=5, summary="Great", review_text="")
+        for _ in range(5):
+            create_review(person=many_reviews, rating=4, summary="Good", review_text="")
+        expected = [many_reviews.pk, one_review.pk, unrated.pk]
+        response = self.client.get(reverse('honest:category', args=[self.category.slug]))
+        self.assertEqual([person.pk for person in response.context['people']], expected)
+        response = self.client.get(reverse('honest:api_list', args=['people']),
+                                   {'ordering': 'score', 'area': self.area.slug, 'fields': 'id', 'limit': 2})
+        self.assertEqual([row['id'] for row in response.json()['results']], expected[:2])
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([row['id'] for row in response.json()['results']], expected[2:])
+        response = self.client.get(reverse('honest:api_list', args=['areas']), {'ordering': 'score'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_recompute_scores(self):
+        """the recompute command puts back scores changed behind the model's back"""
+        people = create_people(self.category, [self.area], 3)
+        create_review(person=people[0], rating=3, summary="Okay", review_text="")
+        Person.objects.update(upvotes=2, score=0)
+        call_command('recompute_scores', '--batch-size', '2', stdout=io.StringIO())
+        for person in Person.objects.all():
+            self.assertAlmostEqual(person.score, person_score(person), places=6)
+            self.assertGreater(person.score, 0)
+
+
+class GenerateDataTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+
+    def generate(self, seed=1):
+        call_command('generate_data', '--categories', '5', '--areas', '4', '--people', '300', '--reviews', '3000',
+                     '--reviewers', '20', '--batch-size', '100', '--seed', str(seed), stdout=io.StringIO())
+
+    def test_generated_data_is_consistent(self):
+        """generated people carry the same aggregates, scores and facet counts the models would have kept"""
+        self.generate()
+        self.assertEqual(Person.objects.count(), 300)
+        self.assertAlmostEqual(Review.objects.count(), 3000, delta=300)
+        self.assertEqual(UserProfile.objects.count(), 20)
+        call_command('backfill_rating_aggregates', '--verify', stdout=io.StringIO())
+        call_command('rebuild_area_category_stats', '--verify', stdout=io.StringIO())
+        # the most popular category by zipf has the most people
+        busiest = Category.objects.annotate(people=Count('service')).order_by('-people').first()
+        self.assertEqual(busiest.category, "Tailor")
+        self.assertFalse(Person.objects.exclude(service_slug=F('service__slug'), location_slug=F('location__slug'))
+                         .exists())
+        person = Person.objects.first()
+        self.assertEqual(search("{0} {1}".format(person.first_name, person.last_name))[0][0], 'person')
+
+    def test_seeds_repeat(self):
+        """the same seed generates the same people and ratings again"""
+        def fingerprint():
+            return list(Person.objects.order_by('pk').values_list('first_name', 'service__category', 'rating_sum'))
+        self.generate(seed=7)
+        first = fingerprint()
+        Person.objects.all().delete()
+        self.generate(seed=7)
+        self.assertEqual(fingerprint(), first)
+
+
+class BenchmarkRankingTest(TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.NamedTemporaryFile(suffix='.sqlite3')
+        self.addCleanup(self.scratch.close)
+        connections.databases['bench'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.scratch.name}
+        self.addCleanup(connections.databases.pop, 'bench')
+        self.addCleanup(connections['bench'].close)
+        call_command('migrate', 'honest', database='bench', verbosity=0)
+
+    def test_database_keeps_what_the_run_did_not_add(self):
+        """with --database only the rows the run inserted are removed, quietly, the default database untouched"""
+        person = create_person(service="Tailor", location="Kano", first_name="Funke")
+        # saved without signals, which would write to the default database
+        Category.objects.using('bench').bulk_create([Category(category="Tailor", slug="tailor")])
+        Area.objects.using('bench').bulk_create([Area(state="Kano", slug="kano")])
+        Person.objects.using('bench').bulk_create([Person(service_id=1, location_id=1, first_name="Kept",
+                                                          last_name="Here", phone_number="08031234567")])
+        call_command('benchmark_ranking', '--database', 'bench', '--people', 30, '--saves', 5, '--queries', 5,
+                     stdout=io.StringIO())
+        self.assertEqual(list(Person.objects.using('bench').values_list('first_name', flat=True)), ["Kept"])
+        self.assertEqual(list(Category.objects.using('bench').values_list('category', flat=True)), ["Tailor"])
+        self.assertEqual(search("funke"), [('person', person)])
+        self.assertEqual(AreaCategoryStats.objects.get().people_count, 1)
+
+
+class BenchmarkComparisonTest(TestCase):
+
+    def test_regressions(self):
+        """an extra query always counts, times only when they grow by the threshold and a whole millisecond"""
+        before = {'p50_ms': 2.0, 'p95_ms': 4.0, 'query_ms': 0.5, 'template_ms': 1.0, 'queries': 3,
+                  'peak_memory_kb': 100}
+        self.assertEqual(compare({'category': before}, {'category': dict(before, p50_ms=2.9, queries=3)}, 0.2), [])
+        self.assertEqual(compare({'category': before}, {'category': dict(before, p95_ms=5.5, queries=4)}, 0.2),
+                         ["category: 4 queries, was 3", "category: p95_ms 5.50, was 4.00"])
+        self.assertEqual(compare({'category': before}, {}, 0.2), [])
+
+    def test_nested_renders_timed_once(self):
+        """form widgets render through the template backend inside the page, only the page's render is counted"""
+        context = {'form': AreaForm()}
+        render_to_string('honest/add_area.html', context)
+        recorder = Recorder()
+        with recorder.timing_templates():
+            started = time.perf_counter()
+            render_to_string('honest/add_area.html', context)
+            elapsed = time.perf_counter() - started
+        self.assertLessEqual(recorder.template_seconds, elapsed)
+
+
+@override_settings(HONEST_METRICS_TOKEN='scrape')
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        saved = metrics.registry.directory, metrics.registry.views
+        metrics.registry.directory, metrics.registry.views = self.directory.name, {}
+        self.addCleanup(setattr, metrics.registry, 'directory', saved[0])
+        self.addCleanup(setattr, metrics.registry, 'views', saved[1])
+        self.category = create_category("Plumber")
+
+    def test_server_timing(self):
+        """every response says how long its sql, templates and the whole request took"""
+        response = self.client.get(reverse('honest:category', args=[self.category.slug]))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="[1-9]\d* queries", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+        self.assertNotEqual(re.search(r'tpl;dur=([\d.]+)', timing).group(1), '0.00')
+
+    def test_metrics_per_view(self):
+        """requests are counted under their url name, with their queries, latency bucket and bytes"""
+        self.client.get(reverse('honest:category', args=[self.category.slug]))
+        self.client.get(reverse('honest:category', args=[self.category.slug]))
+        self.client.get('/no/such/page')
+        text = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION="Bearer scrape").content.decode()
+        self.assertIn('honest_requests_total{view="honest:category"} 2', text)
+        self.assertIn('honest_request_duration_seconds_bucket{view="honest:category",le="+Inf"} 2', text)
+        self.assertIn('honest_requests_total{view="unmatched"} 1', text)
+        queries = re.search(r'honest_db_queries_total\{view="honest:category"\} (\d+)', text)
+        self.assertGreater(int(queries.group(1)), 0)
+        self.assertRegex(text, r'honest_response_bytes_total\{view="honest:category"\} [1-9]')
+
+    def test_metrics_need_staff_or_the_token(self):
+        """anonymous visitors, users who aren't staff and wrong tokens are refused"""
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer guess").status_code, 403)
+        user = UserProfile.objects.create_user(username="bob", password="bobsleighs")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.settings(HONEST_METRICS_TOKEN=None):
+            self.assertEqual(Client().get(url, HTTP_AUTHORIZATION="Bearer None").status_code, 403)
+
+    def test_workers_are_summed(self):
+        """the files other worker processes wrote are added to this one's totals"""
+        self.client.get(reverse('honest:category', args=[self.category.slug]))
+        metrics.registry.flush()
+        with open(metrics.registry.path()) as mine:
+            other = json.load(mine)
+        # the process that started the tests stands in for another running worker
+        with open(os.path.join(self.directory.name, metrics.worker_file_name(os.getppid())), 'w') as theirs:
+            json.dump(other, theirs)
+        views = metrics.registry.collect()
+        self.assertEqual(views['honest:category']['requests'], 2)
+        self.assertEqual(sum(views['honest:category']['buckets']), 2)
+
+    def test_exited_workers_are_retired(self):
+        """the files of exited workers are folded into one and removed, without their totals going missing or
+        counting twice, and a new worker with an old one's pid writes a file of its own"""
+        self.client.get(reverse('honest:category', args=[self.category.slug]))
+        metrics.registry.flush()
+        with open(metrics.registry.path()) as mine:
+            totals = mine.read()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        # an exited worker, and one that had this process's pid before it
+        exited = ['worker-{0}-x1.json'.format(pid), 'worker-{0}-1.json'.format(os.getpid())]
+        for name in exited:
+            with open(os.path.join(self.directory.name, name), 'w') as theirs:
+                theirs.write(totals)
+        for _ in range(2):
+            self.assertEqual(metrics.registry.collect()['honest:category']['requests'], 3)
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         sorted(['collect.lock', 'retired.json', os.path.basename(metrics.registry.path())]))
+
+
+class StaticAssetsTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(StaticAssetsTest, cls).setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.static = override_settings(STATIC_ROOT=cls.directory.name, DEBUG=False,
+                                       STATICFILES_STORAGE='honest.storage.OptimizedStaticFilesStorage')
+        cls.static.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.static.disable()
+        cls.directory.cleanup()
+        super(StaticAssetsTest, cls).tearDownClass()
+
+    def read(self, name):
+        with open(os.path.join(self.directory.name, name), 'rb') as stream:
+            return stream.read()
+
+    def test_minify_css(self):
+        """comments and whitespace go, strings are left exactly as they were"""
+        css = ("/* theme */\na ,\nb {\n\tcolor : red;\n\tcontent: \"  ;  } \" ;\n}\n"
+               "@media (max-width: 600px) { p { margin: 0 } }")
+        self.assertEqual(minify_css(css),
+                         'a,b{color :red;content:"  ;  } "}@media (max-width:600px){p{margin:0}}')
+
+    def test_stylesheets_hashed_minified_and_compressed(self):
+        """the stylesheets are served under their content hash, minified, with gzip and brotli copies"""
+        with open(os.path.join(self.directory.name, 'staticfiles.json')) as manifest:
+            hashed = json.load(manifest)['paths']['honest/themedstyle.css']
+        self.assertRegex(hashed, r'^honest/themedstyle\.[0-9a-f]{12}\.css$')
+        css = self.read(hashed).decode()
+        self.assertNotIn('\n', css)
+        # references to images are rewritten to their hashed names too
+        self.assertRegex(css, r'url\("images/arrow\.[0-9a-f]{12}\.gif"\)')
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, hashed + '.gz')))
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, hashed + '.br')))
+
+    def test_immutable_and_brotli(self):
+        """hashed files are cached for good and sent brotli compressed to browsers that take it"""
+        response = Client().get(static('honest/themedstyle.css'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Content-Encoding'], 'br')
+
+    def test_image_variants(self):
+        """narrower jpeg and webp copies are made of each image, and none wider than it"""
+        variants = json.loads(self.read('responsive.json').decode())['honest/images/logoidea.jpg']
+        self.assertEqual((variants['width'], variants['height']), (1856, 1280))
+        self.assertEqual([width for width, name in variants['webp']], [320, 640, 1280, 1856])
+        self.assertEqual(variants['images'][-1], [1856, 'honest/images/logoidea.jpg'])
+        small = Image.open(io.BytesIO(self.read('honest/images/logoidea-320w.webp')))
+        self.assertEqual((small.format, small.size), ('WEBP', (320, 221)))
+        self.assertEqual([width for width, name in json.loads(self.read('responsive.json').decode())
+                          ['honest/images/Honest.jpg']['images']], [320, 580])
+
+    def test_responsive_image_tag(self):
+        """the tag offers every copy in srcset, by their hashed names"""
+        html = Template("{% load honest_tags %}{% responsive_image 'honest/images/logoidea.jpg' 'Honest' "
+                        "sizes='44px' height=30 %}").render(Context())
+        self.assertIn('<source type="image/webp" srcset="/static/honest/images/logoidea-320w.', html)
+        self.assertRegex(html, r'<img src="/static/honest/images/logoidea\.[0-9a-f]{12}\.jpg" '
+                               r'srcset="[^"]*logoidea-1280w\.[0-9a-f]{12}\.jpg 1280w, [^"]* 1856w" sizes="44px" '
+                               r'alt="Honest" height="30">')
+
+    def test_plain_img_without_variants(self):
+        """without collectstatic's copies the tag is a plain img"""
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            html = Template("{% load honest_tags %}{% responsive_image 'honest/images/logoidea.jpg' '' %}").render(
+                Context())
+        self.assertEqual(html, '<img src="/static/honest/images/logoidea.jpg" alt="">')
+
+
+class ViewCountBufferTest(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        # write out views left over from other tests before their primary keys get reused
+        view_counts.flush()
+        self.category = create_category("Clown")
+        self.area = create_area("Disneyland")
+
+    def test_views_are_buffered_until_flush(self):
+        """recorded views don't touch the database until the buffer is flushed"""
+        buffer = ViewCountBuffer(threshold=100, interval=3600)
+        for _ in range(3):
+            buffer.add(Category, self.category.pk)
+        buffer.add(Area, self.area.pk, count=2)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.views, 0)
+        with CaptureQueriesContext(connection) as queries:
+            buffer.flush()
+        # one batched update per model
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 2)
+        self.category.refresh_from_db()
+        self.area.refresh_from_db()
+        self.assertEqual((self.category.views, self.area.views), (3, 2))
+        self.assertEqual(buffer.pending(), 0)
+
+    def test_flush_at_threshold(self):
+        """the buffer flushes itself once threshold views are pending"""
+        buffer = ViewCountBuffer(threshold=2, interval=3600)
+        buffer.add(Category, self.category.pk)
+        buffer.add(Category, self.category.pk)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.views, 2)
+
+    def test_page_view_is_counted_after_flush(self):
+        """visiting a category page buffers a view which lands on flush_view_counts"""
+        self.client.get(reverse('honest:category', args=[self.category.slug]))
+        call_command('flush_view_counts', stdout=io.StringIO())
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.views, 1)
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_flush_requested_from_another_process(self):
+        """flush_view_counts runs in a process of its own, workers see its request in the shared cache"""
+        cache.clear()
+        buffer = ViewCountBuffer(threshold=100, interval=3600, poll_interval=0)
+        buffer.add(Category, self.category.pk)
+        self.assertTrue(in_other_worker(lambda: call_command('flush_view_counts', stdout=io.StringIO())))
+        buffer.add(Category, self.category.pk)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.views, 2)
+        self.assertEqual(buffer.pending(), 0)
+
+
+
+class HyperLogLogTest(TestCase):
+
+    def test_estimate_close_to_distinct_count(self):
+        """estimate of 20000 distinct visitors should be within 10 percent"""
+        sketch = HyperLogLog()
+        for visitor in range(20000):
+            sketch.add("visitor-%d" % visitor)
+        self.assertAlmostEqual(sketch.count(), 20000, delta=2000)
+
+    def test_repeat_visits_do_not_change_sketch(self):
+        """adding the same visitor again leaves the sketch and its estimate alone"""
+        sketch = HyperLogLog()
+        self.assertTrue(sketch.add("visitor"))
+        self.assertFalse(sketch.add("visitor"))
+        self.assertEqual(sketch.count(), 1)
+
+    def test_merge_and_serialize(self):
+        """merged sketches count the union and survive a round trip through bytes"""
+        first, second = HyperLogLog(), HyperLogLog()
+        for visitor in range(100):
+            first.add(visitor)
+            second.add(visitor + 50)
+        first.merge(second)
+        restored = HyperLogLog(bytes(first))
+        self.assertAlmostEqual(restored.count(), 150, delta=15)
+        self.assertEqual(bytes(restored), bytes(first))
+
+
+class UniqueVisitorsTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        self.person = create_person(service="Clown", location="Disneyland", first_name="Psycho")
+        self.url = reverse('honest:person', args=[self.person.location.slug, self.person.service.slug,
+                                                  self.person.pk])
+
+    def test_unique_visitors_counted_per_person(self):
+        """two visitors viewing a person three times count as three views and two unique visitors"""
+        first_visitor, second_visitor = Client(), Client()
+        first_visitor.get(self.url)
+        first_visitor.get(self.url)
+        second_visitor.get(self.url)
+        view_counts.flush()
+        self.person.refresh_from_db()
+        self.assertEqual(self.person.views, 3)
+        self.assertEqual(self.person.unique_views(), 2)
+
+    def test_page_views_do_not_write_sessions(self):
+        """anonymous page views are tracked with a signed visitor cookie, not the session"""
+        response = self.client.get(self.url)
+        self.assertIn('honest_visitor', response.cookies)
+        self.assertNotIn('sessionid', response.cookies)
+        self.assertFalse(Session.objects.exists())
+
+
+class AdmissionTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        limits = self.settings(HONEST_ADMISSION_FILE=os.path.join(directory.name, 'admission'),
+                               HONEST_ADMISSION_LIMITS={'honest:add_category': {'concurrency': 1, 'rate': 1 / 60,
+                                                                                'burst': 2}})
+        limits.enable()
+        self.addCleanup(limits.disable)
+        self.addCleanup(admission.control.close)
+        self.url = reverse('honest:add_category')
+        self.client.force_login(UserProfile.objects.create_user(username="bob", password="bobsleighs"))
+
+    def post(self, name, address='127.0.0.1', **extra):
+        return self.client.post(self.url, {'category': name, 'views': 0}, REMOTE_ADDR=address, **extra)
+
+    def in_other_worker(self, endpoint, client):
+        """admits a request in a child process, which exits without finishing it, like a worker killed halfway.
+        returns once the child has admitted the request, and a function that ends the child"""
+        read_end, write_end = os.pipe()
+        done_read, done_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                admission.control.admit(endpoint, client)
+                os.write(write_end, b'1')
+                os.read(done_read, 1)
+            finally:
+                os._exit(0)
+        os.read(read_end, 1)
+
+        def end():
+            os.write(done_write, b'1')
+            os.waitpid(pid, 0)
+        self.addCleanup(lambda: [os.close(fd) for fd in (read_end, write_end, done_read, done_write)])
+        return end
+
+    def test_rate_limited_per_client(self):
+        """a client past its burst gets a 429 saying when to come back, other clients and reads are unaffected"""
+        self.assertEqual(self.post("Plumber").status_code, 302)
+        self.assertEqual(self.post("Tailor").status_code, 302)
+        response = self.post("Barber")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(list(Category.objects.values_list('category', flat=True).order_by('category')),
+                         ["Plumber", "Tailor"])
+        self.assertEqual(self.post("Barber", address='10.0.0.2').status_code, 302)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_forwarded_for(self):
+        """behind a trusted proxy clients are told apart by the address it forwards, not by what they claim"""
+        with self.settings(HONEST_TRUSTED_PROXIES=1):
+            for name in ("Plumber", "Tailor"):
+                self.post(name, HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.3')
+            self.assertEqual(self.post("Barber", HTTP_X_FORWARDED_FOR='9.9.9.9, 10.0.0.3').status_code, 429)
+            self.assertEqual(self.post("Barber", HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.4').status_code, 302)
+
+    def test_buckets_shared_between_workers(self):
+        """tokens another worker process took are gone for this one too"""
+        self.in_other_worker('honest:add_category', '127.0.0.1')()
+        self.in_other_worker('honest:add_category', '127.0.0.1')()
+        self.assertEqual(self.post("Plumber").status_code, 429)
+
+    def test_concurrency_over_workers(self):
+        """a request in progress in another worker fills the endpoint, until that worker is gone"""
+        end = self.in_other_worker('honest:add_category', '10.0.0.5')
+        response = self.post("Plumber")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        end()
+        self.assertEqual(self.post("Plumber").status_code, 302)
+        # and a finished request gives its place back
+        self.assertEqual(self.post("Tailor").status_code, 302)
+
+
+class SessionWriteTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        self.person = create_person(service="Clown", location="Disneyland", first_name="Psycho")
+        create_review(self.person, 4, "Funny", "")
+
+    def test_anonymous_browsing_writes_no_sessions(self):
+        """reading every kind of page without logging in never writes to the session table"""
+        location, service = self.person.location.slug, self.person.service.slug
+        urls = [reverse('honest:index'), reverse('honest:about'), reverse('honest:all_categories'),
+                reverse('honest:all_areas'), reverse('honest:category', args=[service]),
+                reverse('honest:area', args=[location]), reverse('honest:category_in_area', args=[location, service]),
+                reverse('honest:person', args=[location, service, self.person.pk]),
+                reverse('honest:search') + '?q=psycho', reverse('honest:login'), reverse('honest:register')]
+        with CaptureQueriesContext(connection) as queries:
+            for url in urls * 2:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200, url)
+                self.assertNotIn('sessionid', response.cookies, url)
+        self.assertEqual([query['sql'] for query in queries.captured_queries if 'django_session' in query['sql']],
+                         [])
+        self.assertFalse(Session.objects.exists())
+
+    def test_purge_sessions(self):
+        """expired sessions are deleted a batch at a time, live ones are kept"""
+        now = timezone.now()
+        for number in range(5):
+            Session.objects.create(session_key='expired%d' % number, session_data='',
+                                   expire_date=now - datetime.timedelta(days=number + 1))
+        Session.objects.create(session_key='live', session_data='', expire_date=now + datetime.timedelta(days=1))
+        out = io.StringIO()
+        call_command('purge_sessions', '--batch-size', '2', '--pause', '0', stdout=out)
+        self.assertIn("deleted 5 expired sessions", out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+
+
+@override_settings(HONEST_DATABASE_REPLICAS=['replica1'], HONEST_ADMISSION_LIMITS={})
+class ReplicaRoutingTest(TransactionTestCase):
+    """a second sqlite file stands in for a replica, copied from the primary the way replication would"""
+
+    def setUp(self):
+        view_counts.flush()
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases['replica1'] = {'ENGINE': 'django.db.backends.sqlite3',
+                                             'NAME': os.path.join(directory.name, 'replica.sqlite3')}
+        self.addCleanup(self.remove_replica)
+        self.person = create_person(service="Clown", location="Disneyland", first_name="Psycho")
+
+    def remove_replica(self):
+        connections['replica1'].close()
+        del connections.databases['replica1']
+        del connections._connections.replica1
+        # the search index isn't a model, so the flush after each test doesn't empty it
+        get_backend().clear()
+
+    def replicate(self):
+        connection.ensure_connection()
+        replica = connections['replica1']
+        replica.close()
+        with sqlite3.connect(replica.settings_dict['NAME']) as target:
+            connection.connection.backup(target)
+
+    def review_ids(self, client):
+        response = client.get(reverse('honest:api_list', args=['reviews']), {'person': self.person.pk})
+        return [review['id'] for review in response.json()['results']]
+
+    def test_reads_follow_writes(self):
+        """pages read the replica, until the reader posts something and reads the primary for a while"""
+        self.replicate()
+        url = reverse('honest:person', args=[self.person.location_slug, self.person.service_slug, self.person.pk])
+        writer, reader = Client(), Client()
+        response = writer.post(url, {'rating': 5, 'summary': "Funny", 'review_text': ""})
+        self.assertIn('honest_primary', response.cookies)
+        review = Review.objects.get()
+        # the replica hasn't caught up yet
+        self.assertEqual(self.review_ids(reader), [])
+        self.assertEqual(self.review_ids(writer), [review.pk])
+        # pages cached under a generation are built from the primary
+        self.assertContains(reader.get(url), "Funny")
+        self.replicate()
+        self.assertEqual(self.review_ids(reader), [review.pk])
+
+    def test_writes_and_transactions_use_the_primary(self):
+        """outside requests, and in transactions, everything reads and writes the primary"""
+        router = PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Person), 'default')
+        routers.state.replica = 'replica1'
+        try:
+            self.assertEqual(router.db_for_read(Person), 'replica1')
+            self.assertEqual(router.db_for_write(Person), 'default')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Person), 'default')
+        finally:
+            routers.state.replica = None
+
+
+class KeysetPaginationTest(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        cache.clear()
+        self.category = create_category("Clown")
+        self.area = create_area("Disneyland")
+        self.people = create_people(self.category, [self.area], 45)
+        # give several people the same rating so ties are broken by id
+        for index, person in enumerate(self.people):
+            Person.objects.filter(pk=person.pk).update(rating=index % 5)
+
+    def expected_order(self):
+        return list(Person.objects.order_by('-rating', '-id').values_list('pk', flat=True))
+
+    def test_pages_walk_forward_and_back(self):
+        """following next cursors visits every person once in order, previous cursors walk back"""
+        queryset = Person.objects.all()
+        seen, pages, cursor = [], [], None
+        while True:
+            page = keyset_paginate(queryset, ['-rating', '-id'], cursor=cursor, per_page=20)
+            pages.append(page)
+            seen.extend(person.pk for person in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, self.expected_order())
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+        previous = keyset_paginate(queryset, ['-rating', '-id'], cursor=pages[-1].previous_cursor, per_page=20)
+        self.assertEqual([person.pk for person in previous], [person.pk for person in pages[1]])
+        first = keyset_paginate(queryset, ['-rating', '-id'], cursor=previous.previous_cursor, per_page=20)
+        self.assertFalse(first.has_previous())
+
+    def test_bad_cursor(self):
+        """a tampered cursor is rejected, and is a 404 on listing pages"""
+        with self.assertRaises(InvalidCursor):
+            keyset_paginate(Person.objects.all(), ['-rating', '-id'], cursor="not-a-cursor")
+        response = self.client.get(reverse('honest:category', args=[self.category.slug]), {'cursor': 'bad'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_later_pages_cost_the_same_as_the_first(self):
+        """page 3 runs the same queries as page 1 and never uses OFFSET"""
+        url = reverse('honest:category_in_area', args=[self.area.slug, self.category.slug])
+        warm_taxonomy()
+        response, first_page_queries = self.get_within_query_budget(url, 8)
+        cursor = response.context['people'].next_cursor
+        response = self.client.get(url, {'cursor': cursor})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'cursor': response.context['people'].next_cursor})
+        self.assertEqual(len(response.context['people']), 5)
+        self.assertEqual(len(queries), first_page_queries)
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+
+    def test_person_reviews_paginated(self):
+        """a person's reviews are shown newest first, ten to a page"""
+        person = self.people[0]
+        for number in range(12):
+            create_review(person=person, rating=5, summary="Review %d" % number, review_text="")
+        url = reverse('honest:person', args=[self.area.slug, self.category.slug, person.pk])
+        response = self.client.get(url)
+        reviews = response.context['reviews']
+        self.assertEqual([review.summary for review in reviews][:2], ["Review 11", "Review 10"])
+        self.assertTrue(reviews.has_next())
+        response = self.client.get(url, {'cursor': reviews.next_cursor})
+        self.assertEqual([review.summary for review in response.context['reviews']], ["Review 1", "Review 0"])
+
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.person = create_person(service="Web Developer", location="Lagos", first_name="Funke",
+                                    last_name="Adeyemi")
+
+    def test_search_finds_each_kind(self):
+        """people, services, locations and reviews are all searchable, by whole word or prefix"""
+        review = create_review(person=self.person, rating=5, summary="Brilliant", review_text="Built our shop site")
+        self.assertEqual(search("funke adeyemi"), [('person', self.person)])
+        self.assertEqual(search("adey"), [('person', self.person)])
+        self.assertEqual(search("web dev"), [('category', self.person.service)])
+        self.assertEqual(search("lagos"), [('area', self.person.location)])
+        self.assertEqual(search("shop"), [('review', review)])
+
+    def test_title_matches_rank_first(self):
+        """a match in a review summary ranks above a match in another review's text"""
+        in_text = create_review(person=self.person, rating=4, summary="Good", review_text="very punctual")
+        in_summary = create_review(person=self.person, rating=5, summary="Punctual", review_text="good work")
+        self.assertEqual(search("punctual"), [('review', in_summary), ('review', in_text)])
+
+    def test_index_follows_saves_and_deletes(self):
+        """renaming an object updates its document and deleting it removes the document"""
+        self.person.first_name = "Kemi"
+        self.person.save()
+        self.assertEqual(search("funke"), [])
+        self.assertEqual(search("kemi"), [('person', self.person)])
+        self.person.delete()
+        self.assertEqual(search("kemi"), [])
+
+    def test_review_changes_keep_the_person_document(self):
+        """editing and deleting reviews updates the person's rating only, they can still be found by name"""
+        review = create_review(person=self.person, rating=5, summary="Brilliant", review_text="Built our shop site")
+        review.rating = 3
+        review.save()
+        self.assertEqual(search("funke"), [('person', self.person)])
+        review.delete()
+        self.assertEqual(search("funke"), [('person', self.person)])
+        call_command('backfill_rating_aggregates', stdout=io.StringIO())
+        self.assertEqual(search("funke"), [('person', self.person)])
+
+    def test_rebuild_search_index(self):
+        """the rebuild command puts every document back into an emptied index"""
+        get_backend().clear()
+        self.assertEqual(search("funke"), [])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(search("funke"), [('person', self.person)])
+
+    def test_search_page(self):
+        """the search page lists matches grouped by kind"""
+        response = self.client.get(reverse('honest:search'), {'q': 'funke'})
+        self.assertEqual(response.context['person_results'], [self.person])
+        self.assertContains(response, "Adeyemi")
+
+
+class TaxonomyTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        self.person = create_person(service="Clown", location="Disneyland", first_name="Psycho")
+        warm_taxonomy()
+
+    def test_slugs_resolved_from_memory(self):
+        """known and unknown slugs alike are answered without a query"""
+        with self.assertNumQueries(0):
+            category = taxonomy.categories.resolve("clown")
+            self.assertIsNone(taxonomy.areas.resolve("atlantis"))
+        self.assertEqual((category.pk, category.category), (self.person.service_id, "Clown"))
+
+    def test_bad_slugs_are_404s(self):
+        """a slug that isn't a category or an area is a 404 before any listing query runs"""
+        for url in (reverse('honest:category', args=["atlantis"]), reverse('honest:area', args=["atlantis"]),
+                    reverse('honest:category_in_area', args=["disneyland", "atlantis"])):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_saves_reload_every_worker(self):
+        """a new or renamed category shows up as soon as it is saved"""
+        create_category("Juggler")
+        self.assertIsNotNone(taxonomy.categories.resolve("juggler"))
+        area = self.person.location
+        area.state = "Disney World"
+        area.save()
+        self.assertIsNone(taxonomy.areas.resolve("disneyland"))
+        self.assertEqual(taxonomy.areas.resolve("disney-world").pk, area.pk)
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_saves_on_other_workers_reload_this_one(self):
+        """a category added or an area renamed by another worker resolves here straight away, not after
+        HONEST_SLUG_CACHE_MAX_AGE"""
+        cache.clear()
+        warm_taxonomy()
+        area = self.person.location
+
+        def change():
+            create_category("Juggler")
+            area.state = "Disney World"
+            area.save()
+        self.assertTrue(in_other_worker(change))
+        # the child changed its own copy of the test database, make the same changes here without the signals
+        Category.objects.bulk_create([Category(category="Juggler", slug="juggler")])
+        Area.objects.filter(pk=area.pk).update(state="Disney World", slug="disney-world")
+        self.assertIsNotNone(taxonomy.categories.resolve("juggler"))
+        self.assertIsNone(taxonomy.areas.resolve("disneyland"))
+        self.assertEqual(taxonomy.areas.resolve("disney-world").pk, area.pk)
+
+    def test_resolved_rows_save_safely(self):
+        """fields not held in memory are deferred, saving a resolved category doesn't blank its sketch"""
+        Category.objects.filter(pk=self.person.service_id).update(visitors_hll=b'sketch')
+        category = taxonomy.categories.resolve("clown")
+        category.save()
+        self.assertEqual(bytes(Category.objects.get(pk=category.pk).visitors_hll), b'sketch')
+
+
+class AutocompleteTest(TestCase):
+
+    def setUp(self):
+        for name in ("Web Developer", "Welder", "Mechanic"):
+            create_category(name)
+        create_area("Lagos")
+
+    def test_prefix_index_matches_word_starts(self):
+        """prefixes match the start of any word in a name, case insensitively"""
+        index = PrefixIndex([("Web Developer", "web-developer"), ("Welder", "welder"), ("Mechanic", "mechanic")])
+        self.assertEqual(index.complete("we"), [("Web Developer", "web-developer"), ("Welder", "welder")])
+        self.assertEqual(index.complete("DEV"), [("Web Developer", "web-developer")])
+        self.assertEqual(index.complete(""), [])
+
+    def test_autocomplete_runs_no_queries(self):
+        """once the index is built, completing a prefix doesn't touch the database"""
+        AUTOCOMPLETERS['categories'].index()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('honest:autocomplete', args=['categories']), {'q': 'we'})
+        self.assertEqual([result['name'] for result in response.json()['results']], ["Web Developer", "Welder"])
+
+    def test_new_names_show_up(self):
+        """saving a new area invalidates the index so the next lookup sees it"""
+        AUTOCOMPLETERS['areas'].index()
+        create_area("Lokoja")
+        response = self.client.get(reverse('honest:autocomplete', args=['areas']), {'q': 'lo'})
+        self.assertEqual([result['name'] for result in response.json()['results']], ["Lokoja"])
+        response = self.client.get(reverse('honest:autocomplete', args=['people']), {'q': 'lo'})
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_changes_on_other_workers_show_up(self):
+        """names renamed or deleted by another worker aren't offered here any more"""
+        cache.clear()
+        AUTOCOMPLETERS['categories'].index()
+        welder, mechanic = Category.objects.get(category="Welder"), Category.objects.get(category="Mechanic")
+
+        def change():
+            welder.delete()
+            mechanic.category = "Wheelwright"
+            mechanic.save()
+        self.assertTrue(in_other_worker(change))
+        # the child changed its own copy of the test database, make the same changes here without the signals
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM honest_category WHERE id = %s', [welder.pk])
+        Category.objects.filter(pk=mechanic.pk).update(category="Wheelwright", slug="wheelwright")
+        self.assertEqual(AUTOCOMPLETERS['categories'].complete("we"), [("Web Developer", "web-developer")])
+        self.assertEqual(AUTOCOMPLETERS['categories'].complete("me"), [])
+        self.assertEqual(AUTOCOMPLETERS['categories'].complete("wh"), [("Wheelwright", "wheelwright")])
+
+
+
+class HomePageCacheTest(TestCase):
+
+    def setUp(self):
+        self.categories = [create_category("Category %d" % i) for i in range(12)]
+        self.area = create_area("Lagos")
+
+    def test_home_page_served_without_queries(self):
+        """once the top 10 lists are cached an anonymous home page view runs no queries"""
+        self.client.get(reverse('honest:index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('honest:index'))
+        self.assertEqual(len(response.context['categories']), 10)
+        self.assertContains(response, "See all")
+
+    def test_lists_refresh_when_views_are_flushed(self):
+        """flushing new category views drops the cached lists so the new order shows"""
+        self.client.get(reverse('honest:index'))
+        view_counts.add(Category, self.categories[11].pk, count=5)
+        view_counts.flush()
+        response = self.client.get(reverse('honest:index'))
+        self.assertEqual(response.context['categories'][0]['category'], "Category 11")
+
+    def test_lists_refresh_when_areas_change(self):
+        """a new area appears on the home page straight away"""
+        self.client.get(reverse('honest:index'))
+        create_area("Kaduna")
+        response = self.client.get(reverse('honest:index'))
+        self.assertContains(response, "Kaduna")
+
+
+
+@override_settings(HONEST_ADMISSION_LIMITS={})
+class AnonymousPageCacheTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        self.person = create_person(service="Clown", location="Disneyland", first_name="Psycho")
+        self.other = create_person(service="Tailor", location="Lagos", first_name="Bola")
+        self.person_url = reverse('honest:person', args=[self.person.location.slug, self.person.service.slug,
+                                                         self.person.pk])
+
+    def test_repeat_views_served_from_cache(self):
+        """the second anonymous view of a page runs no queries but still counts the view"""
+        url = reverse('honest:category', args=[self.person.service.slug])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, "Psycho")
+        view_counts.flush()
+        self.person.service.refresh_from_db()
+        self.assertEqual(self.person.service.views, 2)
+
+    def test_conditional_get(self):
+        """a request with the page's ETag or a later If-Modified-Since gets 304 Not Modified"""
+        response = self.client.get(self.person_url)
+        self.assertTrue(response.has_header('ETag'))
+        response = self.client.get(self.person_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.person_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_review_invalidates_only_affected_pages(self):
+        """a review drops the person's page and listings they are in, other categories stay cached"""
+        other_url = reverse('honest:category', args=[self.other.service.slug])
+        category_url = reverse('honest:category', args=[self.person.service.slug])
+        for url in (self.person_url, category_url, other_url):
+            self.client.get(url)
+        create_review(person=self.person, rating=4, summary="Scary but good", review_text="")
+        self.assertContains(self.client.get(self.person_url), "Scary but good")
+        self.assertContains(self.client.get(category_url), "Rating: 4.0")
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_change_on_other_worker_drops_cached_page(self):
+        """a review saved by another worker moves on the generations this worker's cached pages were built at"""
+        cache.clear()
+        self.client.get(self.person_url)
+        with self.assertNumQueries(0):
+            self.client.get(self.person_url)
+        self.assertTrue(in_other_worker(lambda: create_review(person=self.person, rating=4, summary="Scary",
+                                                              review_text="")))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.person_url)
+        self.assertTrue(queries, "the page was served from the cache")
+
+    def test_each_visitor_gets_their_own_csrf_token(self):
+        """cached pages carry the requesting visitor's csrf token, so posting a review from them works"""
+        self.client.get(self.person_url)
+        visitor = Client(enforce_csrf_checks=True)
+        response = visitor.get(self.person_url)
+        token = re.search(r'name=.csrfmiddlewaretoken. value=.(\w+)', response.content.decode()).group(1)
+        response = visitor.post(self.person_url, {'csrfmiddlewaretoken': token, 'rating': 5, 'summary': "Nice",
+                                                  'review_text': ""})
+        self.assertEqual(response.status_code, 302)
+
+
+
+class PageShellCacheTest(TestCase):
+
+    def setUp(self):
+        self.person = create_person(service="Clown", location="Disneyland", first_name="Psycho")
+        self.url = reverse('honest:person', args=[self.person.location.slug, self.person.service.slug,
+                                                  self.person.pk])
+        self.user = UserProfile.objects.create_user(username="bob", password="bobsleighs")
+
+    def test_logged_in_users_share_the_cached_shell(self):
+        """a logged in user is served the shell an anonymous visitor cached, with their own parts filled in"""
+        self.client.get(self.url)
+        self.client.force_login(self.user)
+        # loading the session and the user are the only queries left
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Reviewing as bob")
+        self.assertContains(response, "Sign out")
+        self.assertNotContains(response, "Reviewing as Anonymous")
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_shell_cached_by_a_user_does_not_leak_to_others(self):
+        """a shell first rendered for a logged in user shows anonymous visitors their own parts"""
+        self.client.force_login(self.user)
+        self.client.get(self.url)
+        response = Client().get(self.url)
+        self.assertContains(response, "Reviewing as Anonymous")
+        self.assertNotContains(response, "bob")
+
+    def test_etag_is_per_user(self):
+        """the same page has a different ETag for a different user"""
+        anonymous_etag = self.client.get(self.url)['ETag']
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=anonymous_etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_unread_query_parameters_share_the_shell(self):
+        """query parameters the view doesn't read don't make a page of their own, the cursor does"""
+        self.client.get(self.url, {'utm_source': "newsletter"})
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(self.url, {'utm_source': "flyer", 'x': 1}), "Psycho")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {'cursor': "bad"})
+        self.assertTrue(queries, "another page of reviews was served from the first page's shell")
+
+    def test_failing_view_leaves_no_holes_punched(self):
+        """a view that raises while rendering the shell doesn't leave the request rendering hole markers"""
+        def failing(request):
+            raise ValueError("broken")
+        request = RequestFactory().get('/failing/')
+        with self.assertRaises(ValueError):
+            cache_page_shell(lambda: [])(failing)(request)
+        self.assertFalse(request.punch_holes)
+
+
+class PersonUrlTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        self.person = create_person(service="Clown", location="Disneyland", first_name="Psycho")
+        self.url = reverse('honest:person', args=["disneyland", "clown", self.person.pk])
+
+    def test_canonical_url(self):
+        """a person's url is built from the slugs stored on them, other slugs redirect to it for good"""
+        self.assertEqual(Person.objects.get(pk=self.person.pk).get_absolute_url(), self.url)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        response = self.client.get(reverse('honest:person', args=["Disneyland", "Clown", self.person.pk]),
+                                   {'cursor': 'abc'})
+        self.assertRedirects(response, self.url + '?cursor=abc', status_code=301, fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('honest:person', args=["x", "y", 0])).status_code, 404)
+
+    def test_listings_link_without_loading_categories(self):
+        """list pages link every person to their canonical url"""
+        create_review(self.person, 4, "Funny", "")
+        response = self.client.get(reverse('honest:category', args=["clown"]))
+        self.assertContains(response, 'href="{0}"'.format(self.url))
+        self.assertContains(self.client.get(reverse('honest:search'), {'q': 'funny'}), 'href="{0}"'.format(self.url))
+
+    def test_rename_moves_urls(self):
+        """renaming a category or an area gives its people new urls, and their old ones redirect"""
+        category, area = self.person.service, self.person.location
+        category.category, area.state = "Circus Clown", "Disney World"
+        category.save()
+        area.save()
+        new_url = reverse('honest:person', args=["disney-world", "circus-clown", self.person.pk])
+        self.assertEqual(Person.objects.get(pk=self.person.pk).get_absolute_url(), new_url)
+        self.assertRedirects(self.client.get(self.url), new_url, status_code=301)
+
+    def test_moving_a_person_moves_their_url(self):
+        """a person saved into another category gets that category's slug"""
+        self.person.service = create_category("Juggler")
+        self.person.save(update_fields=['service'])
+        self.assertEqual(Person.objects.get(pk=self.person.pk).service_slug, "juggler")
+
+
+class AreaHierarchyTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        cache.clear()
+        self.plumber = create_category("Plumber")
+        self.lagos = create_area("Lagos")
+        self.ikeja = Area.objects.create(state="Ikeja", parent=self.lagos)
+        self.allen = Area.objects.create(state="Allen", parent=self.ikeja)
+        self.ogun = create_area("Ogun")
+
+    def links(self):
+        return set(AreaClosure.objects.values_list('ancestor__state', 'descendant__state', 'depth'))
+
+    def add_person(self, area, first_name="Ada"):
+        return Person.objects.create(service=self.plumber, location=area, first_name=first_name, last_name="Obi",
+                                     phone_number="08031234567")
+
+    def people_counts(self):
+        return dict(AreaCategoryStats.objects.filter(category=self.plumber).values_list('area__state',
+                                                                                         'people_count'))
+
+    def test_closure_follows_moves(self):
+        """every area is linked to itself and each area it is inside, and a move relinks everything inside it"""
+        self.assertEqual(self.links(), {("Lagos", "Lagos", 0), ("Ikeja", "Ikeja", 0), ("Allen", "Allen", 0),
+                                        ("Ogun", "Ogun", 0), ("Lagos", "Ikeja", 1), ("Lagos", "Allen", 2),
+                                        ("Ikeja", "Allen", 1)})
+        self.ikeja.parent = self.ogun
+        self.ikeja.save()
+        self.assertEqual(self.links(), {("Lagos", "Lagos", 0), ("Ikeja", "Ikeja", 0), ("Allen", "Allen", 0),
+                                        ("Ogun", "Ogun", 0), ("Ogun", "Ikeja", 1), ("Ogun", "Allen", 2),
+                                        ("Ikeja", "Allen", 1)})
+        self.assertEqual(set(Area.objects.filter(pk__in=self.ogun.subtree()).values_list('state', flat=True)),
+                         {"Ogun", "Ikeja", "Allen"})
+
+    def test_no_loops(self):
+        """an area can't be put inside itself or anything inside it"""
+        self.lagos.parent = self.allen
+        with self.assertRaises(ValueError):
+            self.lagos.save()
+        self.assertEqual(Area.objects.get(pk=self.lagos.pk).parent, None)
+        form = AreaForm({'state': "Lagos", 'parent': self.allen.pk}, instance=Area.objects.get(pk=self.lagos.pk))
+        self.assertFalse(form.is_valid())
+        self.assertIn('parent', form.errors)
+
+    def test_counts_roll_up(self):
+        """people and reviews count in their area and every area it is inside, and move with it"""
+        person = self.add_person(self.allen)
+        create_review(person, 4, "Good", "")
+        self.assertEqual(self.people_counts(), {"Lagos": 1, "Ikeja": 1, "Allen": 1})
+        self.assertEqual(AreaCategoryStats.objects.get(area=self.lagos).rating_sum, 4)
+        self.ikeja.parent = self.ogun
+        self.ikeja.save()
+        self.assertEqual(self.people_counts(), {"Lagos": 0, "Ikeja": 1, "Allen": 1, "Ogun": 1})
+        self.assertEqual(AreaCategoryStats.objects.get(area=self.ogun).review_count, 1)
+        call_command('rebuild_area_category_stats', '--verify', stdout=io.StringIO())
+
+    def test_pages_list_the_subtree(self):
+        """a state's pages list the people of its towns, with the places inside it and the way back up"""
+        self.add_person(self.allen, first_name="Townsperson")
+        self.add_person(self.ogun, first_name="Elsewhere")
+        warm_taxonomy()
+        response = self.client.get(reverse('honest:area', args=[self.lagos.slug]))
+        self.assertContains(response, "Townsperson")
+        self.assertNotContains(response, "Elsewhere")
+        self.assertEqual(response.context['children'], [(self.ikeja, 1)])
+        response = self.client.get(reverse('honest:category_in_area', args=[self.lagos.slug, self.plumber.slug]))
+        self.assertContains(response, "Townsperson")
+        self.assertEqual(response.context['stats'].people_count, 1)
+        response = self.client.get(reverse('honest:area', args=[self.allen.slug]))
+        self.assertEqual(response.context['ancestors'], [self.lagos, self.ikeja])
+        self.assertContains(response, 'href="{0}"'.format(reverse('honest:area', args=[self.lagos.slug])))
+
+    def test_new_person_shows_on_cached_ancestor_pages(self):
+        """adding someone to a town drops the cached pages of the areas the town is inside"""
+        url = reverse('honest:area', args=[self.lagos.slug])
+        self.assertNotContains(self.client.get(url), "Newcomer")
+        self.add_person(self.allen, first_name="Newcomer")
+        self.assertContains(self.client.get(url), "Newcomer")
+
+    def test_api_within(self):
+        """?within= takes in the areas inside the one asked for, ?area= only that area"""
+        self.add_person(self.allen)
+        url = reverse('honest:api_list', args=['people'])
+        self.assertEqual(len(self.client.get(url, {'within': self.lagos.slug}).json()['results']), 1)
+        self.assertEqual(len(self.client.get(url, {'area': self.lagos.slug}).json()['results']), 0)
+        areas = self.client.get(reverse('honest:api_list', args=['areas']), {'parent': self.lagos.slug}).json()
+        self.assertEqual([area['name'] for area in areas['results']], ["Ikeja"])
+
+
+class ApiTest(TestCase):
+
+    def setUp(self):
+        self.clowns = create_category("Clown")
+        self.tailors = create_category("Tailor")
+        self.lagos = create_area("Lagos")
+        self.clown_people = create_people(self.clowns, [self.lagos], 5)
+        self.tailor_people = create_people(self.tailors, [self.lagos], 3)
+        self.url = reverse('honest:api_list', args=['people'])
+
+    def test_sparse_fields_select_only_those_columns(self):
+        """?fields= limits both the response and the columns queried"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'fields': 'first_name,category'})
+        self.assertEqual(response.json()['results'][0],
+                         {'first_name': self.clown_people[0].first_name, 'category': 'clown'})
+        self.assertNotIn('phone_number', queries.captured_queries[-1]['sql'])
+        response = self.client.get(self.url, {'fields': 'first_name,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_pagination_and_filters(self):
+        """people filtered by category come back a page at a time, following next links"""
+        response = self.client.get(self.url, {'category': 'clown', 'limit': 2, 'fields': 'id'})
+        ids = []
+        while True:
+            data = response.json()
+            ids.extend(row['id'] for row in data['results'])
+            if not data['next']:
+                break
+            response = self.client.get(data['next'])
+        self.assertEqual(ids, [person.pk for person in self.clown_people])
+        response = self.client.get(self.url, {'cursor': 'bad'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_reviews_filtered_by_person(self):
+        """reviews can be listed for one person"""
+        create_review(person=self.clown_people[0], rating=4, summary="Funny", review_text="")
+        create_review(person=self.tailor_people[0], rating=2, summary="Loose", review_text="")
+        response = self.client.get(reverse('honest:api_list', args=['reviews']),
+                                   {'person': self.clown_people[0].pk, 'fields': 'summary,rating'})
+        self.assertEqual(response.json()['results'], [{'summary': "Funny", 'rating': 4}])
+
+    def test_conditional_requests(self):
+        """an unchanged list answers If-None-Match with 304, a changed one with the new list"""
+        response = self.client.get(reverse('honest:api_list', args=['categories']))
+        etag = response['ETag']
+        response = self.client.get(reverse('honest:api_list', args=['categories']), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        create_category("Welder")
+        response = self.client.get(reverse('honest:api_list', args=['categories']), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+
+
+class ImportPeopleTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as stream:
+            stream.write(content)
+        return path
+
+    def test_import_csv(self):
+        """people are imported with categories and areas created once each and bad rows skipped"""
+        path = self.write('people.csv', "first_name,last_name,phone_number,email,service,location\n"
+                                        "Ada,Obi,08031234567,ada@example.com,Hair/Beauty,Lagos\n"
+                                        "Bayo,Ade,08031234568,,Hair/Beauty,Lagos\n"
+                                        "Chi,Eze,123,,Plumber,Lagos\n"
+                                        "Dayo,Ola,08031234569,,Plumber,Abuja\n")
+        call_command('import_people', path, '--batch-size', '2', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Person.objects.count(), 3)
+        self.assertEqual(sorted(Category.objects.values_list('category', flat=True)), ['Hair-Beauty', 'Plumber'])
+        self.assertEqual(sorted(Area.objects.values_list('state', flat=True)), ['Abuja', 'Lagos'])
+        self.assertEqual(search("dayo"), [('person', Person.objects.get(first_name="Dayo"))])
+        self.assertTrue(ImportProgress.objects.get(source=path).finished)
+
+    def test_import_jsonl_with_reviews(self):
+        """reviews in a json lines import are linked to their person and counted in the rating aggregates"""
+        rows = [{'first_name': "Ada", 'last_name': "Obi", 'phone_number': "08031234567", 'service': "Tailor",
+                 'location': "Enugu", 'reviews': [{'rating': 5, 'summary': "Neat"}, {'rating': 2, 'summary': "Late"}]},
+                {'first_name': "Bayo", 'last_name': "Ade", 'phone_number': "08031234568", 'service': "Tailor",
+                 'location': "Enugu"}]
+        path = self.write('people.jsonl', "\n".join(json.dumps(row) for row in rows))
+        call_command('import_people', path, stdout=io.StringIO())
+        ada = Person.objects.get(first_name="Ada")
+        self.assertEqual(sorted(ada.review_set.values_list('summary', flat=True)), ["Late", "Neat"])
+        self.assertEqual((ada.review_count, ada.rating_sum, ada.rating), (2, 7, 3.5))
+        self.assertEqual(ada.star_histogram(), [(5, 1), (4, 0), (3, 0), (2, 1), (1, 0)])
+        self.assertEqual(search("neat"), [('review', ada.review_set.get(summary="Neat"))])
+        self.assertEqual(Person.objects.get(first_name="Bayo").review_count, 0)
+        self.assertEqual(ada.get_absolute_url(), reverse('honest:person', args=['enugu', 'tailor', ada.pk]))
+        stats = AreaCategoryStats.objects.get()
+        self.assertEqual((stats.people_count, stats.review_count, stats.rating_sum), (2, 2, 7))
+
+    def test_bad_jsonl_lines_are_skipped(self):
+        """blank, malformed and non-object lines are counted as skipped and the rows around them imported"""
+        row = {'last_name': "Obi", 'phone_number': "08031234567", 'service': "Tailor", 'location': "Enugu"}
+        lines = [json.dumps(dict(row, first_name="Ada")), "", '{"first_name": ', "[1, 2]", "42",
+                 json.dumps(dict(row, first_name="Chi", reviews=5)), json.dumps(dict(row, first_name="Bayo"))]
+        path = self.write('people.jsonl', "\n".join(lines))
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_people', path, '--batch-size', '3', stdout=out, stderr=err)
+        self.assertEqual(sorted(Person.objects.values_list('first_name', flat=True)), ["Ada", "Bayo"])
+        self.assertIn("skipped 5 bad rows", out.getvalue())
+        self.assertIn("row 3: not valid JSON", err.getvalue())
+        self.assertIn("row 6: reviews must be a list", err.getvalue())
+
+    def test_resume_after_committed_batches(self):
+        """an interrupted import is resumed after the rows already committed, without duplicating them"""
+        path = self.write('people.csv', "first_name,last_name,phone_number,email,service,location\n" +
+                          "".join("P{0},Q,0803123456{0},,Driver,Kano\n".format(n) for n in range(4)))
+        ImportProgress.objects.create(source='drivers', rows_done=2)
+        Person.objects.bulk_create([Person(first_name="P0", last_name="Q", phone_number="08031234560",
+                                           service=create_category("Driver"), location=create_area("Kano"))])
+        call_command('import_people', path, '--source', 'drivers', stdout=io.StringIO())
+        self.assertEqual(sorted(Person.objects.values_list('first_name', flat=True)), ["P0", "P2", "P3"])
+        out = io.StringIO()
+        call_command('import_people', path, '--source', 'drivers', stdout=out)
+        self.assertIn("already imported", out.getvalue())
+        self.assertEqual(Person.objects.count(), 3)
@@ -0,0 +1,125 @@
+"""
+query plan regression tests.
+
+each view is requested with the sql it runs captured, then every SELECT is run again under EXPLAIN. a test fails
+when a plan reads a whole table (or, on postgres, any sequential scan) or sorts rows itself instead of reading them
+from an index in order, so a missing or unusable index shows up here rather than as a slow page in production.
+pages that list a whole table on purpose, like all categories, aren't checked, and neither are full-text searches:
+the search index ranks its matches by relevance, which is a sort by design. the listing of an area with areas inside
+it sorts too: its people are found through the closure table, one index range per area in it, and merged.
+"""
+import json
+import re
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from honest import taxonomy
+from honest.counters import view_counts
+from honest.models import Area, Category, Person, Review
+from honest.search import INDEX_TABLE
+
+# sqlite: "SCAN honest_person" (or "SCAN TABLE honest_person" before 3.36) with nothing after the table name is a
+# full table scan, "SCAN ... USING INDEX" walks an index in order and is fine for a LIMIT
+SQLITE_TABLE_SCAN = re.compile(r'^SCAN (TABLE )?(?P<table>\w+)( AS \w+)?$')
+SQLITE_SORT = 'USE TEMP B-TREE'
+
+
+def explain(sql, params):
+    """plan problems of one query, as a list of strings"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            steps = [row[-1] for row in cursor.fetchall()]
+            return ([step for step in steps if SQLITE_TABLE_SCAN.match(step)] +
+                    [step for step in steps if SQLITE_SORT in step])
+        # test tables are tiny and postgres would rightly scan them, make it show the plan it would use at scale
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('SET LOCAL enable_sort = off')
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return [node for node in plan_nodes(plan[0]['Plan']) if node in ('Seq Scan', 'Sort')]
+
+
+def plan_nodes(node):
+    yield node['Node Type']
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+class QueryPlanTest(TestCase):
+
+    def setUp(self):
+        view_counts.flush()
+        cache.clear()
+        self.category = Category.objects.create(category="Plumber")
+        self.area = Area.objects.create(state="Lagos")
+        self.people = [Person.objects.create(service=self.category, location=self.area, first_name="Person%d" % i,
+                                             last_name="Test", phone_number="012345678912") for i in range(3)]
+        Review.objects.create(person=self.people[0], rating=4, summary="Good")
+
+    def assert_indexed_plans(self, url, data=None, sorts=0):
+        """every SELECT the view runs reads rows through an index, in the order it needs them, except for as many
+        sorts as are expected"""
+        selects = []
+
+        def capture(execute, sql, params, many, context):
+            if sql.startswith('SELECT') and 'honest_' in sql and INDEX_TABLE not in sql:
+                selects.append((sql, params))
+            return execute(sql, params, many, context)
+
+        # each worker loads every category and area once, that's a whole table on purpose
+        taxonomy.warm()
+        with connection.execute_wrapper(capture):
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        problems = ["{0}\n    {1}".format(sql, problem) for sql, params in selects for problem in explain(sql, params)]
+        sorted_ = [problem for problem in problems if SQLITE_SORT in problem or problem.endswith('Sort')]
+        self.assertEqual(len(sorted_), sorts, "\n".join(sorted_))
+        problems = [problem for problem in problems if problem not in sorted_]
+        if problems:
+            self.fail("{0} runs queries without a usable index:\n{1}".format(url, "\n".join(problems)))
+
+    def test_home_page(self):
+        self.assert_indexed_plans(reverse('honest:index'))
+
+    def test_category_page(self):
+        self.assert_indexed_plans(reverse('honest:category', args=[self.category.slug]))
+
+    def test_area_page(self):
+        self.assert_indexed_plans(reverse('honest:area', args=[self.area.slug]))
+
+    def test_area_with_areas_inside_page(self):
+        """the people of the areas inside are looked up through the closure table and sorted, within a category they
+        are read in order from the category's index and checked against the closure table instead"""
+        Person.objects.create(service=self.category, location=Area.objects.create(state="Ikeja", parent=self.area),
+                              first_name="Townsperson", last_name="Test", phone_number="012345678912")
+        self.assert_indexed_plans(reverse('honest:area', args=[self.area.slug]), sorts=1)
+        self.assert_indexed_plans(reverse('honest:category_in_area', args=[self.area.slug, self.category.slug]))
+
+    def test_category_in_area_page(self):
+        self.assert_indexed_plans(reverse('honest:category_in_area', args=[self.area.slug, self.category.slug]))
+
+    def test_person_page(self):
+        self.assert_indexed_plans(reverse('honest:person', args=[self.area.slug, self.category.slug,
+                                                                 self.people[0].pk]))
+
+    def test_later_listing_page(self):
+        """keyset pages past the first seek straight to their rows"""
+        response = self.client.get(reverse('honest:api_list', args=['people']),
+                                   {'ordering': 'score', 'category': self.category.slug, 'limit': 1})
+        self.assert_indexed_plans(response.json()['next'])
+
+    def test_search_page(self):
+        """the objects found are loaded by primary key"""
+        self.assert_indexed_plans(reverse('honest:search'), {'q': 'person0'})
+
+    def test_api_lists(self):
+        for resource, data in (('people', {'category': self.category.slug, 'area': self.area.slug}),
+                               ('people', {'ordering': 'score', 'area': self.area.slug}),
+                               ('reviews', {'person': self.people[0].pk})):
+            self.assert_indexed_plans(reverse('honest:api_list', args=[resource]), data)
@@ -1,10 +1,13 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'honest'
 urlpatterns = [
     path('', views.index, name='index'),
     path('about/', views.about, name='about'),
+    path('search/', views.search, name='search'),
+    path('autocomplete/<str:kind>/', views.autocomplete, name='autocomplete'),
+    path('api/v1/<str:resource_name>/', api.resource_list, name='api_list'),
     path('category/<str:category_slug>/', views.category, name='category'),
     path('category/', views.all_categories, name='all_categories'),
     path('add_category/', views.add_category, name='add_category'),
@@ -1,54 +1,77 @@
-from _datetime import datetime
-
-from django.db.models import F
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponsePermanentRedirect, HttpResponseRedirect, JsonResponse
 from django.urls import reverse
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 
-from honest.models import Category, Person, Area, Review, UserProfile
+from honest import taxonomy
+from honest.autocomplete import AUTOCOMPLETERS
+from honest.caching import (HOME_PAGE_KEY, area_page, cache_page_shell, category_in_area_page, category_page,
+                            person_page, record_page_view)
+from honest.counters import view_counts
+from honest.middleware import get_visitor_id
+from honest.models import AreaCategoryStats, Category, Person, Area, Review, UserProfile
 from honest.forms import CategoryForm, AreaForm, PersonForm, UserForm, ReviewsForm
+from honest.pagination import InvalidCursor, keyset_paginate
+from honest.ranking import LEADERBOARD_ORDERING
+from honest.search import search as search_index
+
+PEOPLE_PER_PAGE = 20
+REVIEWS_PER_PAGE = 10
+# people are listed best ranked first and reviews newest first, id breaks ties so every row has one place
+PEOPLE_ORDERING = LEADERBOARD_ORDERING
+REVIEWS_ORDERING = ['-date_added', '-id']
+
+
+def paginate(request, queryset, ordering, per_page):
+    """the keyset page of queryset that the cursor query parameter points at, a bad cursor is a 404"""
+    try:
+        return keyset_paginate(queryset, ordering, cursor=request.GET.get('cursor'), per_page=per_page)
+    except InvalidCursor:
+        raise Http404("Page not found")
 
 
 # Create your views here.
 def index(request):
-    category_list = Category.objects.order_by('-views')[:10]
-    area_list = Area.objects.order_by('-views')[:10]
-    context = {'honest_message': 'We looooove honesty!!',
-               'categories': category_list, 'areas': area_list}
+    context = {'honest_message': 'We looooove honesty!!'}
+    context.update(home_page_lists())
     return render(request, 'honest/index.html', context)
 
 
+def home_page_lists():
+    """top 10 categories and areas by views, from the cache when possible.
+    the cached lists are dropped when view counts are flushed or a category or area changes, and never live
+    longer than HONEST_HOME_PAGE_CACHE_TIMEOUT seconds whichever worker changed things"""
+    lists = cache.get(HOME_PAGE_KEY)
+    if lists is None:
+        lists = {'categories': list(Category.objects.order_by('-views').values('category', 'slug')[:10]),
+                 'areas': list(Area.objects.order_by('-views').values('state', 'slug')[:10])}
+        cache.set(HOME_PAGE_KEY, lists, getattr(settings, 'HONEST_HOME_PAGE_CACHE_TIMEOUT', 60))
+    return lists
+
+
+@cache_page_shell(category_page)
 def category(request, category_slug):
+    # the category comes from memory, a slug that isn't one is a 404 without a query
+    category = taxonomy.categories.get_or_404(category_slug)
+    context = {'category_name': category.category, 'category': category}
 
-    # empty dictionary that we can populate later in the class
-    context = {}
+    # get list of all people within this category (ie providing this service), their category and area are
+    # filled in from memory rather than joined in. listings don't show unique visitors, their sketches stay behind
+    people = paginate(request, Person.objects.filter(service=category).defer('visitors_hll'), PEOPLE_ORDERING,
+                      PEOPLE_PER_PAGE)
+    context['people'] = attach_taxonomy(people)
 
-    try:
-        # search for any category with a matching slug
-        category = Category.objects.get(slug=category_slug)
-        context['category_name'] = category.category
-
-        # get list of all people within this category (ie providing this service)
-        people = Person.objects.filter(service=category)
-        context['people'] = people
-        context['category'] = category
-
-        this_categorys_views = category.views
-        context['this_categorys_views'] = this_categorys_views
-        count_page_views(request=request, object=category)
-
-        # make empty list of locations and populate with locations people are  in
-        areas = []
-        for person in people:
-            if person.location not in areas:
-                areas.append(person.location)
-        context['areas'] = areas
-
-    except Category.DoesNotExist:
-        # will be handled in template
-        pass
+    this_categorys_views = category.views
+    context['this_categorys_views'] = this_categorys_views
+    count_page_views(request=request, object=category)
+
+    # locations with people in this category and how many, from the precomputed counts. there are only as many
+    # as there are areas, sorting them here saves the database a sort on the joined table
+    areas = category.area_stats.filter(people_count__gt=0).select_related('area')
+    context['areas'] = sorted(areas, key=lambda facet: facet.area.state)
 
     return render(request, 'honest/category.html', context)
 
@@ -80,25 +103,44 @@ def add_category(request):
     return render(request, 'honest/add_category.html', {'form': form})
 
 
+@cache_page_shell(area_page)
 def area(request, area_slug):
     context = {}
-    area = Area.objects.get(slug=area_slug)
+    area = taxonomy.areas.get_or_404(area_slug)
     context['area'] = area
-    people = Person.objects.filter(location=area)
-    context['people'] = people
+    # the areas it is inside and the ones directly inside it come from memory
+    context['ancestors'] = taxonomy.areas.ancestors(area)
+    children = taxonomy.areas.children(area)
+    # everyone in the area or anywhere inside it
+    people = paginate(request, people_in_area(area), PEOPLE_ORDERING, PEOPLE_PER_PAGE)
+    context['people'] = attach_taxonomy(people)
     this_areas_views = area.views
     context['this_areas_views'] = this_areas_views
 
-    # make empty list of categories and populate with the services people in this area provide
-    categories = []
-    for person in people:
-        if person.service not in categories:
-            categories.append(person.service)
-    context['categories'] = categories
+    # services provided in this area and by how many people, from the precomputed counts, sorted like the areas
+    # on the category page. an area's counts take in everything inside it
+    categories = area.category_stats.filter(people_count__gt=0).select_related('category')
+    context['categories'] = sorted(categories, key=lambda facet: facet.category.category)
+    # and how many people each of the areas inside it has, from the same counts
+    people_counts = dict.fromkeys([child.pk for child in children], 0)
+    for area_id, people_count in AreaCategoryStats.objects.filter(area_id__in=list(people_counts)).values_list(
+            'area_id', 'people_count'):
+        people_counts[area_id] += people_count
+    context['children'] = [(child, people_counts[child.pk]) for child in children]
     count_page_views(request=request, object=area)
     return render(request, 'honest/area.html', context)
 
 
+def people_in_area(area):
+    """people in area or in any area inside it, one indexed lookup of the area's subtree. an area with nothing
+    inside it is matched on its own, which lets the listing indexes hand its people over already in order.
+    their unique visitor sketches aren't loaded, listings don't show them"""
+    people = Person.objects.defer('visitors_hll')
+    if taxonomy.areas.children(area):
+        return people.filter(location__in=area.subtree())
+    return people.filter(location=area)
+
+
 def all_areas(request):
     areas = Area.objects.all()
     return render(request, 'honest/all_areas.html', {'areas': areas})
@@ -126,42 +168,53 @@ def add_area(request):
     return render(request, 'honest/add_area.html', {'form': form})
 
 
+@cache_page_shell(category_in_area_page)
 def category_in_area(request, area_slug, category_slug):
-    # get the corresponding area and category from the slugs
-    category = Category.objects.get(slug=category_slug)
-    area = Area.objects.get(slug=area_slug)
-    # find all people who have service and location matching the category and area foreign keys provided
-    people = Person.objects.filter(service=category, location=area)
+    category = taxonomy.categories.get_or_404(category_slug)
+    area = taxonomy.areas.get_or_404(area_slug)
+    # pairs nobody was ever in have no row
+    stats = (AreaCategoryStats.objects.filter(area_id=area.pk, category_id=category.pk).first() or
+             AreaCategoryStats(area=area, category=category))
+    # find all people who have service matching the category, in the area or anywhere inside it
+    people = paginate(request, people_in_area(area).filter(service=category), PEOPLE_ORDERING, PEOPLE_PER_PAGE)
     # populate the context with relevant info for the html template
-    context = {'category': category, 'area': area, 'people': people}
+    context = {'category': category, 'area': area, 'stats': stats, 'people': attach_taxonomy(people),
+               'ancestors': taxonomy.areas.ancestors(area)}
 
     return render(request, 'honest/category_in_area.html', context)
 
 
+@cache_page_shell(person_page)
 def person(request, area_slug, category_slug, person_id):
-    this_person = Person.objects.get(pk=person_id)
+    this_person = Person.objects.filter(pk=person_id).first()
+    if this_person is None:
+        raise Http404("Person not found")
+    attach_taxonomy([this_person])
+    # every person has one url, so one cached copy of their page
+    canonical_url = this_person.get_absolute_url()
+    if request.method != 'POST' and request.path != canonical_url:
+        query = request.META.get('QUERY_STRING')
+        return HttpResponsePermanentRedirect(canonical_url + ('?' + query if query else ''))
     if request.method == 'POST':
         form = ReviewsForm(request.POST)
 
         # save review if form is valid
         if form.is_valid():
             pending_review = form.save(commit=False)
-            pending_review.person = Person.objects.get(pk=person_id)
+            pending_review.person = this_person
             if request.user.is_authenticated:
                 pending_review.reviewer = UserProfile.objects.get(
                     pk=request.user.id)
+            # saving the review also updates the person's rating aggregates in the same transaction
             pending_review.save()
-            this_person.set_average_rating()
-            return HttpResponseRedirect(reverse('honest:person', kwargs={'area_slug': area_slug,
-                                                                         'category_slug': category_slug,
-                                                                         'person_id': person_id}))
+            return HttpResponseRedirect(canonical_url)
         else:
             print(form.errors)
     else:
         context = {'person': this_person}
         this_persons_views = this_person.views
-        reviews = Review.objects.filter(person=this_person)
-        context['reviews'] = reviews
+        reviews = Review.objects.filter(person=this_person).select_related('reviewer')
+        context['reviews'] = paginate(request, reviews, REVIEWS_ORDERING, REVIEWS_PER_PAGE)
 
         form = ReviewsForm()
         context['form'] = form
@@ -169,43 +222,22 @@ def person(request, area_slug, category_slug, person_id):
         count_page_views(request=request, object=this_person)
         #context['visits'] = visits
         context['this_persons_views'] = this_persons_views
-        context['area_slug'] = area_slug
-        context['category_slug'] = category_slug
-        context['person_id'] = person_id
         return render(request, 'honest/person.html', context)
 
 
+def attach_taxonomy(people):
+    """fills in each person's category and area from the in-memory taxonomy, returns people"""
+    taxonomy.categories.attach(people, 'service')
+    taxonomy.areas.attach(people, 'location')
+    return people
+
+
 def count_page_views(request, object):
-    """this function uses server side cookies to count the views for the object provided
-    object model must have a views field which takes an integer"""
-
-    # check if this user has visited this person before
-    visits = request.session.get('visits')
-    # if user is visiting for first time increment views by 1
-    if not visits:
-        visits = 1
-        object.views = F('views') + 1
-        object.save()
-    reset_last_visit_time = False
-    last_visit = request.session.get('last_visit')
-    # if a value for the users last visit does not exist, set the current time to their last visit
-    if last_visit:
-        last_visit_time = datetime.strptime(
-            last_visit[:-7], "%Y-%m-%d %H:%M:%S")
-
-        if (datetime.now() - last_visit_time).seconds > 5:
-            # increment the number of views if the last visit was over 5 minutes ago
-            visits = visits + 1
-            object.views = F('views') + 1
-            object.save()
-            # and update the last visit cookie, too.
-            reset_last_visit_time = True
-    else:
-        # Cookie last_visit doesn't exist, so create it to the current date/time.
-        reset_last_visit_time = True
-    if reset_last_visit_time:
-        request.session['last_visit'] = str(datetime.now())
-        request.session['visits'] = visits
+    """counts a view and a visit by this visitor for the object provided, object model must have a views field
+    which takes an integer and a visitors_hll sketch. views are buffered and written in batches, and the visitor
+    is identified by a signed cookie, so the session is never touched"""
+    view_counts.add(type(object), object.pk, visitor=get_visitor_id(request))
+    record_page_view(request, object)
 
 
 # login required decorator to ensure only logged in users can access this page
@@ -220,9 +252,7 @@ def add_person(request):
             pending_person.save()
 
             # easy fix use commit false, grab user ID, save, use ID to redirect
-            return HttpResponseRedirect(reverse('honest:person', kwargs={'area_slug': pending_person.location,
-                                                                         'category_slug': pending_person.service,
-                                                                         'person_id': pending_person.id}))
+            return HttpResponseRedirect(pending_person.get_absolute_url())
         # else:
             # print(form.errors)
     else:
@@ -232,6 +262,25 @@ def add_person(request):
     return render(request, 'honest/add_person.html', {'form': form})
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    results = search_index(query) if query else []
+
+    # split the ranked results up by kind for the template, keeping the ranking within each kind
+    context = {'query': query, 'results': results}
+    for kind in ('person', 'category', 'area', 'review'):
+        context[kind + '_results'] = [instance for result_kind, instance in results if result_kind == kind]
+    return render(request, 'honest/search.html', context)
+
+
+def autocomplete(request, kind):
+    """json list of existing category or area names matching what the user has typed so far"""
+    if kind not in AUTOCOMPLETERS:
+        raise Http404("Nothing to complete")
+    matches = AUTOCOMPLETERS[kind].complete(request.GET.get('q', ''))
+    return JsonResponse({'results': [{'name': name, 'slug': slug} for name, slug in matches]})
+
+
 def about(request):
     return render(request, 'honest/about.html', {})
 
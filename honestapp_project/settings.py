@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/2.0/ref/settings/
 """
 
 import os
+import tempfile
+import dj_database_url
 import django_heroku
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -43,8 +45,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'honest.metrics.MetricsMiddleware',
+    'honest.middleware.AdmissionMiddleware',
+    'honest.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'honest.middleware.VisitorMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -57,7 +63,7 @@ ROOT_URLCONF = 'honestapp_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'honest.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -136,5 +142,84 @@ ACCOUNT_ACTIVATION_DAYS = 14
 REGISTRATION_AUTO_LOGIN = True
 LOGIN_REDIRECT_URL = '/honest/'
 
+# generations, cached pages, the home page lists and flush requests must be seen by every worker, see
+# honest/caching.py, so in production the cache is the redis server at REDIS_URL (heroku redis sets it). without
+# one each process gets a cache of its own, which is only right for a single process like runserver
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            # the default 300 entries would have cached pages push generations out
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# page views are buffered per worker and written in batches, see honest/counters.py
+# a worker killed without a clean exit loses the views it hasn't written, at most
+# HONEST_VIEW_COUNT_FLUSH_THRESHOLD - 1 unless flushes have been failing and kept their counts for the next one
+HONEST_VIEW_COUNT_FLUSH_THRESHOLD = 100
+HONEST_VIEW_COUNT_FLUSH_INTERVAL = 30  # seconds
+
+# longest the home page's top categories and areas can lag behind the database
+HONEST_HOME_PAGE_CACHE_TIMEOUT = 60  # seconds
+
+# longest a worker's in-memory copy of category and area view counts can lag behind the database, see
+# honest/taxonomy.py. names and slugs are reloaded as soon as they change
+HONEST_SLUG_CACHE_MAX_AGE = 30  # seconds
+
+# anonymous category, area and person pages are cached whole for this long, or until what they show changes
+HONEST_PAGE_CACHE_TIMEOUT = 300  # seconds
+
+# every worker process writes its request metrics here for /metrics to add up, see honest/metrics.py.
+# it must be shared by all the workers of one server and not by other servers
+HONEST_METRICS_DIR = os.path.join(tempfile.gettempdir(), 'honest-metrics')
+HONEST_METRICS_FLUSH_INTERVAL = 5  # seconds
+# /metrics is served to staff, and to scrapers sending this as a bearer token. unset, only staff can read it
+HONEST_METRICS_TOKEN = os.environ.get('HONEST_METRICS_TOKEN')
+
+# posts to these url names are admitted at most `concurrency` at a time over all the workers of a server, and per
+# client address at `rate` a second with bursts of up to `burst`, see honest/admission.py. the counts are shared
+# through HONEST_ADMISSION_FILE, which like HONEST_METRICS_DIR belongs to the workers of one server only
+HONEST_ADMISSION_LIMITS = {
+    'honest:person': {'concurrency': 4, 'rate': 1 / 10, 'burst': 5},
+    'honest:add_person': {'concurrency': 2, 'rate': 1 / 30, 'burst': 5},
+    'honest:add_category': {'concurrency': 2, 'rate': 1 / 60, 'burst': 3},
+    'honest:add_area': {'concurrency': 2, 'rate': 1 / 60, 'burst': 3},
+    'honest:register': {'concurrency': 2, 'rate': 1 / 60, 'burst': 3},
+}
+HONEST_ADMISSION_FILE = os.path.join(tempfile.gettempdir(), 'honest-admission')
+# proxies in front of the app appending the client's address to X-Forwarded-For, heroku's router is one
+HONEST_TRUSTED_PROXIES = 1 if 'DYNO' in os.environ else 0
+
 # settings for heroku
 django_heroku.settings(locals())
+
+# collectstatic fingerprints, compresses and minifies static files and makes webp and resized copies of images,
+# see honest/storage.py. this replaces the storage django_heroku sets, so it has to come after it
+STATICFILES_STORAGE = 'honest.storage.OptimizedStaticFilesStorage'
+# tests don't run collectstatic, their runner switches them to the plain storage, see honest/test_runner.py
+TEST_RUNNER = 'honest.test_runner.HonestTestRunner'
+# widths in pixels of the copies made of each image narrower than it
+HONEST_IMAGE_WIDTHS = [320, 640, 1280]
+
+# read replicas as a comma separated list of database urls, GET requests read from one of them and everything else
+# uses the primary, see honest/routers.py. locally a copy of db.sqlite3 works as a replica:
+#   sqlite3 db.sqlite3 ".backup replica.sqlite3" && DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3 ...
+HONEST_DATABASE_REPLICAS = []
+for number, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+    alias = 'replica{0}'.format(number + 1)
+    DATABASES[alias] = dj_database_url.parse(url.strip(), conn_max_age=600)
+    # tests run against the primary's test database only
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    HONEST_DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['honest.routers.PrimaryReplicaRouter']
+# how long a user who wrote something reads from the primary, it should be longer than replication ever lags
+HONEST_REPLICA_PIN_SECONDS = 10
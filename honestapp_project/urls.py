@@ -15,11 +15,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from honest import views
+from honest import metrics, views
 
 urlpatterns = [
     path('', views.index, name='home'), # added to redirect empty path to homepage
     path('honest/', include('honest.urls')),
     path('accounts/', include('registration.backends.simple.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', metrics.metrics, name='metrics'),
 ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "honestapp_project.settings")
 
 application = get_wsgi_application()
+
+# build the in-memory autocomplete indexes and slug lookups as the worker starts
+from honest import autocomplete, taxonomy  # noqa: E402
+autocomplete.warm()
+taxonomy.warm()